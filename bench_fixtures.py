@@ -0,0 +1,394 @@
+"""
+Offline fixture store and local HTTP stand-in for benchmarks.
+FixtureStore holds recorded responses (collection pages, product pages, products.json, images)
+keyed by host+path+query. FixtureServer serves them on 127.0.0.1 with configurable latency and
+error injection, rewriting recorded absolute URLs so every request stays local.
+"""
+import hashlib
+import io
+import json
+import logging
+import os
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import TYPE_CHECKING, Dict, Iterable, Optional, Tuple
+from urllib.parse import urlsplit
+
+import requests
+
+if TYPE_CHECKING:
+    import numpy as np
+
+logger = logging.getLogger(__name__)
+
+NAV_COLLECTIONS = (
+    "shop-all", "t-shirts", "sweatshirts", "hoodies", "knitwear", "jackets", "trousers", "shorts",
+    "caps", "bags", "socks", "accessories", "sale",
+)
+# Synthetic product collections: (handle, title, expected canonical category)
+PRODUCT_COLLECTIONS = (
+    ("t-shirts", "T-Shirts", "clothes"), ("hoodies", "Hoodies", "clothes"), ("caps", "Caps", "accessories"),
+    ("bags", "Bags", "accessories"), ("knitwear", "Knitwear", "clothes"), ("sneakers", "Sneakers", "footwear"),
+)
+SITEMAP_NS = "http://www.sitemaps.org/schemas/sitemap/0.9"
+SYNTHETIC_LASTMOD = "2026-01-01T00:00:00Z"
+TEXT_TYPES = ("text/", "application/json", "application/xml", "application/javascript", "application/ld+json")
+
+
+def fixture_key(url: str) -> str:
+    """'https://host/path?q#frag' -> 'host/path?q' (scheme and fragment ignored)."""
+    parts = urlsplit(url if "://" in url else "https://" + url.lstrip("/"))
+    key = parts.netloc.lower() + (parts.path or "/")
+    return f"{key}?{parts.query}" if parts.query else key
+
+
+class FixtureStore:
+    """
+    Directory of recorded responses: index.json + bodies/<sha1 of key>. Optional labels.json holds
+    expected extraction results per key (e.g. {"category": "clothes"}) for accuracy checks.
+    """
+
+    def __init__(self, root: str):
+        self.root = root
+        self.index_path = os.path.join(root, "index.json")
+        self.labels_path = os.path.join(root, "labels.json")
+        self.index: Dict[str, Dict[str, object]] = {}
+        self.labels: Dict[str, Dict[str, object]] = {}
+        if os.path.exists(self.index_path):
+            with open(self.index_path, "r", encoding="utf-8") as f:
+                self.index = json.load(f)
+        if os.path.exists(self.labels_path):
+            with open(self.labels_path, "r", encoding="utf-8") as f:
+                self.labels = json.load(f)
+
+    def put(self, url: str, body: bytes, content_type: str, status: int = 200) -> str:
+        key = fixture_key(url)
+        name = hashlib.sha1(key.encode("utf-8")).hexdigest()
+        os.makedirs(os.path.join(self.root, "bodies"), exist_ok=True)
+        with open(os.path.join(self.root, "bodies", name), "wb") as f:
+            f.write(body)
+        self.index[key] = {"file": name, "content_type": content_type, "status": status}
+        return key
+
+    def get(self, key: str) -> Optional[Tuple[int, str, bytes]]:
+        entry = self.index.get(key)
+        if entry is None:
+            return None
+        with open(os.path.join(self.root, "bodies", str(entry["file"])), "rb") as f:
+            body = f.read()
+        return int(entry.get("status", 200)), str(entry["content_type"]), body
+
+    def label(self, url: str, **expected) -> None:
+        self.labels.setdefault(fixture_key(url), {}).update(expected)
+
+    def hosts(self) -> Iterable[str]:
+        return sorted({k.split("/", 1)[0] for k in self.index})
+
+    def save(self) -> None:
+        os.makedirs(self.root, exist_ok=True)
+        tmp = self.index_path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, indent=1, sort_keys=True)
+        os.replace(tmp, self.index_path)
+        if self.labels:
+            with open(self.labels_path, "w", encoding="utf-8") as f:
+                json.dump(self.labels, f, indent=1, sort_keys=True)
+
+
+def record_live(store: FixtureStore, base_url: str, collection_url: str, max_pages: int = 3,
+                max_products: int = 50, with_images: bool = True, delay: float = 0.5) -> Dict[str, int]:
+    """Record a corpus from the live store (needs network). Returns counts per kind."""
+    import re
+    from bs4 import BeautifulSoup
+    from config import HEADERS
+    from utils import extract_shopify_product_json, get_all_product_image_urls
+
+    session = requests.Session()
+    session.headers.update(HEADERS)
+    counts = {"collection_pages": 0, "product_pages": 0, "products_json": 0, "sitemaps": 0, "images": 0}
+
+    def fetch(url: str) -> Optional[requests.Response]:
+        try:
+            r = session.get(url, timeout=30)
+        except Exception as e:
+            logger.warning(f"Record failed for {url}: {e}")
+            return None
+        store.put(url, r.content, r.headers.get("Content-Type", "application/octet-stream"), r.status_code)
+        time.sleep(delay)
+        return r
+
+    product_urls = []
+    for page in range(1, max_pages + 1):
+        url = f"{collection_url}?page={page}" if page > 1 else collection_url
+        r = fetch(url)
+        if r is None or r.status_code != 200:
+            break
+        counts["collection_pages"] += 1
+        soup = BeautifulSoup(r.text, "lxml")
+        for a in soup.find_all("a", href=re.compile(r"/products/")):
+            href = (a.get("href") or "").split("?")[0].split("#")[0]
+            full = base_url + href if href.startswith("/") else href
+            if full not in product_urls:
+                product_urls.append(full)
+
+    handle = collection_url.rstrip("/").rsplit("/", 1)[-1]
+    r = fetch(f"{base_url}/collections/{handle}/products.json?page=1")
+    if r is not None and r.status_code == 200:
+        counts["products_json"] += 1
+
+    from sitemap import is_product_sitemap, parse_sitemap
+    r = fetch(f"{base_url}/sitemap.xml")
+    if r is not None and r.status_code == 200:
+        counts["sitemaps"] += 1
+        for kind, loc, _ in parse_sitemap(io.BytesIO(r.content)):
+            if kind == "sitemap" and is_product_sitemap(loc) and fetch(loc) is not None:
+                counts["sitemaps"] += 1
+
+    for url in product_urls[:max_products]:
+        r = fetch(url)
+        if r is None or r.status_code != 200:
+            continue
+        counts["product_pages"] += 1
+        if with_images:
+            soup = BeautifulSoup(r.text, "lxml")
+            for img in get_all_product_image_urls(soup, base_url, extract_shopify_product_json(soup))[:3]:
+                if fetch(img) is not None:
+                    counts["images"] += 1
+    store.save()
+    return counts
+
+
+def _synthetic_image(seed: int) -> bytes:
+    """A product-photo-sized JPEG whose pixels depend only on `seed`."""
+    from PIL import Image
+    buf = io.BytesIO()
+    color = (80 + seed * 37 % 160, 40 + seed * 53 % 180, 40 + seed * 71 % 200)
+    Image.new("RGB", (1200, 1500), color=color).save(buf, format="JPEG", quality=85)
+    return buf.getvalue()
+
+
+def build_synthetic_store(store: FixtureStore, host: str, n_products: int = 100,
+                          per_page: int = 24, with_images: bool = True) -> None:
+    """
+    Generate a Shopify-like corpus (no network): shop-all pages, product pages with JSON-LD, images,
+    and a sitemap index with one product sitemap (every product at SYNTHETIC_LASTMOD).
+    Each product belongs to one of PRODUCT_COLLECTIONS, shown (in rotation) as a breadcrumb, a JSON-LD
+    BreadcrumbList or a product-section link, and is labelled with that collection's category.
+    Colourways share photos: in every group of 4 products the second is a re-upload of the first
+    (own file name, same bytes) and the fourth reuses the third's image URL. Each product also has
+    its own back view as a second gallery image.
+    """
+    pages = max(1, -(-n_products // per_page))
+    nav = "".join(f'<a href="/collections/{c}">{c.title()}</a>' for c in NAV_COLLECTIONS)
+
+    for page in range(1, pages + 1):
+        # Product cards link twice, like most themes: collection-scoped title link and plain image link
+        links = "".join(
+            f'<a href="/collections/shop-all/products/item-{i}?variant={i * 10}">Item {i}</a>'
+            f'<a href="/products/item-{i}"><img src="/cdn/shop/files/item-{i}.jpg?v=1&width=360" alt=""></a>'
+            for i in range((page - 1) * per_page, min(page * per_page, n_products))
+        )
+        nxt = '<a href="?page={0}">Next</a>'.format(page + 1) if page < pages else ""
+        html = f"<html><body><header><nav>{nav}</nav></header>{links}{nxt}<footer>{nav}</footer></body></html>"
+        url = f"https://{host}/collections/shop-all" + (f"?page={page}" if page > 1 else "")
+        store.put(url, html.encode("utf-8"), "text/html; charset=utf-8")
+
+    # Theme/app bundles: real product pages carry dozens of inline scripts mentioning price/variant
+    theme_scripts = "".join(
+        f"<script>window.app{k} = {{config: {{money_format: '${{{{amount}}}}', variant_selector: true}}, "
+        f"render: function(v) {{ return v.price + ' ' + v.available; }}, pad: '{'x' * 1500}'}};</script>"
+        for k in range(25)
+    )
+    for i in range(n_products):
+        # Stored under the canonical URL; pages reference it with resize/version params like a theme does
+        image_owner = i - 1 if i % 4 == 3 else i
+        img_file = f"https://{host}/cdn/shop/files/item-{image_owner}.jpg"
+        img = img_file + "?v=1"
+        back_file = f"https://{host}/cdn/shop/files/item-{i}-back.jpg"  # second gallery view
+        back = back_file + "?v=1"
+        cents = (40 + i % 30) * 100
+        ld = json.dumps({
+            "@type": "Product", "name": f"Item {i}", "description": f"Synthetic product {i}",
+            "image": [img], "offers": [{"price": f"{cents // 100}.00", "priceCurrency": "USD"}],
+        })
+        variants = [
+            {"id": i * 10 + s, "title": size, "option1": size, "public_title": size, "sku": f"AB-{i}-{size}",
+             "price": cents, "available": s != 2}
+            for s, size in enumerate(("S", "M", "L", "XL"))
+        ]
+        product_json = json.dumps({
+            "id": i, "title": f"Item {i}", "handle": f"item-{i}", "options": ["Size"],
+            "variants": variants, "images": ["//" + u.split("://", 1)[1] for u in (img, back)],
+            "media": [
+                {"media_type": "image", "position": n + 1, "src": "//" + u.split("://", 1)[1]}
+                for n, u in enumerate((img, back))
+            ], "description": "<p>" + "Washed cotton. " * 40 + "</p>",
+        })
+        handle, coll_title, category = PRODUCT_COLLECTIONS[i % len(PRODUCT_COLLECTIONS)]
+        crumb_ld = placement = ""
+        if i % 3 == 0:
+            placement = (f'<nav class="breadcrumb" aria-label="Breadcrumb"><a href="/">Home</a> / '
+                         f'<a href="/collections/{handle}">{coll_title}</a> / <span>Item {i}</span></nav>')
+        elif i % 3 == 1:
+            crumb_ld = '<script type="application/ld+json">{}</script>'.format(json.dumps({
+                "@type": "BreadcrumbList", "itemListElement": [
+                    {"@type": "ListItem", "position": n + 1, "name": name}
+                    for n, name in enumerate(("Home", coll_title, f"Item {i}"))
+                ],
+            }))
+        else:
+            placement = f'<div class="product-meta"><a href="/collections/{handle}-essentials">{coll_title} Essentials</a></div>'
+        meta = json.dumps({"product": {"id": i, "variants": [
+            {"id": v["id"], "price": v["price"], "public_title": v["public_title"], "sku": v["sku"]} for v in variants
+        ]}, "page": {"pageType": "product"}})
+        html = (
+            f'<html><head><script type="application/ld+json">{ld}</script>{crumb_ld}'
+            f'<script>Shopify.currency = {{"active":"USD","rate":"1.0"}};</script>'
+            f'<script>var meta = {meta};\nfor (var attr in meta) {{ window.ShopifyAnalytics.meta[attr] = meta[attr]; }}</script>'
+            f'{theme_scripts}</head><body><header><nav>{nav}</nav></header>'
+            f'<main>{placement}<h1 class="product-title">Item {i}</h1>'
+            f'<div class="product-description">Synthetic product {i} in washed cotton.</div>'
+            f'<span class="price">${cents // 100}.00</span>'
+            f'<img src="{img}&width=360" srcset="{img}&width=360 360w, {img}&width=1080 1080w" alt="Item {i} front">'
+            f'<img src="{back}&width=360" alt="Item {i} back">'
+            f'<form action="/cart/add"><select name="Size"><option value="S">S</option><option value="M">M</option></select>'
+            f'<button>Add to cart</button></form>'
+            f'<script type="application/json" id="ProductJson-product-template">{product_json}</script>'
+            f'</main><footer>{nav}</footer></body></html>'
+        )
+        store.put(f"https://{host}/products/item-{i}", html.encode("utf-8"), "text/html; charset=utf-8")
+        store.label(f"https://{host}/products/item-{i}", category=category)
+        if with_images and image_owner == i:
+            store.put(img_file, _synthetic_image(i - 1 if i % 4 == 1 else i), "image/jpeg")
+        if with_images:
+            store.put(back_file, _synthetic_image(1000 + i), "image/jpeg")
+    sitemap_path = f"/sitemap_products_1.xml?from=0&to={n_products - 1}"
+    urls = "".join(
+        f"<url><loc>https://{host}/products/item-{i}</loc><lastmod>{SYNTHETIC_LASTMOD}</lastmod>"
+        f"<changefreq>daily</changefreq></url>"
+        for i in range(n_products)
+    )
+    store.put(f"https://{host}/sitemap.xml", (
+        f'<?xml version="1.0" encoding="UTF-8"?><sitemapindex xmlns="{SITEMAP_NS}">'
+        f"<sitemap><loc>https://{host}{sitemap_path.replace('&', '&amp;')}</loc></sitemap>"
+        f"<sitemap><loc>https://{host}/sitemap_pages_1.xml</loc></sitemap></sitemapindex>"
+    ).encode("utf-8"), "application/xml")
+    store.put(f"https://{host}{sitemap_path}", (
+        f'<?xml version="1.0" encoding="UTF-8"?><urlset xmlns="{SITEMAP_NS}">'
+        f"<url><loc>https://{host}/</loc><changefreq>daily</changefreq></url>{urls}</urlset>"
+    ).encode("utf-8"), "application/xml")
+    store.save()
+
+
+def synthetic_embedding_queries(n_products: int = 5000, n_queries: int = 500, dim: int = 768,
+                                seed: int = 0) -> Tuple["np.ndarray", "np.ndarray", "np.ndarray"]:
+    """
+    A retrieval fixture without the model: (corpus, queries, relevant), L2-normalized float32.
+    Products cluster around 60 category centres, every fourth one is a near copy of the one before
+    (a colourway), and each query is a noisy view of product relevant[i]. Random vectors: good for
+    exercising the precision benchmark, not for judging retrieval quality on real embeddings.
+    """
+    import numpy as np
+    rng = np.random.default_rng(seed)
+    centres = rng.standard_normal((60, dim)).astype(np.float32)
+    corpus = centres[rng.integers(0, 60, n_products)] + 0.6 * rng.standard_normal((n_products, dim)).astype(np.float32)
+    copies = corpus[2::4][: len(corpus[3::4])]
+    corpus[3::4] = copies + 0.05 * rng.standard_normal(copies.shape).astype(np.float32)
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    relevant = rng.integers(0, n_products, n_queries)
+    queries = corpus[relevant] + 0.05 * rng.standard_normal((n_queries, dim)).astype(np.float32)
+    queries /= np.linalg.norm(queries, axis=1, keepdims=True)
+    return corpus, queries, relevant
+
+
+class FixtureServer:
+    """
+    Serve a FixtureStore on 127.0.0.1. `primary_host` maps to "/", other recorded hosts to
+    "/_h/<host>/...". Injects latency (mean +- jitter, ms) and HTTP 503s at `error_rate`.
+    """
+
+    def __init__(self, store: FixtureStore, primary_host: str, latency_ms: float = 0.0,
+                 jitter_ms: float = 0.0, error_rate: float = 0.0, seed: int = 0, port: int = 0):
+        self.store = store
+        self.primary_host = primary_host.lower()
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._rng = random.Random(seed)
+        self._rng_lock = threading.Lock()
+        self.stats = {"requests": 0, "served": 0, "missing": 0, "injected_errors": 0, "bytes": 0}
+        self._httpd = ThreadingHTTPServer(("127.0.0.1", port), self._handler())
+        self._thread: Optional[threading.Thread] = None
+
+    @property
+    def origin(self) -> str:
+        return f"http://127.0.0.1:{self._httpd.server_address[1]}"
+
+    def _rewrite(self, body: bytes) -> bytes:
+        for host in self.store.hosts():
+            target = self.origin if host == self.primary_host else f"{self.origin}/_h/{host}"
+            for prefix in (f"https://{host}", f"http://{host}", f"//{host}"):
+                body = body.replace(prefix.encode("utf-8"), target.encode("utf-8"))
+        return body
+
+    def _handler(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                path = self.path
+                host = server.primary_host
+                if path.startswith("/_h/"):
+                    host, _, rest = path[4:].partition("/")
+                    path = "/" + rest
+                with server._rng_lock:
+                    server.stats["requests"] += 1
+                    fail = server._rng.random() < server.error_rate
+                    delay = max(0.0, server.latency_ms + server._rng.uniform(-server.jitter_ms, server.jitter_ms))
+                if delay:
+                    time.sleep(delay / 1000.0)
+                if fail:
+                    server.stats["injected_errors"] += 1
+                    self.send_error(503, "Injected error")
+                    return
+                hit = server.store.get(host.lower() + path)
+                if hit is None and "?" in path:
+                    # Like the Shopify CDN: resize/version params don't change which file is served
+                    hit = server.store.get(host.lower() + path.split("?", 1)[0])
+                if hit is None:
+                    server.stats["missing"] += 1
+                    self.send_error(404, "Not recorded")
+                    return
+                status, content_type, body = hit
+                if content_type.startswith(TEXT_TYPES):
+                    body = server._rewrite(body)
+                server.stats["served"] += 1
+                server.stats["bytes"] += len(body)
+                self.send_response(status)
+                self.send_header("Content-Type", content_type)
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def start(self) -> str:
+        self._thread = threading.Thread(target=self._httpd.serve_forever, daemon=True)
+        self._thread.start()
+        return self.origin
+
+    def stop(self) -> None:
+        self._httpd.shutdown()
+        self._httpd.server_close()
+
+    def __enter__(self) -> "FixtureServer":
+        self.start()
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
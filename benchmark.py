@@ -0,0 +1,527 @@
+#!/usr/bin/env python3
+"""
+Offline benchmark over recorded (or synthetic) product pages and images.
+Serves a fixture corpus from a local HTTP server with configurable latency/errors,
+runs discovery -> scrape -> sync (cold, then steady state) against a throwaway SQLite store,
+and writes per-phase and per-stage timings to bench_results/<timestamp>_<commit>.json.
+
+  python benchmark.py record --fixtures fixtures/aboutblank      # needs network, once
+  python benchmark.py synth --fixtures fixtures/synthetic --products 200
+  python benchmark.py run --fixtures fixtures/synthetic --latency-ms 40 --no-embed
+  python benchmark.py compare bench_results/a.json bench_results/b.json --fail-above 10
+  python benchmark.py extract --fixtures fixtures/aboutblank --repeat 20   # per-page extractor microbenchmark
+  python benchmark.py preprocess --fixtures fixtures/synthetic --batch 8    # per-image preprocessing time
+  python benchmark.py precision --db products.sqlite3                       # half-precision vectors: size, retrieval
+"""
+
+import argparse
+import asyncio
+import json
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+PRIMARY_HOST = "about---blank.com"
+DEFAULT_FIXTURES = os.path.join("fixtures", "synthetic")
+DEFAULT_RESULTS = "bench_results"
+
+
+def _git_commit() -> str:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+            capture_output=True, text=True, timeout=10,
+        )
+        return out.stdout.strip() or "unknown"
+    except Exception:
+        return "unknown"
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def cmd_record(args) -> int:
+    from bench_fixtures import FixtureStore, record_live
+    from config import BASE_URL, SHOP_ALL_URL
+
+    store = FixtureStore(args.fixtures)
+    counts = record_live(
+        store, BASE_URL, SHOP_ALL_URL,
+        max_pages=args.pages, max_products=args.products, with_images=not args.no_images,
+    )
+    logger.info(f"Recorded {counts} into {args.fixtures}")
+    return 0
+
+
+def cmd_synth(args) -> int:
+    from bench_fixtures import FixtureStore, build_synthetic_store
+
+    store = FixtureStore(args.fixtures)
+    build_synthetic_store(store, PRIMARY_HOST, n_products=args.products, with_images=not args.no_images)
+    logger.info(f"Wrote {len(store.index)} synthetic fixtures to {args.fixtures}")
+    return 0
+
+
+async def _run_phases(embeddings: bool, db_path: str) -> Dict[str, Any]:
+    # Imported here: config reads SCRAPER_BASE_URL etc. at import time (set by cmd_run)
+    from local_db import SQLiteManager
+    from scraper import AboutBlankScraper
+
+    scraper = AboutBlankScraper(db_manager=SQLiteManager(db_path), embeddings=embeddings)
+    phases: Dict[str, float] = {}
+    counts: Dict[str, Any] = {}
+
+    t0 = time.perf_counter()
+    urls = await scraper.discover_product_urls()
+    phases["discover"] = time.perf_counter() - t0
+    counts["discovered"] = len(urls)
+
+    t0 = time.perf_counter()
+    products = await scraper.scrape_all_products(urls)
+    phases["scrape"] = time.perf_counter() - t0
+    counts["scraped"] = len(products)
+
+    t0 = time.perf_counter()
+    counts["sync_cold"] = await scraper.sync_products_to_db(products)
+    phases["sync_cold"] = time.perf_counter() - t0
+
+    # Discovery again after a sync: an incremental run yields only products changed since their last fetch
+    t0 = time.perf_counter()
+    counts["discovered_warm"] = len(await scraper.discover_product_urls())
+    phases["discover_warm"] = time.perf_counter() - t0
+
+    # Steady state: same catalogue again, everything should be skipped (by content hash, no diff read)
+    t0 = time.perf_counter()
+    counts["sync_warm"] = await scraper.sync_products_to_db(products)
+    phases["sync_warm"] = time.perf_counter() - t0
+    return {"phases": {k: round(v, 4) for k, v in phases.items()}, "counts": counts}
+
+
+def cmd_run(args) -> int:
+    fixtures = os.path.abspath(args.fixtures)
+    out_dir = os.path.abspath(args.out)
+    if not os.path.exists(os.path.join(fixtures, "index.json")):
+        logger.error(f"No fixtures at {fixtures}; run `benchmark.py synth` or `benchmark.py record` first")
+        return 1
+
+    from bench_fixtures import FixtureServer, FixtureStore
+
+    port = _free_port()
+    os.environ["SCRAPER_BASE_URL"] = f"http://127.0.0.1:{port}"
+    os.environ["REQUESTS_PER_SECOND"] = str(args.rps)
+    os.environ["EMBEDDING_DELAY"] = "0"
+    os.environ["EXPORT_DIR"] = ""
+    # The warm discovery phase measures lastmod-driven admission: incremental runs over the sitemap
+    os.environ.setdefault("DISCOVERY_MODE", "sitemap")
+    os.environ.setdefault("RUN_MODE", "incremental")
+
+    server = FixtureServer(
+        FixtureStore(fixtures), PRIMARY_HOST, latency_ms=args.latency_ms,
+        jitter_ms=args.jitter_ms, error_rate=args.error_rate, seed=args.seed, port=port,
+    )
+    workdir = tempfile.mkdtemp(prefix="bench_")
+    cwd = os.getcwd()
+    started = time.perf_counter()
+    with server:
+        # Stale/journal state files land in the scratch dir, never next to production state
+        os.chdir(workdir)
+        try:
+            outcome = asyncio.run(_run_phases(not args.no_embed, os.path.join(workdir, "products.sqlite3")))
+        finally:
+            os.chdir(cwd)
+    wall = time.perf_counter() - started
+
+    from metrics import get_metrics
+
+    commit = _git_commit()
+    result = {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": sys.version.split()[0],
+        "params": {
+            "fixtures": fixtures,
+            "latency_ms": args.latency_ms,
+            "jitter_ms": args.jitter_ms,
+            "error_rate": args.error_rate,
+            "seed": args.seed,
+            "rps": args.rps,
+            "embeddings": not args.no_embed,
+        },
+        "wall_seconds": round(wall, 4),
+        **outcome,
+        "server": dict(server.stats),
+        "stages": get_metrics().report()["stages"],
+    }
+    os.makedirs(out_dir, exist_ok=True)
+    stamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(out_dir, f"{stamp}_{commit}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, indent=2, default=str)
+
+    print(f"\nBenchmark ({commit}) -> {path}")
+    for name, seconds in result["phases"].items():
+        print(f"  {name:<14} {seconds:>9.3f}s")
+    print(f"  {'total':<14} {wall:>9.3f}s  (server: {server.stats})")
+    return 0
+
+
+def _page_extractors(base_url: str, nav_handles=frozenset()):
+    """name -> fn(soup, product_json) for the per-page extractors, in scrape_product order."""
+    import utils
+
+    return {
+        "prices": utils.extract_prices_with_currencies,
+        "images": lambda soup, pj: utils.get_all_product_image_urls(soup, base_url, pj),
+        "sizes": utils.extract_sizes,
+        "categories": lambda soup, pj: utils.extract_categories_from_page(soup, base_url),
+        "categories_scoped": lambda soup, pj: utils.extract_categories_from_page(
+            soup, base_url, scoped=True, nav_handles=nav_handles,
+        ),
+        "stock": utils.is_in_stock,
+    }
+
+
+def cmd_extract(args) -> int:
+    from statistics import mean
+
+    from bs4 import BeautifulSoup
+
+    from bench_fixtures import FixtureStore
+    from metrics import _percentile
+
+    store = FixtureStore(os.path.abspath(args.fixtures))
+    keys = sorted(k for k in store.index if "/products/" in k and not k.endswith((".js", ".json")))[: args.pages]
+    if not keys:
+        logger.error(f"No product pages in {args.fixtures}")
+        return 1
+    from utils import CollectionNavIndex, extract_shopify_product_json
+
+    nav_index = CollectionNavIndex()
+    for key in store.index:
+        if "/collections/" in key and store.index[key]["content_type"].startswith("text/html"):
+            nav_index.add_page(BeautifulSoup(store.get(key)[2], "lxml"))
+    extractors = _page_extractors(f"https://{PRIMARY_HOST}", nav_index.handles)
+    results: Dict[str, Dict[str, object]] = {}
+    timings: Dict[str, list] = {"parse": [], "product_json": []}
+    timings.update({name: [] for name in extractors})
+    for key in keys:
+        html = store.get(key)[2].decode("utf-8", "replace")
+        best = min(_time_call(lambda: BeautifulSoup(html, "lxml")) for _ in range(max(1, args.repeat // 5)))
+        timings["parse"].append(best)
+        soup = BeautifulSoup(html, "lxml")
+        timings["product_json"].append(min(_time_call(lambda: extract_shopify_product_json(soup)) for _ in range(args.repeat)))
+        product_json = extract_shopify_product_json(soup)
+        for name, fn in extractors.items():
+            timings[name].append(min(_time_call(lambda: fn(soup, product_json)) for _ in range(args.repeat)))
+        results[key] = {name: fn(soup, product_json) for name, fn in extractors.items() if name.startswith("categories")}
+
+    print(f"{len(keys)} pages, best of {args.repeat} runs per page (microseconds)")
+    print(f"{'extractor':<16}{'mean':>10}{'p50':>10}{'p95':>10}")
+    summary = {}
+    for name, values in timings.items():
+        ordered = sorted(values)
+        summary[name] = {
+            "mean_us": round(mean(values) * 1e6, 1),
+            "p50_us": round(_percentile(ordered, 50) * 1e6, 1),
+            "p95_us": round(_percentile(ordered, 95) * 1e6, 1),
+        }
+        print(f"{name:<16}{summary[name]['mean_us']:>10.1f}{summary[name]['p50_us']:>10.1f}{summary[name]['p95_us']:>10.1f}")
+    accuracy = _category_accuracy(store, results)
+    if accuracy:
+        labelled = sum(1 for key in keys if "category" in store.labels.get(key, {}))
+        print(f"\nCategory accuracy on {labelled} labelled pages (nav handles learned from "
+              f"{nav_index.pages} collection pages: {len(nav_index.handles)})")
+        for name, acc in accuracy.items():
+            print(f"  {name:<18} exact {acc['exact']:.1%}  precision {acc['precision']:.1%}  recall {acc['recall']:.1%}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "pages": len(keys), "extractors": summary,
+                       "category_accuracy": accuracy}, f, indent=2)
+    return 0
+
+
+def _processor_preprocess():
+    """
+    The embedder's processor path (IMAGE_PREPROCESS=processor) as datas -> float32 NCHW batch:
+    full decode, LANCZOS to 384, then the SigLIP image processor. Without transformers installed,
+    preprocess.processor_reference stands in.
+    """
+    import io
+
+    from PIL import Image
+
+    from preprocess import SIGLIP_SIZE, processor_reference
+
+    def decode(data):
+        with Image.open(io.BytesIO(data)) as image:
+            return image.convert("RGB").resize((SIGLIP_SIZE, SIGLIP_SIZE), Image.Resampling.LANCZOS)
+
+    try:
+        from transformers import AutoImageProcessor
+
+        from config import EMBEDDING_MODEL
+        processor = AutoImageProcessor.from_pretrained(EMBEDDING_MODEL)
+        return "transformers", lambda datas: processor([decode(d) for d in datas], return_tensors="np")["pixel_values"]
+    except Exception as e:
+        logger.info(f"Image processor unavailable ({e}); timing the NumPy reference instead")
+    return "numpy reference", processor_reference
+
+
+def cmd_preprocess(args) -> int:
+    from statistics import mean
+
+    import numpy as np
+
+    from bench_fixtures import FixtureStore
+    from metrics import _percentile
+    from preprocess import ImageBatchPreprocessor
+
+    store = FixtureStore(os.path.abspath(args.fixtures))
+    keys = sorted(k for k, v in store.index.items() if v["content_type"].startswith("image/"))[: args.images]
+    if not keys:
+        logger.error(f"No images in {args.fixtures}")
+        return 1
+    datas = [store.get(k)[2] for k in keys]
+    batches = [datas[i:i + args.batch] for i in range(0, len(datas), args.batch)]
+    fast = ImageBatchPreprocessor()
+    processor_name, processor = _processor_preprocess()
+    paths = {"fast": lambda batch: fast(batch)[0], "processor": processor}
+
+    timings: Dict[str, list] = {name: [] for name in paths}
+    diffs = []
+    for batch in batches:
+        for name, fn in paths.items():
+            best = min(_time_call(lambda: fn(batch)) for _ in range(args.repeat))
+            timings[name].extend([best / len(batch)] * len(batch))
+        diffs.append(float(np.abs(fast(batch)[0] - processor(batch)).max()))
+
+    print(f"{len(datas)} images in batches of {args.batch}, best of {args.repeat} runs per batch "
+          f"(milliseconds per image; processor path: {processor_name})")
+    print(f"{'path':<12}{'mean':>10}{'p50':>10}{'p95':>10}")
+    summary = {}
+    for name, values in timings.items():
+        ordered = sorted(values)
+        summary[name] = {
+            "mean_ms": round(mean(values) * 1e3, 3),
+            "p50_ms": round(_percentile(ordered, 50) * 1e3, 3),
+            "p95_ms": round(_percentile(ordered, 95) * 1e3, 3),
+        }
+        print(f"{name:<12}{summary[name]['mean_ms']:>10.3f}{summary[name]['p50_ms']:>10.3f}{summary[name]['p95_ms']:>10.3f}")
+    speedup = summary["processor"]["mean_ms"] / max(summary["fast"]["mean_ms"], 1e-9)
+    print(f"\nfast path {speedup:.1f}x; max abs pixel difference vs processor path {max(diffs):.4f} (normalized units)")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "images": len(datas), "batch": args.batch,
+                       "processor": processor_name, "paths": summary, "speedup": round(speedup, 2),
+                       "max_abs_diff": round(max(diffs), 4)}, f, indent=2)
+    return 0
+
+
+def _precision_query_set(db_path: Optional[str]):
+    """(corpus, queries, relevant, name): a local store's image vectors queried by each row's info
+    vector (text-to-image search), or the synthetic fixture set."""
+    import numpy as np
+
+    if not db_path:
+        from bench_fixtures import synthetic_embedding_queries
+        return (*synthetic_embedding_queries(), "synthetic fixture set")
+    from state_store import connect_sqlite
+    from vector_codec import as_vector, blob_to_vector
+
+    conn = connect_sqlite(db_path)
+    rows = conn.execute("SELECT image_embedding, info_embedding FROM products"
+                        " WHERE image_embedding IS NOT NULL AND info_embedding IS NOT NULL").fetchall()
+    conn.close()
+    corpus = np.stack([as_vector(blob_to_vector(r[0])) for r in rows]) if rows else np.zeros((0, 0), np.float32)
+    queries = np.stack([as_vector(blob_to_vector(r[1])) for r in rows]) if rows else corpus
+    return corpus, queries, np.arange(len(rows)), f"{db_path} (info -> image)"
+
+
+def cmd_precision(args) -> int:
+    import numpy as np
+
+    from vector_codec import round_trip, vector_text
+
+    corpus, queries, relevant, name = _precision_query_set(args.db)
+    if len(corpus) <= args.k:
+        logger.error(f"Need more than {args.k} vectors, got {len(corpus)}")
+        return 1
+    top_k = lambda c, q: np.argsort(-(q @ c.T), axis=1)[:, : args.k]
+    reference = top_k(corpus, queries)
+    sample = corpus[:100]
+    print(f"{name}: {len(corpus)} vectors x {corpus.shape[1]} dims, {len(queries)} queries, k={args.k}")
+    if not args.db:
+        print("  (random vectors: recall here is no evidence of retrieval quality; use --db with stored embeddings)")
+    print(f"{'precision':<10}{'recall@k':>10}{'top-k vs f32':>14}{'blob B':>9}{'JSON B':>9}{'memory B':>10}")
+    summary = {}
+    for precision in ("float32", "float16", "bfloat16"):
+        got = top_k(round_trip(corpus, precision), round_trip(queries, precision))
+        if precision == "float32":
+            text = [json.dumps(v.tolist()) for v in sample]  # a list of Python floats, as upserted today
+            memory = sys.getsizeof(sample[0].tolist()) + 24 * sample.shape[1]
+            blob = 4 * corpus.shape[1]
+        else:
+            text = [vector_text(round_trip(v, precision), precision) for v in sample]
+            memory = sys.getsizeof(sample[0].astype(np.float16))
+            blob = 2 * corpus.shape[1] + 1
+        summary[precision] = {
+            "recall_at_k": round(float(np.mean([r in row for r, row in zip(relevant, got)])), 4),
+            "topk_overlap": round(float(np.mean([len(set(a) & set(b)) for a, b in zip(reference, got)])) / args.k, 4),
+            "blob_bytes": blob,
+            "json_bytes": round(float(np.mean([len(t) for t in text]))),
+            "memory_bytes": memory,
+        }
+        row = summary[precision]
+        print(f"{precision:<10}{row['recall_at_k']:>10.4f}{row['topk_overlap']:>14.4f}{row['blob_bytes']:>9}"
+              f"{row['json_bytes']:>9}{row['memory_bytes']:>10}")
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump({"commit": _git_commit(), "query_set": name, "k": args.k, "precisions": summary}, f, indent=2)
+    return 0
+
+
+def _category_accuracy(store, results: Dict[str, Dict[str, object]]) -> Dict[str, Dict[str, float]]:
+    """Exact-match rate and label-level precision/recall of each category extractor vs labels.json."""
+    accuracy = {}
+    labelled = {k: store.labels[k]["category"] for k in results if "category" in store.labels.get(k, {})}
+    if not labelled:
+        return accuracy
+    split = lambda value: {p.strip() for p in (value or "").split(",") if p.strip()}
+    for name in next(iter(results.values())):
+        exact = hits = predicted = expected = 0
+        for key, label in labelled.items():
+            got, want = split(results[key][name]), split(label)
+            exact += got == want
+            hits += len(got & want)
+            predicted += len(got)
+            expected += len(want)
+        accuracy[name] = {
+            "exact": exact / len(labelled),
+            "precision": hits / predicted if predicted else 0.0,
+            "recall": hits / expected if expected else 0.0,
+        }
+    return accuracy
+
+
+def _time_call(fn) -> float:
+    t0 = time.perf_counter()
+    fn()
+    return time.perf_counter() - t0
+
+
+def _pct(old: float, new: float) -> float:
+    return (new - old) / old * 100.0 if old else 0.0
+
+
+def cmd_compare(args) -> int:
+    with open(args.baseline, "r", encoding="utf-8") as f:
+        base = json.load(f)
+    with open(args.candidate, "r", encoding="utf-8") as f:
+        cand = json.load(f)
+
+    print(f"{base.get('commit')} -> {cand.get('commit')}")
+    print(f"{'phase':<28}{'base s':>10}{'cand s':>10}{'delta':>9}")
+    regressions = []
+    for name, old in base.get("phases", {}).items():
+        new = cand.get("phases", {}).get(name)
+        if new is None:
+            continue
+        delta = _pct(old, new)
+        print(f"{name:<28}{old:>10.3f}{new:>10.3f}{delta:>+8.1f}%")
+        if args.fail_above is not None and delta > args.fail_above:
+            regressions.append(name)
+
+    print(f"\n{'stage (ms)':<28}{'p50 base':>10}{'p50 cand':>10}{'p95 base':>10}{'p95 cand':>10}{'p95 delta':>11}")
+    for name, old in sorted(base.get("stages", {}).items()):
+        new = cand.get("stages", {}).get(name)
+        if new is None:
+            continue
+        print(
+            f"{name[:27]:<28}{old['p50_seconds'] * 1000:>10.2f}{new['p50_seconds'] * 1000:>10.2f}"
+            f"{old['p95_seconds'] * 1000:>10.2f}{new['p95_seconds'] * 1000:>10.2f}"
+            f"{_pct(old['p95_seconds'], new['p95_seconds']):>+10.1f}%"
+        )
+
+    if regressions:
+        print(f"\nRegressed by more than {args.fail_above}%: {', '.join(regressions)}")
+        return 1
+    return 0
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Offline scraper benchmark")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("record", help="Record a fixture corpus from the live store (needs network)")
+    p.add_argument("--fixtures", default=os.path.join("fixtures", "aboutblank"))
+    p.add_argument("--pages", type=int, default=3)
+    p.add_argument("--products", type=int, default=50)
+    p.add_argument("--no-images", action="store_true")
+    p.set_defaults(func=cmd_record)
+
+    p = sub.add_parser("synth", help="Generate a synthetic Shopify-like corpus")
+    p.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    p.add_argument("--products", type=int, default=100)
+    p.add_argument("--no-images", action="store_true")
+    p.set_defaults(func=cmd_synth)
+
+    p = sub.add_parser("run", help="Run the scraper against the fixture server")
+    p.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    p.add_argument("--latency-ms", type=float, default=0.0)
+    p.add_argument("--jitter-ms", type=float, default=0.0)
+    p.add_argument("--error-rate", type=float, default=0.0)
+    p.add_argument("--seed", type=int, default=0)
+    p.add_argument("--rps", type=float, default=1000.0, help="Scraper rate limit (default: effectively off)")
+    p.add_argument("--no-embed", action="store_true", help="Skip SigLIP (measure scrape/sync only)")
+    p.add_argument("--out", default=DEFAULT_RESULTS)
+    p.set_defaults(func=cmd_run)
+
+    p = sub.add_parser("extract", help="Per-page extractor microbenchmark over fixture product pages")
+    p.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    p.add_argument("--pages", type=int, default=50)
+    p.add_argument("--repeat", type=int, default=10)
+    p.add_argument("--out", default=None, help="Optional JSON output path")
+    p.set_defaults(func=cmd_extract)
+
+    p = sub.add_parser("preprocess", help="Per-image preprocessing time: fast path vs image processor path")
+    p.add_argument("--fixtures", default=DEFAULT_FIXTURES)
+    p.add_argument("--images", type=int, default=64)
+    p.add_argument("--batch", type=int, default=8)
+    p.add_argument("--repeat", type=int, default=5)
+    p.add_argument("--out", default=None, help="Optional JSON output path")
+    p.set_defaults(func=cmd_preprocess)
+
+    p = sub.add_parser("precision", help="Vector size and retrieval quality at float32, float16 and bfloat16")
+    p.add_argument("--db", default=None, help="Local SQLite store to query; without it a synthetic set only exercises the sizes")
+    p.add_argument("--k", type=int, default=10)
+    p.add_argument("--out", default=None, help="Optional JSON output path")
+    p.set_defaults(func=cmd_precision)
+
+    p = sub.add_parser("compare", help="Compare two result files")
+    p.add_argument("baseline")
+    p.add_argument("candidate")
+    p.add_argument("--fail-above", type=float, default=None, help="Exit 1 if a phase is slower by more than N%%")
+    p.set_defaults(func=cmd_compare)
+    return parser
+
+
+def main(argv=None) -> int:
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
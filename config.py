@@ -20,9 +20,27 @@ SUPABASE_KEY = os.getenv("SUPABASE_KEY") or os.getenv("SUPABASE_ANON_KEY") or ""
 if not SUPABASE_URL or not SUPABASE_KEY:
     pass  # Allow missing at import; database module will raise on first use
 
+# Storage backend: "supabase" (PostgREST) or "sqlite" (local file for offline runs, benchmarks, tests)
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "supabase").strip().lower()
+LOCAL_DB_PATH = os.getenv("LOCAL_DB_PATH", "products.sqlite3")
+
 # Scraper Configuration
-BASE_URL = "https://about---blank.com"
+# SCRAPER_BASE_URL overrides the origin (e.g. the local fixture server used by benchmark.py)
+BASE_URL = os.getenv("SCRAPER_BASE_URL", "https://about---blank.com").rstrip("/")
 SHOP_ALL_URL = f"{BASE_URL}/collections/shop-all"
+SITEMAP_URL = f"{BASE_URL}/sitemap.xml"
+# Discovery: "collections" = crawl shop-all pages; "sitemap" = product sitemap with per-product lastmod
+# (falls back to products.json, then the collection crawl, when the sitemap is unavailable). The sitemap
+# lists the whole catalogue, including products outside shop-all, so it is opt-in.
+DISCOVERY_MODE = os.getenv("DISCOVERY_MODE", "collections").strip().lower()
+# Run mode: "full" fetches every listed product. "incremental" (opt-in) fetches only products whose sitemap
+# lastmod / products.json updated_at changed or whose last fetch is older than INCREMENTAL_MAX_AGE_HOURS;
+# a full sweep runs when the last one is older than FULL_SWEEP_INTERVAL_HOURS (0 = never). Collection
+# pages carry no change signal, so with DISCOVERY_MODE=collections a known product's price or stock change
+# can go unseen for up to INCREMENTAL_MAX_AGE_HOURS (or until the next full sweep, if sooner).
+RUN_MODE = os.getenv("RUN_MODE", "full").strip().lower()
+INCREMENTAL_MAX_AGE_HOURS = float(os.getenv("INCREMENTAL_MAX_AGE_HOURS", "72"))
+FULL_SWEEP_INTERVAL_HOURS = float(os.getenv("FULL_SWEEP_INTERVAL_HOURS", "24"))
 HEADERS = {
     'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36',
     'Accept': 'text/html,application/xhtml+xml,application/xml;q=0.9,image/webp,*/*;q=0.8',
@@ -32,6 +50,10 @@ HEADERS = {
     'Upgrade-Insecure-Requests': '1',
 }
 
+# Several stores/collections in one process: JSON list of store configs (see stores.py); empty = the
+# single store configured here
+STORES_FILE = os.getenv("STORES_FILE", "")
+
 # Data Mapping Configuration
 BRAND = "About Blank"
 # Unique source per scraper so multiple scrapers don't delete each other's rows
@@ -46,13 +68,65 @@ CATEGORY_MAPPING = {
     'footwear': ['footwear', 'shoes', 'sneakers', 'boots', 'sandals']
 }
 
+# Category extraction: "page" = every /collections/ link on the page; "product" (opt-in) = JSON-LD,
+# breadcrumb and product-section links only (menu links learned from collection pages are skipped).
+# Switching to "product" rewrites `category` on existing rows once, which re-embeds their info text.
+CATEGORY_SCOPE = os.getenv("CATEGORY_SCOPE", "page").strip().lower()
+
 # Rate limiting
-REQUESTS_PER_SECOND = 2  # Conservative rate limiting
+REQUESTS_PER_SECOND = float(os.getenv("REQUESTS_PER_SECOND", "2"))  # Conservative rate limiting
 MAX_CONCURRENT_REQUESTS = 5
 
+# Streaming pipeline: max items buffered between stages, and seconds before a partial batch is flushed
+PIPELINE_QUEUE_SIZE = int(os.getenv("PIPELINE_QUEUE_SIZE", "100"))
+PIPELINE_FLUSH_SECONDS = float(os.getenv("PIPELINE_FLUSH_SECONDS", "5"))
+
+# Sharded runs (main.py --shards / --worker): queue shared by coordinator and workers ("sqlite" = local
+# file SHARD_QUEUE_PATH, one host only; "postgrest" = Supabase tables from sql/shard_queue.sql, workers
+# on any host), how often they poll it, and how long the coordinator waits for all shards (and a worker
+# for its run)
+SHARD_QUEUE_BACKEND = os.getenv("SHARD_QUEUE_BACKEND", "sqlite").strip().lower()
+SHARD_QUEUE_PATH = os.getenv("SHARD_QUEUE_PATH", "shard_queue.sqlite3")
+SHARD_POLL_SECONDS = float(os.getenv("SHARD_POLL_SECONDS", "2"))
+SHARD_TIMEOUT_SECONDS = float(os.getenv("SHARD_TIMEOUT_SECONDS", str(6 * 3600)))
+
+# Run report: JSON always written to RUN_REPORT_PATH (empty = off); Prometheus textfile only if set
+RUN_REPORT_PATH = os.getenv("RUN_REPORT_PATH", "run_report.json")
+PROMETHEUS_TEXTFILE = os.getenv("PROMETHEUS_TEXTFILE", "")
+
 # 0 = no limit; set PRODUCT_LIMIT in env for test/CI (e.g. 10)
 PRODUCT_LIMIT = int(os.getenv("PRODUCT_LIMIT", "0"))
 
+# Columnar run snapshot (Parquet, needs pyarrow); empty = disabled
+EXPORT_DIR = os.getenv("EXPORT_DIR", "")
+EXPORT_ROW_GROUP_SIZE = int(os.getenv("EXPORT_ROW_GROUP_SIZE", "256"))
+
 # Image processing
+EMBEDDING_DELAY = float(os.getenv("EMBEDDING_DELAY", "0.5"))  # Pause between model calls
 EMBEDDING_MODEL = "google/siglip-base-patch16-384"
-EMBEDDING_DIM = 768
\ No newline at end of file
+EMBEDDING_DIM = 768
+# Vector precision in memory, in local SQLite stores/caches and in upserts: "float32", "float16" or
+# "bfloat16" (needs ml_dtypes). Half precision halves vector memory and storage (vector_codec.py).
+EMBEDDING_PRECISION = os.getenv("EMBEDDING_PRECISION", "float32").strip().lower()
+# Info-text embeddings are cached locally by a hash of the text; cache misses go through the
+# text tower this many at a time. Images requested together are embedded in model batches of
+# IMAGE_EMBEDDING_BATCH_SIZE. Local vector caches drop entries unused for EMBEDDING_CACHE_DAYS.
+TEXT_EMBEDDING_BATCH_SIZE = int(os.getenv("TEXT_EMBEDDING_BATCH_SIZE", "32"))
+IMAGE_EMBEDDING_BATCH_SIZE = int(os.getenv("IMAGE_EMBEDDING_BATCH_SIZE", "8"))
+EMBEDDING_CACHE_DAYS = float(os.getenv("EMBEDDING_CACHE_DAYS", "30"))
+# Image preprocessing: "fast" (draft-mode JPEG decode, one resize, batch normalization into a
+# reused pinned buffer; preprocess.py) or "processor" (the transformers image processor)
+IMAGE_PREPROCESS = os.getenv("IMAGE_PREPROCESS", "fast").strip().lower()
+# Multi-view vectors: embed up to GALLERY_MAX_IMAGES gallery images per product and write their
+# pooled vector (GALLERY_POOLING: "mean" or "attention") to products.gallery_embedding. At most
+# GALLERY_IMAGE_BUDGET gallery images not in the local cache are embedded per run (0 = no limit).
+GALLERY_EMBEDDINGS = os.getenv("GALLERY_EMBEDDINGS", "0").strip().lower() in ("1", "true", "yes")
+GALLERY_MAX_IMAGES = int(os.getenv("GALLERY_MAX_IMAGES", "8"))
+GALLERY_IMAGE_BUDGET = int(os.getenv("GALLERY_IMAGE_BUDGET", "500"))
+GALLERY_POOLING = os.getenv("GALLERY_POOLING", "mean").strip().lower()
+# A re-uploaded image (new file name or ?v=) whose perceptual hash is within this many bits (of 64)
+# of the image a product's stored vector came from reuses that vector instead of re-embedding
+PHASH_MAX_DISTANCE = int(os.getenv("PHASH_MAX_DISTANCE", "4"))
+# Run-scoped image dedup keeps vectors for this many most recently used image URLs and contents
+# (~3 KB each at float32). Must exceed the images in flight in the pipeline at once.
+IMAGE_DEDUP_CACHE_SIZE = int(os.getenv("IMAGE_DEDUP_CACHE_SIZE", "4096"))
@@ -0,0 +1,64 @@
+"""
+Shared test fixtures: a minimal PostgREST stand-in whose RPCs are served by a Python handler
+(e.g. local_db.SQLiteManager or a SQLite ShardQueue), so PostgREST clients are tested without Supabase.
+"""
+import json
+from typing import Any, Callable, Dict, List, Optional
+
+import pytest
+
+
+class FakeResponse:
+    def __init__(self, status_code: int, payload: Any = None):
+        self.status_code = status_code
+        self._payload = payload
+        self.text = json.dumps(payload) if payload is not None else ""
+
+    def json(self) -> Any:
+        return self._payload
+
+    def raise_for_status(self) -> None:
+        if self.status_code >= 400:
+            raise RuntimeError(f"HTTP {self.status_code}")
+
+
+class PostgrestStandIn:
+    """
+    Stands in for the requests session of a PostgREST client: POST /rpc/<name> returns
+    handler(name, params) as JSON. installed=False answers 404, denied=True 401, the first
+    `fail_first` calls 503, and `fail` is raised after the handler ran (committed server-side,
+    but the response never arrives).
+    """
+
+    def __init__(self, handler: Callable[[str, Dict[str, Any]], Any], installed: bool = True,
+                 denied: bool = False, fail_first: int = 0, fail: Optional[BaseException] = None):
+        self.handler = handler
+        self.installed = installed
+        self.denied = denied
+        self.fail_first = fail_first
+        self.fail = fail
+        self.calls: List[str] = []
+
+    def post(self, url, data=None, timeout=None, **kwargs):
+        name = url.rsplit("/rpc/", 1)[1]
+        self.calls.append(name)
+        if not self.installed:
+            return FakeResponse(404, {"code": "PGRST202"})
+        if self.denied:
+            return FakeResponse(401, {"code": "42501"})
+        if self.fail_first:
+            self.fail_first -= 1
+            return FakeResponse(503, {"message": "unavailable"})
+        result = self.handler(name, json.loads(data))
+        if self.fail:
+            raise self.fail
+        return FakeResponse(200, result)
+
+    def close(self) -> None:
+        pass
+
+
+@pytest.fixture
+def postgrest():
+    """Factory: postgrest(handler, **options) -> PostgrestStandIn."""
+    return PostgrestStandIn
@@ -7,10 +7,12 @@ import logging
 import requests
 import os
 import time
-from typing import List, Dict, Any, Set, Tuple, Optional
+from typing import List, Dict, Any, Set, Tuple, Optional, Protocol
 from datetime import datetime, timezone
 
-from config import SUPABASE_URL, SUPABASE_KEY
+from config import SUPABASE_URL, SUPABASE_KEY, STORAGE_BACKEND, LOCAL_DB_PATH
+from metrics import get_metrics
+from vector_codec import format_vector, json_default
 
 logger = logging.getLogger(__name__)
 
@@ -21,6 +23,28 @@ EMBEDDING_DELAY = 0.5
 CONSECUTIVE_MISSES_THRESHOLD = 2
 
 
+class StorageBackend(Protocol):
+    """Products store used by AboutBlankScraper (SupabaseManager, local_db.SQLiteManager)."""
+
+    def products_has_column(self, column_name: str) -> bool: ...
+
+    def get_existing_product_urls(self, source: str) -> Set[str]: ...
+
+    def get_existing_products_for_sync(self, source: str) -> List[Dict[str, Any]]: ...
+
+    def get_products_by_ids(self, ids: List[str], select: str) -> Dict[str, Dict[str, Any]]: ...
+
+    def delete_products_by_ids(self, ids: List[str]) -> int: ...
+
+    def insert_products_batch(self, products_data: List[Dict[str, Any]], *, ignore_duplicates: bool = True) -> int: ...
+
+    def upsert_products_batch(self, products_data: List[Dict[str, Any]]) -> Tuple[int, int, List[Dict[str, Any]]]: ...
+
+    def mark_and_sweep_products(
+        self, source: str, seen_ids: List[str], threshold: int = CONSECUTIVE_MISSES_THRESHOLD
+    ) -> Optional[Dict[str, int]]: ...
+
+
 class SupabaseManager:
     """PostgREST client for products table: HTTP session, upsert, normalized keys."""
 
@@ -35,6 +59,8 @@ class SupabaseManager:
             "Content-Type": "application/json",
             "Accept": "application/json",
         })
+        # Every PostgREST call is timed into the run report as "postgrest.<METHOD> <path>".
+        self.session.hooks["response"].append(get_metrics().requests_hook("postgrest"))
         self._products_columns_cache: Optional[Set[str]] = None
         logger.info("Connected to Supabase (PostgREST)")
 
@@ -273,7 +299,7 @@ class SupabaseManager:
         return [{k: p.get(k) for k in all_keys} for p in products_data]
 
     def _prepare_row(self, row: Dict[str, Any]) -> Dict[str, Any]:
-        """Prepare one row for JSON (e.g. leave lists as-is for vector columns)."""
+        """Prepare one row for JSON (lists as-is; half-precision vector arrays as compact pgvector text)."""
         out = {}
         for k, v in row.items():
             if v is None:
@@ -281,7 +307,7 @@ class SupabaseManager:
             elif isinstance(v, list):
                 out[k] = v
             else:
-                out[k] = v
+                out[k] = format_vector(v)
         return out
 
     def insert_products_batch(
@@ -380,7 +406,7 @@ class SupabaseManager:
             r = self.session.patch(
                 f"{self.base_url}/products",
                 params={"id": f"eq.{product_id}"},
-                data=json.dumps({"image_embedding": embedding}),
+                data=json.dumps({"image_embedding": format_vector(embedding)}),
                 timeout=30,
             )
             r.raise_for_status()
@@ -432,7 +458,7 @@ class SupabaseManager:
                 f.write(f"Error: {error_msg}\n")
                 f.write("-" * 50 + "\n")
                 for p in failed_products:
-                    f.write(json.dumps(p, ensure_ascii=False) + "\n")
+                    f.write(json.dumps(p, ensure_ascii=False, default=json_default) + "\n")
             logger.warning(f"Logged {len(failed_products)} failed products to {log_file}")
         except Exception as e:
             logger.error(f"Failed to write error log: {e}")
@@ -498,70 +524,41 @@ class SupabaseManager:
 
         return 0
 
-    def update_products_last_seen(self, product_ids: List[str]) -> int:
-        """Update last_seen timestamp and reset consecutive_misses for products seen in current run."""
-        if not product_ids:
-            return 0
-        updated = 0
-        now = datetime.now(timezone.utc).isoformat()
-        chunk = 100
-        for i in range(0, len(product_ids), chunk):
-            batch = product_ids[i:i + chunk]
-            try:
-                in_val = "in.(" + ",".join(batch) + ")"
-                r = self.session.patch(
-                    f"{self.base_url}/products",
-                    params={"id": in_val},
-                    data=json.dumps({"last_seen": now, "consecutive_misses": 0}),
-                    timeout=30,
-                )
-                r.raise_for_status()
-                updated += len(batch)
-            except Exception as e:
-                logger.error(f"Error updating last_seen: {e}")
-        return updated
-
-    def increment_consecutive_misses(self, product_ids: List[str]) -> int:
-        """Increment consecutive_misses for products not seen in current run."""
-        if not product_ids:
-            return 0
-        updated = 0
-        chunk = 100
-        for i in range(0, len(product_ids), chunk):
-            batch = product_ids[i:i + chunk]
-            try:
-                in_val = "in.(" + ",".join(batch) + ")"
-                r = self.session.patch(
-                    f"{self.base_url}/products",
-                    params={"id": in_val},
-                    data=json.dumps({"consecutive_misses": "consecutive_misses+1"}),
-                    timeout=30,
-                )
-                r.raise_for_status()
-                updated += len(batch)
-            except Exception as e:
-                logger.error(f"Error incrementing consecutive_misses: {e}")
-        return updated
+    def mark_and_sweep_products(
+        self,
+        source: str,
+        seen_ids: List[str],
+        threshold: int = CONSECUTIVE_MISSES_THRESHOLD,
+    ) -> Optional[Dict[str, int]]:
+        """
+        Stale tracking in one RPC (see sql/mark_and_sweep_products.sql): rows in
+        `seen_ids` get last_seen=now() and consecutive_misses=0, other rows for
+        `source` get consecutive_misses+1, and rows reaching `threshold` are deleted,
+        all in one transaction. Returns {"seen", "missed", "deleted"} counts, or None
+        if the function is not installed (404; caller falls back to local tracking).
+        Other errors are raised: the server may have committed the sweep (e.g. a timeout),
+        so counting the misses again locally could delete products after one miss.
+        """
+        payload = {
+            "p_source": source,
+            "p_seen_ids": [pid for pid in seen_ids if pid],
+            "p_threshold": int(threshold),
+        }
+        r = self.session.post(
+            f"{self.base_url}/rpc/mark_and_sweep_products",
+            data=json.dumps(payload),
+            timeout=120,
+        )
+        if r.status_code == 404:
+            logger.warning("RPC mark_and_sweep_products not found; run sql/mark_and_sweep_products.sql")
+            return None
+        r.raise_for_status()
+        data = r.json()
 
-    def delete_stale_products(self, source: str, threshold: int = 2) -> int:
-        """Delete products that have missed >= threshold consecutive runs."""
-        try:
-            r = self.session.delete(
-                f"{self.base_url}/products",
-                params={
-                    "source": f"eq.{source}",
-                    "consecutive_misses": f"gte.{threshold}",
-                },
-                timeout=30,
-            )
-            r.raise_for_status()
-            deleted = r.json() if r.text else []
-            if isinstance(deleted, list):
-                return len(deleted)
-            return 0
-        except Exception as e:
-            logger.error(f"Error deleting stale products: {e}")
-            return 0
+        row = data[0] if isinstance(data, list) and data else data
+        if not isinstance(row, dict):
+            return {"seen": 0, "missed": 0, "deleted": 0}
+        return {k: int(row.get(k) or 0) for k in ("seen", "missed", "deleted")}
 
     @staticmethod
     def _norm_value(v: Any) -> Any:
@@ -661,9 +658,13 @@ class SupabaseManager:
 _db_manager = None
 
 
-def get_db_manager() -> SupabaseManager:
-    """Get or create global database manager instance."""
+def get_db_manager() -> StorageBackend:
+    """Get or create global database manager instance (STORAGE_BACKEND selects Supabase or local SQLite)."""
     global _db_manager
     if _db_manager is None:
-        _db_manager = SupabaseManager()
+        if STORAGE_BACKEND == "sqlite":
+            from local_db import SQLiteManager
+            _db_manager = SQLiteManager(LOCAL_DB_PATH)
+        else:
+            _db_manager = SupabaseManager()
     return _db_manager
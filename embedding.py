@@ -4,10 +4,14 @@ from PIL import Image
 import requests
 from io import BytesIO
 import numpy as np
-from config import EMBEDDING_MODEL, EMBEDDING_DIM
+from config import EMBEDDING_MODEL, EMBEDDING_DIM, IMAGE_PREPROCESS
 import asyncio
+import threading
 from concurrent.futures import ThreadPoolExecutor
 import logging
+from metrics import get_metrics
+from profiling import torch_profile
+from preprocess import ImageBatchPreprocessor
 
 logger = logging.getLogger(__name__)
 
@@ -23,6 +27,27 @@ class SigLIPEmbedder:
         self.model.to(self.device)
         self.model.eval()
 
+        # Fast preprocessing path: one pinned pixel buffer reused by every batch, so batches
+        # (thread pool callers) take turns through preprocessing and the forward pass
+        self._image_lock = threading.Lock()
+        self._pixel_tensor = None
+        self.preprocessor = None
+        if IMAGE_PREPROCESS == "fast":
+            image_processor = getattr(self.processor, "image_processor", None)
+            size = getattr(image_processor, "size", None) or {}
+            self.preprocessor = ImageBatchPreprocessor(
+                size=size.get("height", 384),
+                mean=getattr(image_processor, "image_mean", None) or (0.5, 0.5, 0.5),
+                std=getattr(image_processor, "image_std", None) or (0.5, 0.5, 0.5),
+                resample=getattr(image_processor, "resample", None) or Image.Resampling.BICUBIC,
+                allocate=self._allocate_pixels,
+            )
+
+    def _allocate_pixels(self, shape):
+        """Preprocessing buffer: page-locked on CUDA so the host-to-device copy can run async"""
+        self._pixel_tensor = torch.empty(shape, dtype=torch.float32, pin_memory=self.device == 'cuda')
+        return self._pixel_tensor.numpy()
+
     async def generate_embedding_async(self, image_url):
         """Generate embedding asynchronously"""
         loop = asyncio.get_event_loop()
@@ -31,71 +56,131 @@ class SigLIPEmbedder:
 
     def generate_embedding(self, image_url):
         """Generate 768-dimensional embedding for image URL"""
-        try:
-            # Download image
-            response = requests.get(image_url, timeout=30, stream=True)
-            response.raise_for_status()
-
-            # Open image
-            image = Image.open(BytesIO(response.content))
+        data = download_image_bytes(image_url)
+        return self.embed_image_bytes(data, image_url) if data is not None else None
 
-            # Convert to RGB if necessary
-            if image.mode != 'RGB':
-                image = image.convert('RGB')
+    async def embed_image_bytes_async(self, data: bytes, label: str = ""):
+        """Embed already downloaded image bytes asynchronously"""
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor() as executor:
+            return await loop.run_in_executor(executor, self.embed_image_bytes, data, label)
 
-            # Resize image to expected size if needed (SigLIP typically expects 384x384 for base-patch16-384)
-            image = image.resize((384, 384), Image.Resampling.LANCZOS)
+    async def embed_images_async(self, datas, labels=None):
+        """Embed a batch of downloaded images asynchronously"""
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor() as executor:
+            return await loop.run_in_executor(executor, self.embed_images, datas, labels)
 
-            # Process image - SigLIP requires both image and text
-            # Use empty text or a generic description
-            text = [""]  # Empty text for image-only embedding
-            inputs = self.processor(text=text, images=image, return_tensors="pt", padding=True)
-            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+    def embed_image_bytes(self, data: bytes, label: str = ""):
+        """Generate 768-dimensional embedding for downloaded image bytes (label: URL for log messages)"""
+        return self.embed_images([data], [label])[0]
 
-            # Generate embedding
-            with torch.no_grad():
-                outputs = self.model(**inputs)
-                # For SigLIP, we want the image embeddings (vision model output)
-                # The outputs.image_embeds contains the image embeddings
-                if hasattr(outputs, 'image_embeds'):
-                    embedding = outputs.image_embeds
-                elif hasattr(outputs, 'pooler_output'):
-                    embedding = outputs.pooler_output
+    def embed_images(self, datas, labels=None):
+        """Embeddings for a batch of downloaded images in one forward pass (None for undecodable images)"""
+        labels = labels or [""] * len(datas)
+        results = [None] * len(datas)
+        try:
+            with self._image_lock:
+                if self.preprocessor is not None:
+                    embeddings, ok = self._image_features_fast(datas, labels)
                 else:
-                    # Fallback to mean pooling
-                    embedding = outputs.last_hidden_state.mean(dim=1)
-
-            # Convert to numpy and flatten
-            embedding = embedding.cpu().numpy().flatten()
+                    embeddings, ok = self._image_features_processor(datas, labels)
+            if not ok:
+                return results
 
             # Ensure correct dimension
-            if len(embedding) != EMBEDDING_DIM:
-                logger.warning(f"Embedding dimension mismatch: {len(embedding)} vs {EMBEDDING_DIM}")
+            if embeddings.shape[1] != EMBEDDING_DIM:
+                logger.warning(f"Embedding dimension mismatch: {embeddings.shape[1]} vs {EMBEDDING_DIM}")
                 # Pad or truncate if necessary
-                if len(embedding) < EMBEDDING_DIM:
-                    embedding = np.pad(embedding, (0, EMBEDDING_DIM - len(embedding)))
-                else:
-                    embedding = embedding[:EMBEDDING_DIM]
+                if embeddings.shape[1] < EMBEDDING_DIM:
+                    embeddings = np.pad(embeddings, ((0, 0), (0, EMBEDDING_DIM - embeddings.shape[1])))
+                embeddings = embeddings[:, :EMBEDDING_DIM]
 
-            # Normalize the embedding (L2 normalization)
-            norm = np.linalg.norm(embedding)
-            if norm > 0:
-                embedding = embedding / norm
+            # Normalize the embeddings (L2 normalization)
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms > 0, norms, 1)
 
-            return embedding.tolist()
+            for i, row in zip(ok, embeddings):
+                results[i] = row.tolist()
 
         except Exception as e:
-            logger.error(f"Error generating embedding for {image_url}: {e}")
-            return None
+            logger.error(f"Error generating embeddings for {len(datas)} images: {e}")
+        return results
+
+    def _image_features_fast(self, datas, labels):
+        """(image features, indices of decoded images) via preprocess.ImageBatchPreprocessor"""
+        metrics = get_metrics()
+        with metrics.stage("embedding.image_preprocess"):
+            pixels, ok = self.preprocessor(datas, labels)
+        if not ok:
+            return None, ok
+        # pixels is a view of self._pixel_tensor; the copy to the GPU (if any) overlaps from pinned memory
+        pixel_values = self._pixel_tensor[:len(ok)].to(self.device, non_blocking=True)
+        with torch.no_grad(), metrics.stage("embedding.image_inference"), torch_profile("image_inference"):
+            features = self.model.get_image_features(pixel_values=pixel_values)
+            # Newer transformers return a model output whose pooler_output is the projected embedding
+            features = getattr(features, "pooler_output", features)
+            return features.float().cpu().numpy().reshape(len(ok), -1), ok
+
+    def _image_features_processor(self, datas, labels):
+        """(image features, indices of decoded images) via the transformers processor"""
+        metrics = get_metrics()
+        images = []
+        with metrics.stage("embedding.image_preprocess"):
+            for i, (data, label) in enumerate(zip(datas, labels)):
+                try:
+                    # Open image
+                    image = Image.open(BytesIO(data))
+
+                    # Convert to RGB if necessary
+                    if image.mode != 'RGB':
+                        image = image.convert('RGB')
+
+                    # Resize image to expected size if needed (SigLIP typically expects 384x384 for base-patch16-384)
+                    images.append((i, image.resize((384, 384), Image.Resampling.LANCZOS)))
+                except Exception as e:
+                    logger.error(f"Error generating embedding for {label or 'image'}: {e}")
+            if not images:
+                return None, []
+
+            # Process images - SigLIP requires both image and text
+            # Use empty text or a generic description
+            text = [""]  # Empty text for image-only embedding
+            inputs = self.processor(text=text, images=[im for _, im in images], return_tensors="pt", padding=True)
+            inputs = {k: v.to(self.device) for k, v in inputs.items()}
+
+        # Generate embedding
+        with torch.no_grad(), metrics.stage("embedding.image_inference"), torch_profile("image_inference"):
+            outputs = self.model(**inputs)
+            # For SigLIP, we want the image embeddings (vision model output)
+            # The outputs.image_embeds contains the image embeddings
+            if hasattr(outputs, 'image_embeds'):
+                embedding = outputs.image_embeds
+            elif hasattr(outputs, 'pooler_output'):
+                embedding = outputs.pooler_output
+            else:
+                # Fallback to mean pooling
+                embedding = outputs.last_hidden_state.mean(dim=1)
+
+        # Convert to numpy, one row per image
+        return embedding.cpu().numpy().reshape(len(images), -1), [i for i, _ in images]
 
     def generate_text_embedding(self, text: str):
         """Generate 768-dimensional text embedding using SigLIP text encoder (same space as image embeddings)."""
         if not text or not text.strip():
             return None
+        return self.generate_text_embeddings([text])[0]
+
+    def generate_text_embeddings(self, texts):
+        """Text embeddings for a batch of texts in one pass through the text tower (None for empty texts)."""
+        results = [None] * len(texts)
+        batch = [(i, t.strip()) for i, t in enumerate(texts) if t and t.strip()]
+        if not batch:
+            return results
         try:
             # Text only: use processor's tokenizer; padding="max_length" as in SigLIP docs
             inputs = self.processor(
-                text=[text.strip()],
+                text=[t for _, t in batch],
                 padding="max_length",
                 return_tensors="pt",
                 truncation=True,
@@ -105,25 +190,23 @@ class SigLIPEmbedder:
             if not text_inputs:
                 text_inputs = {k: v.to(self.device) for k, v in inputs.items()}
 
-            with torch.no_grad():
+            with torch.no_grad(), get_metrics().stage("embedding.text_inference"), torch_profile("text_inference"):
                 # get_text_features returns pooler_output (projected text embedding, same dim as image_embeds)
                 text_output = self.model.get_text_features(**text_inputs)
-                embedding = text_output.pooler_output.cpu().numpy().flatten()
+                embeddings = text_output.pooler_output.cpu().numpy().reshape(len(batch), -1)
 
-            if len(embedding) != EMBEDDING_DIM:
-                if len(embedding) < EMBEDDING_DIM:
-                    embedding = np.pad(embedding, (0, EMBEDDING_DIM - len(embedding)))
-                else:
-                    embedding = embedding[:EMBEDDING_DIM]
+            if embeddings.shape[1] < EMBEDDING_DIM:
+                embeddings = np.pad(embeddings, ((0, 0), (0, EMBEDDING_DIM - embeddings.shape[1])))
+            embeddings = embeddings[:, :EMBEDDING_DIM]
 
-            norm = np.linalg.norm(embedding)
-            if norm > 0:
-                embedding = embedding / norm
+            norms = np.linalg.norm(embeddings, axis=1, keepdims=True)
+            embeddings = embeddings / np.where(norms > 0, norms, 1)
 
-            return embedding.tolist()
+            for (i, _), embedding in zip(batch, embeddings):
+                results[i] = embedding.tolist()
         except Exception as e:
-            logger.error(f"Error generating text embedding: {e}")
-            return None
+            logger.error(f"Error generating text embeddings for {len(batch)} texts: {e}")
+        return results
 
     async def generate_text_embedding_async(self, text: str):
         """Generate text embedding asynchronously."""
@@ -131,6 +214,12 @@ class SigLIPEmbedder:
         with ThreadPoolExecutor() as executor:
             return await loop.run_in_executor(executor, self.generate_text_embedding, text)
 
+    async def generate_text_embeddings_async(self, texts):
+        """Batch of text embeddings asynchronously."""
+        loop = asyncio.get_event_loop()
+        with ThreadPoolExecutor() as executor:
+            return await loop.run_in_executor(executor, self.generate_text_embeddings, texts)
+
     def __del__(self):
         """Cleanup GPU memory"""
         if hasattr(self, 'model'):
@@ -138,6 +227,18 @@ class SigLIPEmbedder:
         if torch.cuda.is_available():
             torch.cuda.empty_cache()
 
+def download_image_bytes(image_url):
+    """Download an image for embedding; None (logged) on failure. Needs no model."""
+    try:
+        with get_metrics().stage("embedding.image_download") as t:
+            response = requests.get(image_url, timeout=30)
+            response.raise_for_status()
+            t.bytes = len(response.content)
+        return response.content
+    except Exception as e:
+        logger.error(f"Error downloading image {image_url}: {e}")
+        return None
+
 # Global embedder instance
 _embedder = None
 
@@ -154,9 +255,35 @@ async def generate_image_embedding(image_url):
     return await embedder.generate_embedding_async(image_url)
 
 
+async def fetch_image_bytes(image_url):
+    """Download image bytes in a worker thread (no model needed)."""
+    loop = asyncio.get_event_loop()
+    return await loop.run_in_executor(None, download_image_bytes, image_url)
+
+
+async def embed_image_bytes(data: bytes, label: str = ""):
+    """Image embedding from already downloaded bytes."""
+    embedder = get_embedder()
+    return await embedder.embed_image_bytes_async(data, label)
+
+
+async def embed_image_batch(datas, labels=None):
+    """Image embeddings for a batch of downloaded images, one forward pass."""
+    embedder = get_embedder()
+    return await embedder.embed_images_async(datas, labels)
+
+
 async def generate_text_embedding(text: str):
     """Convenience function to generate text embedding (same model as image, for info_embedding)."""
     if not text or not text.strip():
         return None
     embedder = get_embedder()
-    return await embedder.generate_text_embedding_async(text)
\ No newline at end of file
+    return await embedder.generate_text_embedding_async(text)
+
+
+async def generate_text_embeddings(texts):
+    """Text embeddings for a batch of info texts, one text-tower pass (None for empty texts)."""
+    if not any(t and t.strip() for t in texts):
+        return [None] * len(texts)
+    embedder = get_embedder()
+    return await embedder.generate_text_embeddings_async(texts)
@@ -0,0 +1,114 @@
+"""
+Columnar (Parquet) snapshot of each scrape run, written in row groups as products complete.
+Embeddings are fixed-size float32 list columns, so readers get vectors zero-copy.
+Optional: needs `pip install pyarrow` (commented out in requirements.txt); enabled by EXPORT_DIR in .env.
+"""
+import json
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+
+from config import EMBEDDING_DIM, EXPORT_DIR, EXPORT_ROW_GROUP_SIZE
+from vector_codec import as_vector
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # optional dependency
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+STRING_COLUMNS = (
+    "id", "source", "product_url", "image_url", "additional_images", "brand", "title",
+    "description", "category", "gender", "price", "size", "country", "metadata",
+)
+VECTOR_COLUMNS = ("image_embedding", "info_embedding", "gallery_embedding")
+
+
+def snapshot_schema() -> "pa.Schema":
+    fields = [pa.field(c, pa.string()) for c in STRING_COLUMNS]
+    fields += [
+        pa.field("second_hand", pa.bool_()),
+        pa.field("tags", pa.list_(pa.string())),
+        pa.field("scraped_at", pa.timestamp("us", tz="UTC")),
+    ]
+    fields += [pa.field(c, pa.list_(pa.float32(), EMBEDDING_DIM)) for c in VECTOR_COLUMNS]
+    return pa.schema(fields)
+
+
+class ParquetSnapshotWriter:
+    """Buffer product rows and flush one Parquet row group every `row_group_size` rows."""
+
+    def __init__(self, path: str, row_group_size: int = EXPORT_ROW_GROUP_SIZE):
+        if pa is None:
+            raise RuntimeError("Parquet export needs pyarrow: pip install pyarrow")
+        self.path = path
+        self.row_group_size = max(1, int(row_group_size))
+        self.schema = snapshot_schema()
+        self._writer: Optional["pq.ParquetWriter"] = None
+        self._buffer: List[Dict[str, Any]] = []
+        self._written_ids = set()
+        self.rows_written = 0
+
+    def write(self, product: Dict[str, Any]) -> None:
+        """Add one finished product; later writes of the same id are ignored."""
+        pid = product.get("id")
+        if pid in self._written_ids:
+            return
+        self._written_ids.add(pid)
+        self._buffer.append(self._to_record(product))
+        if len(self._buffer) >= self.row_group_size:
+            self.flush()
+
+    def _to_record(self, product: Dict[str, Any]) -> Dict[str, Any]:
+        rec: Dict[str, Any] = {}
+        for c in STRING_COLUMNS:
+            v = product.get(c)
+            rec[c] = v if v is None or isinstance(v, str) else json.dumps(v, ensure_ascii=False)
+        rec["second_hand"] = product.get("second_hand")
+        tags = product.get("tags")
+        rec["tags"] = list(tags) if isinstance(tags, (list, tuple)) else None
+        rec["scraped_at"] = datetime.now(timezone.utc)
+        for c in VECTOR_COLUMNS:
+            vec = as_vector(product.get(c))  # half-precision arrays and pgvector text widen to float32
+            rec[c] = vec if vec is not None and len(vec) == EMBEDDING_DIM else None
+        return rec
+
+    def flush(self) -> None:
+        if not self._buffer:
+            return
+        if self._writer is None:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            self._writer = pq.ParquetWriter(self.path, self.schema, compression="zstd")
+        table = pa.Table.from_pylist(self._buffer, schema=self.schema)
+        self._writer.write_table(table, row_group_size=len(self._buffer))
+        self.rows_written += len(self._buffer)
+        self._buffer = []
+
+    def close(self) -> None:
+        """Flush the last row group and write the footer (file is readable only after this)."""
+        self.flush()
+        if self._writer is not None:
+            self._writer.close()
+            self._writer = None
+            logger.info(f"Wrote {self.rows_written} products to {self.path}")
+
+
+def open_run_snapshot(source: str) -> Optional[ParquetSnapshotWriter]:
+    """Snapshot writer for this run, or None when EXPORT_DIR is unset or pyarrow is missing."""
+    if not EXPORT_DIR:
+        return None
+    if pa is None:
+        logger.warning("EXPORT_DIR is set but pyarrow is not installed; skipping Parquet export")
+        return None
+    safe_source = source.replace("/", "_").replace("\\", "_").replace(":", "_")
+    timestamp = datetime.now(timezone.utc).strftime("%Y%m%d_%H%M%S")
+    path = os.path.join(EXPORT_DIR, f"{safe_source}_{timestamp}.parquet")
+    n = 1
+    while os.path.exists(path):  # never overwrite an earlier run's snapshot
+        n += 1
+        path = os.path.join(EXPORT_DIR, f"{safe_source}_{timestamp}_{n}.parquet")
+    return ParquetSnapshotWriter(path)
@@ -0,0 +1,55 @@
+"""
+Multi-view product vectors (GALLERY_EMBEDDINGS): every gallery image (main image plus
+additional_images) is embedded, its vector kept in a local per-image cache, and the product gets
+gallery_embedding, a pooled vector of its views. Back views, detail and model shots then count
+in visual search, while image_embedding stays the main image's vector.
+"""
+import hashlib
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from config import EMBEDDING_MODEL
+from utils import normalize_image_url
+
+
+def gallery_image_urls(product: Dict[str, Any], limit: int = 0) -> List[str]:
+    """Canonical image URLs of a product, main image first, duplicates dropped; `limit` > 0 caps the count."""
+    urls = [product.get("image_url")] + (product.get("additional_images") or "").split(" , ")
+    out: List[str] = []
+    for url in urls:
+        url = normalize_image_url(url.strip()) if url and url.strip() else None
+        if url and url not in out:
+            out.append(url)
+    return out[:limit] if limit > 0 else out
+
+
+def gallery_hash(urls: List[str]) -> str:
+    """Identity of a gallery (its image URLs in order): the pooled vector is current while this matches."""
+    return hashlib.sha1("\n".join(urls).encode("utf-8")).hexdigest()
+
+
+def image_vector_key(url: str, model: str = EMBEDDING_MODEL) -> str:
+    """Per-image vector cache key (canonical image URL and model)."""
+    return hashlib.sha256(f"{model}\n{url}".encode("utf-8")).hexdigest()
+
+
+def pool_vectors(vectors: List[Optional[List[float]]], method: str = "mean",
+                 temperature: float = 0.1) -> Optional[List[float]]:
+    """
+    L2-normalized pooled vector of a product's views (None entries skipped).
+    "mean": plain average. "attention": softmax weights on each view's cosine similarity to the
+    mean, so the views that agree count more than outliers (size charts, swatches).
+    """
+    rows = [v for v in vectors if v is not None]
+    if not rows:
+        return None
+    m = np.asarray(rows, dtype=np.float32)
+    m = m / np.maximum(np.linalg.norm(m, axis=1, keepdims=True), 1e-12)
+    pooled = m.mean(axis=0)
+    if method == "attention" and len(rows) > 1:
+        scores = m @ (pooled / max(float(np.linalg.norm(pooled)), 1e-12)) / temperature
+        weights = np.exp(scores - scores.max())
+        pooled = (weights / weights.sum()) @ m
+    norm = float(np.linalg.norm(pooled))
+    return (pooled / norm).tolist() if norm > 0 else None
@@ -0,0 +1,103 @@
+"""
+HTTP plumbing shared by every store scraped in one process: one aiohttp session, one requests
+session, and a rate limiter that spaces requests per host. Configs on the same shop share its
+REQUESTS_PER_SECOND budget; different shops do not slow each other down.
+"""
+import asyncio
+import contextlib
+import logging
+import threading
+import time
+from typing import Dict, Optional
+from urllib.parse import urlsplit
+
+import aiohttp
+import requests
+
+from config import HEADERS, MAX_CONCURRENT_REQUESTS, REQUESTS_PER_SECOND
+from utils import setup_session
+
+logger = logging.getLogger(__name__)
+
+
+class HostRateLimiter:
+    """At most `rate` request starts per second per host, across threads and coroutines."""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._next: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def reserve(self, url: str) -> float:
+        """Claim the host's next request slot; returns the seconds to wait before sending."""
+        if not self.interval:
+            return 0.0
+        host = urlsplit(url).netloc.lower()
+        with self._lock:
+            now = time.monotonic()
+            slot = max(now, self._next.get(host, now))
+            self._next[host] = slot + self.interval
+        return slot - now
+
+    async def wait(self, url: str) -> None:
+        delay = self.reserve(url)
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+    def wait_sync(self, url: str) -> None:
+        delay = self.reserve(url)
+        if delay > 0:
+            time.sleep(delay)
+
+
+class HttpClient:
+    """Shared sessions plus the per-host limiter. Sync helpers are for discovery's executor threads."""
+
+    def __init__(self, rate: float = REQUESTS_PER_SECOND, max_per_host: int = MAX_CONCURRENT_REQUESTS):
+        self.limiter = HostRateLimiter(rate)
+        self.max_per_host = max_per_host
+        self.requests = requests.Session()
+        self.requests.headers.update(HEADERS)
+        self._session: Optional[aiohttp.ClientSession] = None
+        self._users = 0
+
+    @contextlib.asynccontextmanager
+    async def open(self):
+        """The shared aiohttp session: opened by the first user, closed when the last one leaves."""
+        if self._users == 0:
+            self._session = setup_session(limit=0, limit_per_host=self.max_per_host)
+        self._users += 1
+        try:
+            yield self._session
+        finally:
+            self._users -= 1
+            if self._users == 0:
+                await self._session.close()
+                self._session = None
+
+    def get(self, url: str, timeout: float = 30) -> requests.Response:
+        """Rate-limited GET on the shared requests session; raises on HTTP errors."""
+        self.limiter.wait_sync(url)
+        response = self.requests.get(url, timeout=timeout)
+        response.raise_for_status()
+        return response
+
+    def fetch_text(self, url: str, timeout: float = 30) -> Optional[str]:
+        """Like utils.sync_fetch_url: the page text, or None (logged) on any error."""
+        try:
+            return self.get(url, timeout).text
+        except Exception as e:
+            logger.warning(f"Error fetching {url}: {e}")
+            return None
+
+
+# Process-wide client shared by all scrapers
+_http_client = None
+
+
+def get_http_client() -> HttpClient:
+    """Get or create the global HTTP client."""
+    global _http_client
+    if _http_client is None:
+        _http_client = HttpClient()
+    return _http_client
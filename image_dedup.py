@@ -0,0 +1,250 @@
+"""
+Run-scoped image embedding deduplication. Stores reuse one photo across products and colourways,
+so each image is embedded once per run and its vector fanned out to every product using it.
+Requests are grouped by canonical CDN URL (normalize_image_url: no ?v=/width=/size suffix) and,
+after the download, by a hash of the image bytes (the same photo under another file name).
+Across runs, a perceptual hash (dHash) of the image a product's vector came from is kept in the
+product state index: a re-uploaded, re-encoded copy of that image reuses the stored vector.
+Inferences requested concurrently are grouped into model batches (BatchedInference).
+Memory stays bounded: only the IMAGE_DEDUP_CACHE_SIZE most recently used URLs and contents keep
+their vectors; an image evicted and requested again is simply embedded again.
+"""
+import asyncio
+import hashlib
+import io
+import logging
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+import numpy as np
+from PIL import Image
+
+from config import IMAGE_DEDUP_CACHE_SIZE, PHASH_MAX_DISTANCE
+from metrics import get_metrics
+from utils import normalize_image_url
+from vector_codec import VECTOR_DTYPE, as_vector, to_vector
+
+logger = logging.getLogger(__name__)
+
+# dHash compares PHASH_SIZE + 1 columns per row of a PHASH_SIZE-row grayscale thumbnail: 64 bits
+PHASH_SIZE = 8
+
+class LruCache:
+    """Dict that keeps only the `max_size` most recently used keys."""
+
+    def __init__(self, max_size: int):
+        self.max_size = max(1, max_size)
+        self._items: "OrderedDict[str, Any]" = OrderedDict()
+
+    def get(self, key: str, default: Any = None) -> Any:
+        if key not in self._items:
+            return default
+        self._items.move_to_end(key)
+        return self._items[key]
+
+    def __setitem__(self, key: str, value: Any) -> None:
+        self._items[key] = value
+        self._items.move_to_end(key)
+        if len(self._items) > self.max_size:
+            self._items.popitem(last=False)
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+
+def perceptual_hash(data: bytes) -> Optional[str]:
+    """
+    64-bit difference hash of an image as 16 hex chars, or None if it cannot be decoded.
+    Stable under re-encoding, resizing and small colour shifts. JPEGs are decoded at reduced scale.
+    """
+    try:
+        with get_metrics().stage("embedding.image_phash"), Image.open(io.BytesIO(data)) as image:
+            image.draft("L", (PHASH_SIZE * 4, PHASH_SIZE * 4))
+            thumb = image.convert("L").resize((PHASH_SIZE + 1, PHASH_SIZE), Image.Resampling.BOX)
+            pixels = np.asarray(thumb, dtype=np.int16)
+    except Exception as e:
+        logger.warning(f"Could not hash image: {e}")
+        return None
+    return np.packbits(pixels[:, 1:] > pixels[:, :-1]).tobytes().hex()
+
+
+def hamming_distance(a: str, b: str) -> int:
+    """Differing bits between two perceptual hashes."""
+    return (int(a, 16) ^ int(b, 16)).bit_count()
+
+
+class BatchedInference:
+    """
+    infer(bytes, label) -> vector that groups concurrent calls into infer_batch(datas, labels) calls
+    of up to `size` images. A partial batch runs after `max_wait` seconds. Batches run one at a
+    time, with `delay` slept after each. Batch tasks are tracked; join() waits for all of them.
+    """
+
+    def __init__(self, infer_batch: Callable[[List[bytes], List[str]], Awaitable[List[Optional[List[float]]]]],
+                 size: int, max_wait: float = 0.05, delay: float = 0.0):
+        self.infer_batch = infer_batch
+        self.size = max(1, size)
+        self.max_wait = max_wait
+        self.delay = delay
+        self._pending: List[Tuple[bytes, str, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._lock: Optional[asyncio.Lock] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.batches = 0
+
+    async def __call__(self, data: bytes, label: str = "") -> Optional[List[float]]:
+        loop = asyncio.get_event_loop()
+        future = loop.create_future()
+        self._pending.append((data, label, future))
+        if len(self._pending) >= self.size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.max_wait, self._flush)
+        return await future
+
+    def _flush(self) -> None:
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        batch, self._pending = self._pending, []
+        if batch:
+            task = asyncio.get_event_loop().create_task(self._run(batch))
+            self._tasks.add(task)
+            task.add_done_callback(self._task_done)
+
+    def _task_done(self, task: asyncio.Task) -> None:
+        self._tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            logger.error(f"Image embedding batch task failed: {task.exception()}")
+
+    async def join(self) -> None:
+        """Run what is still pending and wait for every batch task (call before the loop closes)."""
+        self._flush()
+        while self._tasks:
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+
+    async def _run(self, batch: List[Tuple[bytes, str, asyncio.Future]]) -> None:
+        if self._lock is None:
+            self._lock = asyncio.Lock()
+        try:
+            async with self._lock:
+                try:
+                    vectors = await self.infer_batch([b[0] for b in batch], [b[1] for b in batch])
+                except Exception as e:
+                    logger.error(f"Batch of {len(batch)} image embeddings failed: {e}")
+                    vectors = [None] * len(batch)
+                self.batches += 1
+                get_metrics().incr("embedding_image_batches")
+                for (_, _, future), vector in zip(batch, vectors):
+                    if not future.done():
+                        future.set_result(vector)
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+        finally:
+            for _, _, future in batch:  # a short result list or cancellation must not strand a caller
+                if not future.done():
+                    future.set_result(None)
+
+
+class ImageEmbeddingDeduper:
+    """
+    embed(url) -> vector, with one download per canonical URL and one inference per distinct content.
+    fetch(url) -> bytes | None and infer(bytes, url) -> vector | None are the embedding backend;
+    `delay` is slept after each real inference. Vectors (in EMBEDDING_PRECISION) and perceptual hashes
+    are kept for the `cache_size` most recently used URLs and contents.
+    """
+
+    def __init__(self, fetch: Callable[[str], Awaitable[Optional[bytes]]],
+                 infer: Callable[[bytes, str], Awaitable[Optional[List[float]]]], delay: float = 0.0,
+                 max_distance: int = PHASH_MAX_DISTANCE, cache_size: int = IMAGE_DEDUP_CACHE_SIZE):
+        self.fetch = fetch
+        self.infer = infer
+        self.delay = delay
+        self.max_distance = max_distance
+        # canonical URL -> future of its vector; sha256 of the bytes -> future of (vector, phash)
+        self._by_url: LruCache = LruCache(cache_size)
+        self._by_content: LruCache = LruCache(cache_size)
+        self._phash: LruCache = LruCache(cache_size)
+        self.requests = 0
+        self.url_hits = 0
+        self.content_hits = 0
+        self.phash_hits = 0
+        self.inferences = 0
+
+    async def embed(self, image_url: str, reuse: Optional[Tuple[str, Any]] = None) -> Optional[List[float]]:
+        """
+        reuse: (perceptual hash, vector) of the image the product was last embedded from. If the
+        downloaded image is within max_distance bits of it, that vector is returned without inference.
+        """
+        self.requests += 1
+        get_metrics().incr("embedding_image_requests")
+        key = normalize_image_url(image_url) or image_url
+        future = self._by_url.get(key)
+        if future is not None:
+            self.url_hits += 1
+            get_metrics().incr("embedding_image_dedup_url")
+            vector = await future
+        else:
+            future = self._by_url[key] = asyncio.get_event_loop().create_future()
+            vector = None
+            try:
+                vector = await self._embed_url(key, image_url, reuse)
+            finally:
+                future.set_result(vector)  # concurrent requests for this URL wait on it
+        return to_vector(vector)
+
+    async def aclose(self) -> None:
+        """Wait for the inference backend's outstanding batch tasks, if it runs any."""
+        join = getattr(self.infer, "join", None)
+        if join is not None:
+            await join()
+
+    def phash(self, image_url: str) -> Optional[str]:
+        """Perceptual hash of the image a vector returned this run came from (None if not embedded)."""
+        return self._phash.get(normalize_image_url(image_url) or image_url)
+
+    async def _embed_url(self, key: str, image_url: str, reuse: Optional[Tuple[str, Any]]) -> Optional[np.ndarray]:
+        data = await self.fetch(image_url)
+        if data is None:
+            return None
+        digest = hashlib.sha256(data).hexdigest()
+        future = self._by_content.get(digest)
+        if future is not None:
+            self.content_hits += 1
+            get_metrics().incr("embedding_image_dedup_content")
+            vector, self._phash[key] = await future
+            return vector
+        future = self._by_content[digest] = asyncio.get_event_loop().create_future()
+        vector, phash = None, None
+        try:
+            phash = await asyncio.get_event_loop().run_in_executor(None, perceptual_hash, data)
+            if self._matches(phash, reuse):
+                # Keep the hash of the image the vector came from, so re-encodes cannot drift away from it
+                vector, phash = as_vector(reuse[1]).astype(VECTOR_DTYPE), reuse[0]
+                self.phash_hits += 1
+                get_metrics().incr("embedding_image_phash_reuse")
+            else:
+                result = await self.infer(data, image_url)
+                vector = np.asarray(result, dtype=np.float32).astype(VECTOR_DTYPE) if result is not None else None
+                self.inferences += 1
+                get_metrics().incr("embedding_image_inferences")
+                if self.delay:
+                    await asyncio.sleep(self.delay)
+                if vector is None:
+                    phash = None
+        finally:
+            self._phash[key] = phash
+            future.set_result((vector, phash))
+        return vector
+
+    def _matches(self, phash: Optional[str], reuse: Optional[Tuple[str, Any]]) -> bool:
+        if not phash or not reuse or not reuse[0] or reuse[1] is None:
+            return False
+        return hamming_distance(phash, reuse[0]) <= self.max_distance
+
+    @property
+    def dedup_ratio(self) -> float:
+        """Share of image requests answered without a new inference."""
+        if not self.requests:
+            return 0.0
+        return round((self.url_hits + self.content_hits + self.phash_hits) / self.requests, 4)
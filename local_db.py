@@ -0,0 +1,226 @@
+"""
+Local products store (SQLite) with the same interface as database.SupabaseManager.
+For offline runs, benchmarks and tests: bulk executemany upserts, vectors as BLOBs
+(float32, or float16/bfloat16 with EMBEDDING_PRECISION; see vector_codec).
+"""
+import json
+import logging
+from typing import Any, Dict, Iterable, List, Optional, Set, Tuple
+
+from config import EMBEDDING_DIM
+from database import CONSECUTIVE_MISSES_THRESHOLD
+from state_store import connect_sqlite
+from vector_codec import VECTOR_DTYPE, blob_to_vector, vector_to_blob
+
+logger = logging.getLogger(__name__)
+
+VECTOR_COLUMNS = ("image_embedding", "info_embedding", "gallery_embedding")
+
+_PRODUCTS_DDL = """
+CREATE TABLE IF NOT EXISTS products (
+    id TEXT PRIMARY KEY,
+    source TEXT,
+    product_url TEXT,
+    affiliate_url TEXT,
+    image_url TEXT,
+    additional_images TEXT,
+    brand TEXT,
+    title TEXT,
+    description TEXT,
+    category TEXT,
+    gender TEXT,
+    price TEXT,
+    currency TEXT,
+    size TEXT,
+    second_hand INTEGER DEFAULT 0,
+    image_embedding BLOB,
+    info_embedding BLOB,
+    gallery_embedding BLOB,
+    country TEXT,
+    metadata TEXT,
+    tags TEXT,
+    sale TEXT,
+    other TEXT,
+    created_at TEXT DEFAULT (strftime('%Y-%m-%dT%H:%M:%fZ', 'now')),
+    updated_at TEXT,
+    last_seen TEXT,
+    consecutive_misses INTEGER NOT NULL DEFAULT 0,
+    UNIQUE (source, product_url)
+)
+"""
+
+
+class SQLiteManager:
+    """SQLite products table: same methods/return shapes the scraper uses on SupabaseManager."""
+
+    def __init__(self, path: str = "products.sqlite3"):
+        self.path = path
+        self.conn = connect_sqlite(path)
+        with self.conn:
+            self.conn.execute(_PRODUCTS_DDL)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS products_source_idx ON products (source)")
+        self._columns: Optional[Set[str]] = None
+        with self.conn:
+            self._ensure_columns(VECTOR_COLUMNS)  # stores created before gallery_embedding
+        logger.info(f"Using local SQLite store {path} (embedding dim {EMBEDDING_DIM}, {VECTOR_DTYPE.name})")
+
+    def get_products_columns(self) -> Set[str]:
+        if self._columns is None:
+            self._columns = {r[1] for r in self.conn.execute("PRAGMA table_info(products)")}
+        return self._columns
+
+    def products_has_column(self, column_name: str) -> bool:
+        return column_name in self.get_products_columns()
+
+    def _ensure_columns(self, keys: Iterable[str]) -> None:
+        """Add unknown keys as columns (PostgREST would reject them; locally we just grow the table)."""
+        missing = [k for k in keys if k not in self.get_products_columns()]
+        for k in missing:
+            self.conn.execute(f'ALTER TABLE products ADD COLUMN "{k}"')
+            logger.info(f"Added column products.{k}")
+        if missing:
+            self._columns = None
+
+    @staticmethod
+    def _encode(key: str, value: Any) -> Any:
+        if value is None:
+            return None
+        if key in VECTOR_COLUMNS:
+            return vector_to_blob(value)
+        if isinstance(value, (list, dict)):
+            return json.dumps(value, ensure_ascii=False)
+        if isinstance(value, bool):
+            return int(value)
+        return value
+
+    @staticmethod
+    def _decode_row(row: Dict[str, Any]) -> Dict[str, Any]:
+        for k in VECTOR_COLUMNS:
+            if k in row:
+                row[k] = blob_to_vector(row[k])
+        if isinstance(row.get("tags"), str):
+            try:
+                row["tags"] = json.loads(row["tags"])
+            except ValueError:
+                pass
+        if row.get("second_hand") is not None:
+            row["second_hand"] = bool(row["second_hand"])
+        return row
+
+    def _select(self, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        cur = self.conn.execute(sql, tuple(params))
+        names = [d[0] for d in cur.description]
+        return [self._decode_row(dict(zip(names, r))) for r in cur]
+
+    @staticmethod
+    def _columns_sql(select: str) -> str:
+        cols = [c.strip() for c in (select or "*").split(",") if c.strip()]
+        return "*" if not cols or cols == ["*"] else ",".join(f'"{c}"' for c in cols)
+
+    def get_existing_product_urls(self, source: str) -> Set[str]:
+        rows = self.conn.execute("SELECT product_url FROM products WHERE source = ?", (source,))
+        return {r[0] for r in rows if r[0]}
+
+    def get_existing_products_for_sync(self, source: str) -> List[Dict[str, Any]]:
+        select = "id,product_url,title,description,category,gender,price,size,image_url,additional_images,metadata,tags,country,second_hand,sale,other"
+        return self._select(f"SELECT {self._columns_sql(select)} FROM products WHERE source = ?", (source,))
+
+    def get_products_by_ids(self, ids: List[str], select: str) -> Dict[str, Dict[str, Any]]:
+        if not ids:
+            return {}
+        collected: Dict[str, Dict[str, Any]] = {}
+        cols = self._columns_sql(select if "id" in select.split(",") else f"id,{select}")
+        chunk = 500
+        for i in range(0, len(ids), chunk):
+            batch = ids[i:i + chunk]
+            marks = ",".join("?" * len(batch))
+            for row in self._select(f"SELECT {cols} FROM products WHERE id IN ({marks})", batch):
+                collected[row["id"]] = row
+        return collected
+
+    def delete_products_by_ids(self, ids: List[str]) -> int:
+        if not ids:
+            return 0
+        with self.conn:
+            cur = self.conn.executemany("DELETE FROM products WHERE id = ?", ((pid,) for pid in ids))
+        return cur.rowcount
+
+    def _write_rows(self, products_data: List[Dict[str, Any]], conflict: str) -> int:
+        """One executemany per batch; all rows get the same key set (like _normalize_batch)."""
+        keys: List[str] = []
+        for p in products_data:
+            for k in p.keys():
+                if k not in keys:
+                    keys.append(k)
+        cols = ",".join(f'"{k}"' for k in keys)
+        marks = ",".join("?" * len(keys))
+        if conflict == "ignore":
+            sql = f"INSERT OR IGNORE INTO products ({cols}) VALUES ({marks})"
+        else:
+            updates = ",".join(f'"{k}"=excluded."{k}"' for k in keys if k != "id")
+            sql = f"INSERT INTO products ({cols}) VALUES ({marks}) ON CONFLICT(id) DO UPDATE SET {updates}"
+        params = [tuple(self._encode(k, p.get(k)) for k in keys) for p in products_data]
+        with self.conn:
+            self._ensure_columns(keys)
+            self.conn.executemany(sql, params)
+        return len(params)
+
+    def insert_products_batch(
+        self,
+        products_data: List[Dict[str, Any]],
+        *,
+        ignore_duplicates: bool = True,
+    ) -> int:
+        if not products_data:
+            return 0
+        try:
+            return self._write_rows(products_data, "ignore" if ignore_duplicates else "merge")
+        except Exception as e:
+            logger.error(f"Local insert failed: {e}")
+            return 0
+
+    def upsert_products_batch(
+        self,
+        products_data: List[Dict[str, Any]],
+    ) -> Tuple[int, int, List[Dict[str, Any]]]:
+        """Upsert all rows in one transaction. Returns (success_count, failed_count, failed_products)."""
+        if not products_data:
+            return 0, 0, []
+        try:
+            success = self._write_rows(products_data, "merge")
+        except Exception as e:
+            logger.error(f"Local upsert failed: {e}")
+            return 0, len(products_data), list(products_data)
+        logger.info(f"Batch upsert completed: {success}/{len(products_data)} products")
+        return success, 0, []
+
+    def mark_and_sweep_products(
+        self,
+        source: str,
+        seen_ids: List[str],
+        threshold: int = CONSECUTIVE_MISSES_THRESHOLD,
+    ) -> Optional[Dict[str, int]]:
+        """Same semantics as sql/mark_and_sweep_products.sql, in one SQLite transaction."""
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS _seen (id TEXT PRIMARY KEY)")
+            self.conn.execute("DELETE FROM _seen")
+            self.conn.executemany("INSERT OR IGNORE INTO _seen (id) VALUES (?)", ((pid,) for pid in seen_ids if pid))
+            seen = self.conn.execute(
+                "UPDATE products SET last_seen = strftime('%Y-%m-%dT%H:%M:%fZ', 'now'), consecutive_misses = 0"
+                " WHERE source = ? AND id IN (SELECT id FROM _seen)",
+                (source,),
+            ).rowcount
+            missed = self.conn.execute(
+                "UPDATE products SET consecutive_misses = coalesce(consecutive_misses, 0) + 1"
+                " WHERE source = ? AND id NOT IN (SELECT id FROM _seen)",
+                (source,),
+            ).rowcount
+            deleted = self.conn.execute(
+                "DELETE FROM products WHERE source = ? AND id NOT IN (SELECT id FROM _seen)"
+                " AND consecutive_misses >= ?",
+                (source, int(threshold)),
+            ).rowcount
+        return {"seen": seen, "missed": missed, "deleted": deleted}
+
+    def close(self) -> None:
+        self.conn.close()
@@ -4,11 +4,20 @@ About Blank Fashion Store Scraper
 Scrapes all products, generates image embeddings, and stores in Supabase
 """
 
+import argparse
 import asyncio
 import logging
+import os
+import subprocess
 import sys
+from typing import Callable, Dict, List, Optional
+
+from config import SHARD_QUEUE_PATH
 from scraper import AboutBlankScraper
-from config import SHOP_ALL_URL
+from sharding import ShardQueueBackend, open_shard_queue
+from stores import load_store_configs
+from metrics import write_run_report
+from profiling import start_profiler, stop_profiler
 
 # Configure logging
 logging.basicConfig(
@@ -22,44 +31,115 @@ logging.basicConfig(
 
 logger = logging.getLogger(__name__)
 
-async def main():
-    """Main scraper execution"""
-    logger.info("Starting About Blank scraper...")
+async def run_store(scraper: AboutBlankScraper, args, queue: Optional[ShardQueueBackend] = None,
+                    workers_alive: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+    """One store's run, in the role chosen on the command line (single process, shard coordinator or worker)."""
+    if args.worker is not None:
+        await scraper._in_db_thread(scraper.replay_upsert_journal)
+        return await scraper.run_shard_worker(queue, args.worker)
 
-    try:
-        # Initialize scraper
-        scraper = AboutBlankScraper()
+    if args.shards:
+        result = await scraper.run_shard_coordinator(queue, args.shards, workers_alive)
+    else:
+        # Finish rows a crashed previous run prepared but never upserted
+        await scraper._in_db_thread(scraper.replay_upsert_journal)
+        # Stream discover -> scrape -> diff -> embed -> upsert; stale cleanup runs at the end
+        result = await scraper.run_pipeline()
 
-        # Discover product URLs
-        logger.info("Discovering product URLs...")
-        product_urls = await scraper.discover_product_urls()
+    if not result["scraped"] and not result["unmodified"]:
+        logger.warning(f"No products were successfully scraped (source={scraper.source})")
+        return result
+
+    logger.info(
+        f"Summary ({scraper.source}): {result['discovered']} discovered, {result['scraped']} scraped | "
+        f"inserted={result['inserted']}, updated={result['updated']}, "
+        f"skipped={result['skipped']}, deleted={result['deleted']}, unmodified={result['unmodified']}"
+    )
+    return result
+
+def spawn_local_workers(n_shards: int, queue_path: str) -> List[subprocess.Popen]:
+    """Start one `main.py --worker i` process per shard on this machine."""
+    return [
+        subprocess.Popen([sys.executable, os.path.abspath(__file__), "--worker", str(i), "--queue", queue_path])
+        for i in range(n_shards)
+    ]
 
-        if not product_urls:
-            logger.info("No new products found to scrape")
-            return
+async def main(args):
+    """Main scraper execution"""
+    stores = load_store_configs()
+    logger.info(f"Starting About Blank scraper for {len(stores)} store(s)...")
 
-        # Scrape all products
-        logger.info(f"Found {len(product_urls)} products to scrape")
-        products = await scraper.scrape_all_products(product_urls)
+    results: Dict[str, Dict[str, int]] = {}
+    queue = open_shard_queue(args.queue) if args.shards or args.worker is not None else None
+    workers: List[subprocess.Popen] = []
+    try:
+        workers_alive = None
+        if args.spawn_workers:
+            workers = spawn_local_workers(args.shards, args.queue)
+            workers_alive = lambda: any(w.poll() is None for w in workers)
 
-        if not products:
-            logger.warning("No products were successfully scraped")
-            return
+        # Stores run concurrently and share the HTTP client, per-host rate limits and the embedder
+        scrapers = [AboutBlankScraper(store=store, shard=args.worker) for store in stores]
+        outcomes = await asyncio.gather(
+            *(run_store(s, args, queue, workers_alive) for s in scrapers), return_exceptions=True,
+        )
 
-        # Sync to database (insert new, update changed, skip same, delete missing)
-        sync_result = await scraper.sync_products_to_db(products)
+        failed = []
+        for scraper, outcome in zip(scrapers, outcomes):
+            if isinstance(outcome, BaseException):
+                logger.error(f"Scraping failed for {scraper.source}: {outcome}")
+                failed.append(scraper.source)
+            else:
+                results[scraper.source] = outcome
+        if failed:
+            raise RuntimeError(f"Scraping failed for: {', '.join(failed)}")
 
         logger.info("Scraping completed successfully!")
-        logger.info(
-            f"Summary: {len(product_urls)} discovered, {len(products)} scraped | "
-            f"inserted={sync_result['inserted']}, updated={sync_result['updated']}, "
-            f"skipped={sync_result['skipped']}, deleted={sync_result['deleted']}"
-        )
 
     except Exception as e:
         logger.error(f"Fatal error during scraping: {e}")
         raise
+    finally:
+        for w in workers:
+            w.wait()
+        if queue is not None:
+            queue.close()
+        # Per-stage timings for this run (also written when the run failed)
+        suffix = f".shard{args.worker}" if args.worker is not None else ""
+        if len(stores) == 1:
+            write_run_report(stores[0].source, results.get(stores[0].source), suffix)
+        else:
+            write_run_report(
+                ",".join(s.source for s in stores),
+                {f"{source}.{name}": value for source, result in results.items() for name, value in result.items()},
+                suffix,
+            )
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="About Blank scraper")
+    parser.add_argument(
+        "--profile", action="store_true",
+        help="Write cProfile, per-stage stack samples, tracemalloc snapshots and torch traces",
+    )
+    parser.add_argument("--profile-dir", default="profiles", help="Parent directory for timestamped profiles")
+    shards = parser.add_argument_group("sharded runs (see sharding.py)")
+    role = shards.add_mutually_exclusive_group()
+    role.add_argument("--shards", type=int, default=0, help="Coordinate a run split across N shard workers")
+    role.add_argument("--worker", type=int, default=None, help="Run as the worker for shard I")
+    shards.add_argument("--spawn-workers", action="store_true", help="With --shards: start the N workers locally")
+    shards.add_argument("--queue", default=SHARD_QUEUE_PATH, help="Shared SQLite queue file (SHARD_QUEUE_BACKEND=sqlite)")
+    args = parser.parse_args()
+    if args.spawn_workers and not args.shards:
+        parser.error("--spawn-workers needs --shards N")
+    return args
 
 if __name__ == "__main__":
-    # Run the scraper
-    asyncio.run(main())
\ No newline at end of file
+    args = parse_args()
+    if args.profile:
+        start_profiler(args.profile_dir)
+    try:
+        # Run the scraper
+        asyncio.run(main(args))
+    finally:
+        if args.profile:
+            logger.info(f"Profile: {stop_profiler()}")
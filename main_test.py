@@ -30,6 +30,9 @@ async def main():
         # Initialize scraper
         scraper = AboutBlankScraper()
 
+        # Finish rows a crashed previous run prepared but never upserted
+        scraper.replay_upsert_journal()
+
         # Discover product URLs
         logger.info("Discovering product URLs...")
         product_urls = await scraper.discover_product_urls()
@@ -52,7 +55,8 @@ async def main():
             return
 
         # Sync to database
-        sync_result = await scraper.sync_products_to_db(products)
+        # A truncated list must not count the rest of the catalog as missed (stale cleanup)
+        sync_result = await scraper.sync_products_to_db(products, sweep=len(test_urls) == len(product_urls))
 
         logger.info("Test scraping completed successfully!")
         logger.info(
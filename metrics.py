@@ -0,0 +1,235 @@
+"""
+Per-stage timing/throughput instrumentation and the machine-readable run report.
+Stages record wall time, count, bytes and latency percentiles; the report is written as
+JSON and optionally as a Prometheus textfile for the node exporter's textfile collector.
+"""
+import contextlib
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional
+from urllib.parse import urlparse
+
+logger = logging.getLogger(__name__)
+
+
+def _percentile(sorted_values: List[float], pct: float) -> float:
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    rank = max(1, math.ceil(pct / 100.0 * len(sorted_values)))
+    return sorted_values[min(rank, len(sorted_values)) - 1]
+
+
+class _Stage:
+    __slots__ = ("count", "errors", "total_seconds", "bytes", "samples")
+
+    def __init__(self):
+        self.count = 0
+        self.errors = 0
+        self.total_seconds = 0.0
+        self.bytes = 0
+        self.samples: List[float] = []
+
+
+class StageTimer:
+    """Handle yielded by RunMetrics.stage(); set `.bytes` to attribute payload size."""
+
+    __slots__ = ("bytes",)
+
+    def __init__(self):
+        self.bytes = 0
+
+
+class RunMetrics:
+    """Thread-safe collector (embedding runs in executor threads)."""
+
+    def __init__(self):
+        self.started_at = datetime.now(timezone.utc)
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self._stages: Dict[str, _Stage] = {}
+        self.counters: Dict[str, int] = {}
+        self._listeners: List[Any] = []
+
+    def record(self, name: str, seconds: float, nbytes: int = 0, error: bool = False) -> None:
+        with self._lock:
+            st = self._stages.get(name)
+            if st is None:
+                st = self._stages[name] = _Stage()
+            st.count += 1
+            st.total_seconds += seconds
+            st.bytes += int(nbytes or 0)
+            st.samples.append(seconds)
+            if error:
+                st.errors += 1
+
+    def add_stage_listener(self, listener: Any) -> None:
+        """Notify `listener.stage_enter(name, frame)` / `stage_exit(name, frame)` (the profiler)."""
+        self._listeners = self._listeners + [listener]
+
+    def remove_stage_listener(self, listener: Any) -> None:
+        self._listeners = [x for x in self._listeners if x is not listener]
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Time a block: `with get_metrics().stage("product.fetch") as t: ...; t.bytes = len(html)`."""
+        timer = StageTimer()
+        listeners = self._listeners
+        frame = None
+        if listeners:
+            # Frame of the `with` statement (skip contextlib), so samples can be attributed to this stage
+            frame = sys._getframe(1)
+            while frame is not None and frame.f_code.co_filename == contextlib.__file__:
+                frame = frame.f_back
+            for listener in listeners:
+                listener.stage_enter(name, frame)
+        start = time.perf_counter()
+        error = False
+        try:
+            yield timer
+        except BaseException:
+            error = True
+            raise
+        finally:
+            self.record(name, time.perf_counter() - start, timer.bytes, error)
+            for listener in listeners:
+                listener.stage_exit(name, frame)
+
+    def incr(self, name: str, value: int = 1) -> None:
+        with self._lock:
+            self.counters[name] = self.counters.get(name, 0) + int(value)
+
+    def requests_hook(self, prefix: str):
+        """requests response hook recording each HTTP call as `<prefix>.<METHOD> <path>`."""
+        def hook(response, *args, **kwargs):
+            path = urlparse(response.url).path
+            if "/rest/v1/" in path:
+                path = path.split("/rest/v1/", 1)[1]
+            self.record(
+                f"{prefix}.{response.request.method} {path}",
+                response.elapsed.total_seconds(),
+                len(response.content or b""),
+                error=response.status_code >= 400,
+            )
+        return hook
+
+    def report(self, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        """Snapshot as a JSON-serializable dict."""
+        wall = time.perf_counter() - self._t0
+        stages: Dict[str, Any] = {}
+        with self._lock:
+            for name, st in sorted(self._stages.items()):
+                samples = sorted(st.samples)
+                stages[name] = {
+                    "count": st.count,
+                    "errors": st.errors,
+                    "total_seconds": round(st.total_seconds, 6),
+                    "p50_seconds": round(_percentile(samples, 50), 6),
+                    "p95_seconds": round(_percentile(samples, 95), 6),
+                    "p99_seconds": round(_percentile(samples, 99), 6),
+                    "max_seconds": round(samples[-1], 6) if samples else 0.0,
+                    "bytes": st.bytes,
+                    "per_second": round(st.count / st.total_seconds, 3) if st.total_seconds > 0 else None,
+                }
+            counters = dict(self.counters)
+        out = {
+            "started_at": self.started_at.isoformat(),
+            "wall_seconds": round(wall, 3),
+            "stages": stages,
+            "counters": counters,
+        }
+        if extra:
+            out.update(extra)
+        return out
+
+    def write_json(self, path: str, extra: Optional[Dict[str, Any]] = None) -> Dict[str, Any]:
+        report = self.report(extra)
+        _atomic_write(path, json.dumps(report, indent=2, default=str))
+        logger.info(f"Wrote run report to {path}")
+        return report
+
+    def write_prometheus(self, path: str, source: str, extra: Optional[Dict[str, Any]] = None) -> None:
+        """Prometheus text exposition format (for node_exporter --collector.textfile.directory)."""
+        report = self.report(extra)
+        label_source = _label(source)
+        lines = [
+            "# HELP scraper_run_wall_seconds Wall time of the last run.",
+            "# TYPE scraper_run_wall_seconds gauge",
+            f'scraper_run_wall_seconds{{source="{label_source}"}} {report["wall_seconds"]}',
+            "# HELP scraper_run_timestamp_seconds Start time of the last run.",
+            "# TYPE scraper_run_timestamp_seconds gauge",
+            f'scraper_run_timestamp_seconds{{source="{label_source}"}} {self.started_at.timestamp():.0f}',
+        ]
+        series = [
+            ("scraper_stage_count", "count", "Operations per stage in the last run."),
+            ("scraper_stage_errors", "errors", "Failed operations per stage in the last run."),
+            ("scraper_stage_seconds_total", "total_seconds", "Summed latency per stage in the last run."),
+            ("scraper_stage_bytes", "bytes", "Payload bytes per stage in the last run."),
+        ]
+        for metric, key, help_text in series:
+            lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} gauge"]
+            for name, st in report["stages"].items():
+                lines.append(f'{metric}{{source="{label_source}",stage="{_label(name)}"}} {st[key]}')
+        lines += [
+            "# HELP scraper_stage_latency_seconds Latency quantiles per stage in the last run.",
+            "# TYPE scraper_stage_latency_seconds gauge",
+        ]
+        for name, st in report["stages"].items():
+            for q, key in (("0.5", "p50_seconds"), ("0.95", "p95_seconds"), ("0.99", "p99_seconds")):
+                lines.append(
+                    f'scraper_stage_latency_seconds{{source="{label_source}",stage="{_label(name)}",quantile="{q}"}} {st[key]}'
+                )
+        lines += ["# HELP scraper_run_result Run result counters.", "# TYPE scraper_run_result gauge"]
+        for name, value in {**report["counters"], **(extra or {}).get("result", {})}.items():
+            lines.append(f'scraper_run_result{{source="{label_source}",name="{_label(name)}"}} {value}')
+        _atomic_write(path, "\n".join(lines) + "\n")
+        logger.info(f"Wrote Prometheus metrics to {path}")
+
+
+def _label(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"')
+
+
+def _atomic_write(path: str, text: str) -> None:
+    """Write via temp file + rename so collectors never read a half-written file."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(text)
+    os.replace(tmp, path)
+
+
+def write_run_report(source: str, result: Optional[Dict[str, Any]] = None, suffix: str = "") -> None:
+    """
+    Write the JSON report (RUN_REPORT_PATH) and Prometheus textfile (PROMETHEUS_TEXTFILE) if configured.
+    `suffix` goes before the file extension (shard workers: run_report.shard0.json).
+    """
+    from config import RUN_REPORT_PATH, PROMETHEUS_TEXTFILE
+    extra = {"source": source, "result": dict(result or {})}
+    try:
+        if RUN_REPORT_PATH:
+            root, ext = os.path.splitext(RUN_REPORT_PATH)
+            get_metrics().write_json(root + suffix + ext, extra)
+        if PROMETHEUS_TEXTFILE:
+            root, ext = os.path.splitext(PROMETHEUS_TEXTFILE)
+            get_metrics().write_prometheus(root + suffix + ext, source, extra)
+    except Exception as e:
+        logger.warning(f"Could not write run report: {e}")
+
+
+# Global metrics instance for the current run
+_metrics = None
+
+
+def get_metrics() -> RunMetrics:
+    """Get or create global run metrics instance."""
+    global _metrics
+    if _metrics is None:
+        _metrics = RunMetrics()
+    return _metrics
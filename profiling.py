@@ -0,0 +1,262 @@
+"""
+Opt-in run profiler (`python main.py --profile`).
+Captures, into one timestamped directory:
+- cpu.prof / cpu_top.txt: cProfile of the event-loop thread (deterministic, open with snakeviz/pstats)
+- stages.txt / stacks.folded: wall-clock stack samples of all threads, attributed to the
+  metrics stage active in the sampled frame (so executor threads and interleaved tasks are split correctly)
+- memory/*.tracemalloc + memory.txt: tracemalloc snapshot the first time each stage completes
+- torch/*.json: torch profiler traces around the first SigLIP inference calls (chrome://tracing)
+"""
+import contextlib
+import cProfile
+import io
+import logging
+import os
+import pstats
+import sys
+import threading
+import tracemalloc
+from collections import Counter, defaultdict
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from metrics import get_metrics
+
+logger = logging.getLogger(__name__)
+
+UNSTAGED = "(unstaged)"
+TOP_FUNCTIONS = 15
+
+
+def _func_key(code) -> str:
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class RunProfiler:
+    """Collects the profiles listed in the module docstring; start() before the run, stop() after."""
+
+    def __init__(self, out_dir: str, sample_interval: float = 0.005, torch_traces: int = 3):
+        self.out_dir = out_dir
+        self.sample_interval = sample_interval
+        self.torch_traces = torch_traces
+        self._cprofile = cProfile.Profile()
+        self._lock = threading.Lock()
+        self._active: Dict[int, List[str]] = {}  # id(frame) -> stage names opened in that frame
+        self._self_samples: Dict[str, Counter] = defaultdict(Counter)
+        self._total_samples: Dict[str, Counter] = defaultdict(Counter)
+        self._stage_samples: Counter = Counter()
+        self._folded: Counter = Counter()
+        self._snapshots: List[Tuple[str, str, int, int]] = []  # (stage, file, traced bytes, peak bytes)
+        self._mem_peak: Dict[str, int] = {}
+        self._torch_lock = threading.Lock()
+        self._torch_done: Counter = Counter()
+        self._torch_tables: List[Tuple[str, str]] = []
+        self._stop = threading.Event()
+        self._sampler: Optional[threading.Thread] = None
+
+    # -- lifecycle ---------------------------------------------------------
+
+    def start(self) -> None:
+        os.makedirs(os.path.join(self.out_dir, "memory"), exist_ok=True)
+        tracemalloc.start()
+        get_metrics().add_stage_listener(self)
+        self._sampler = threading.Thread(target=self._sample_loop, name="profiler-sampler", daemon=True)
+        self._sampler.start()
+        self._cprofile.enable()
+        logger.info(f"Profiling enabled, writing to {self.out_dir}")
+
+    def stop(self) -> None:
+        self._cprofile.disable()
+        self._stop.set()
+        if self._sampler is not None:
+            self._sampler.join()
+        get_metrics().remove_stage_listener(self)
+        self._take_snapshot("end")
+        tracemalloc.stop()
+        self._write_cpu()
+        self._write_stages()
+        self._write_memory()
+        self._write_torch()
+        logger.info(f"Profile written to {self.out_dir}")
+
+    # -- stage boundaries (called by RunMetrics.stage) ---------------------
+
+    def stage_enter(self, name: str, frame) -> None:
+        with self._lock:
+            self._active.setdefault(id(frame), []).append(name)
+
+    def stage_exit(self, name: str, frame) -> None:
+        with self._lock:
+            names = self._active.get(id(frame))
+            if names:
+                names.pop()
+                if not names:
+                    del self._active[id(frame)]
+            first = name not in self._mem_peak
+            current, _ = tracemalloc.get_traced_memory()
+            self._mem_peak[name] = max(self._mem_peak.get(name, 0), current)
+        if first:
+            self._take_snapshot(name)
+
+    # -- sampling ----------------------------------------------------------
+
+    def _sample_loop(self) -> None:
+        me = threading.get_ident()
+        while not self._stop.wait(self.sample_interval):
+            frames = sys._current_frames()
+            with self._lock:
+                active = {k: v[-1] for k, v in self._active.items()}
+            for tid, frame in frames.items():
+                if tid == me:
+                    continue
+                stage = None
+                codes = []
+                f = frame
+                while f is not None:
+                    codes.append(f.f_code)
+                    stage = active.get(id(f))
+                    if stage is not None:
+                        break  # only the stage's own subtree counts towards it
+                    f = f.f_back
+                stage = stage or UNSTAGED
+                self._stage_samples[stage] += 1
+                self._self_samples[stage][_func_key(codes[0])] += 1
+                for key in {_func_key(c) for c in codes}:
+                    self._total_samples[stage][key] += 1
+                self._folded[";".join([stage] + [c.co_name for c in reversed(codes[:64])])] += 1
+
+    # -- memory ------------------------------------------------------------
+
+    def _take_snapshot(self, stage: str) -> None:
+        # Dump only: filtering/diffing ~10^5 traces takes seconds, so that happens once in _write_memory
+        if not tracemalloc.is_tracing():
+            return
+        current, peak = tracemalloc.get_traced_memory()
+        path = os.path.join(self.out_dir, "memory", f"{len(self._snapshots):02d}_{stage}.tracemalloc")
+        tracemalloc.take_snapshot().dump(path)
+        self._snapshots.append((stage, path, current, peak))
+
+    # -- torch -------------------------------------------------------------
+
+    @contextlib.contextmanager
+    def torch_trace(self, label: str):
+        """Trace the first `torch_traces` calls per label; concurrent calls are not traced."""
+        if self._torch_done[label] >= self.torch_traces or not self._torch_lock.acquire(blocking=False):
+            yield
+            return
+        try:
+            import torch
+            from torch.profiler import ProfilerActivity, profile
+
+            n = self._torch_done[label]
+            self._torch_done[label] += 1
+            activities = [ProfilerActivity.CPU]
+            if torch.cuda.is_available():
+                activities.append(ProfilerActivity.CUDA)
+            with profile(activities=activities, record_shapes=True, profile_memory=True) as prof:
+                yield
+            os.makedirs(os.path.join(self.out_dir, "torch"), exist_ok=True)
+            prof.export_chrome_trace(os.path.join(self.out_dir, "torch", f"{label}_{n}.json"))
+            self._torch_tables.append(
+                (f"{label} #{n}", prof.key_averages().table(sort_by="self_cpu_time_total", row_limit=TOP_FUNCTIONS))
+            )
+        finally:
+            self._torch_lock.release()
+
+    # -- reports -----------------------------------------------------------
+
+    def _write_cpu(self) -> None:
+        self._cprofile.dump_stats(os.path.join(self.out_dir, "cpu.prof"))
+        buf = io.StringIO()
+        stats = pstats.Stats(self._cprofile, stream=buf).strip_dirs()
+        buf.write("== cProfile (event-loop thread), by cumulative time ==\n")
+        stats.sort_stats("cumulative").print_stats(40)
+        buf.write("\n== cProfile (event-loop thread), by own time ==\n")
+        stats.sort_stats("tottime").print_stats(40)
+        with open(os.path.join(self.out_dir, "cpu_top.txt"), "w", encoding="utf-8") as f:
+            f.write(buf.getvalue())
+
+    def _write_stages(self) -> None:
+        report = get_metrics().report()["stages"]
+        lines = [
+            f"Wall-clock samples every {self.sample_interval * 1000:.0f} ms across all threads.",
+            f"{UNSTAGED} includes idle threads (event loop select, pool workers waiting).",
+            "",
+        ]
+        ordered = sorted(self._stage_samples.items(), key=lambda kv: (kv[0] == UNSTAGED, -kv[1]))
+        for stage, n in ordered:
+            st = report.get(stage, {})
+            header = f"== {stage}: {n} samples"
+            if st:
+                header += f", {st['count']} calls, {st['total_seconds']:.3f}s total, p95 {st['p95_seconds'] * 1000:.1f} ms"
+            lines.append(header + " ==")
+            lines.append(f"  {'self':>6} {'total':>6}  function")
+            own = self._self_samples[stage]
+            ranked = sorted(self._total_samples[stage].items(), key=lambda kv: (-own[kv[0]], -kv[1]))
+            for key, total in ranked[:TOP_FUNCTIONS]:
+                lines.append(f"  {own[key]:>6} {total:>6}  {key}")
+            lines.append("")
+        with open(os.path.join(self.out_dir, "stages.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines))
+        with open(os.path.join(self.out_dir, "stacks.folded"), "w", encoding="utf-8") as f:
+            for stack, count in self._folded.items():
+                f.write(f"{stack} {count}\n")
+
+    def _write_memory(self) -> None:
+        lines = [
+            "tracemalloc at the first completion of each stage (snapshots in memory/, diff any two with",
+            "tracemalloc.Snapshot.load(a).compare_to(tracemalloc.Snapshot.load(b), 'lineno'))",
+            "",
+            f"{'#':>3}  {'stage':<32}{'traced MB':>10}{'peak MB':>10}{'max at exit MB':>16}",
+        ]
+        for i, (stage, _, current, peak) in enumerate(self._snapshots):
+            at_exit = self._mem_peak.get(stage)
+            lines.append(
+                f"{i:>3}  {stage:<32}{current / 1e6:>10.1f}{peak / 1e6:>10.1f}"
+                + (f"{at_exit / 1e6:>16.1f}" if at_exit is not None else f"{'':>16}")
+            )
+        if len(self._snapshots) >= 2:
+            first = tracemalloc.Snapshot.load(self._snapshots[0][1])
+            last = tracemalloc.Snapshot.load(self._snapshots[-1][1])
+            lines += ["", f"== Top growth: {self._snapshots[0][0]} -> {self._snapshots[-1][0]} =="]
+            for stat in last.compare_to(first, "lineno")[:TOP_FUNCTIONS]:
+                lines.append(f"  {stat}")
+        with open(os.path.join(self.out_dir, "memory.txt"), "w", encoding="utf-8") as f:
+            f.write("\n".join(lines) + "\n")
+
+    def _write_torch(self) -> None:
+        if not self._torch_tables:
+            return
+        with open(os.path.join(self.out_dir, "torch_top.txt"), "w", encoding="utf-8") as f:
+            for label, table in self._torch_tables:
+                f.write(f"== {label} ==\n{table}\n\n")
+
+
+# Active profiler for this process (None unless --profile)
+_profiler = None
+
+
+def start_profiler(root: str = "profiles") -> RunProfiler:
+    """Start profiling into <root>/<timestamp>/."""
+    global _profiler
+    out_dir = os.path.join(root, datetime.now().strftime("%Y%m%d_%H%M%S"))
+    _profiler = RunProfiler(out_dir)
+    _profiler.start()
+    return _profiler
+
+
+def stop_profiler() -> Optional[str]:
+    """Stop and write reports; returns the output directory."""
+    global _profiler
+    if _profiler is None:
+        return None
+    profiler, _profiler = _profiler, None
+    profiler.stop()
+    return profiler.out_dir
+
+
+def torch_profile(label: str):
+    """Context manager around a SigLIP forward pass; no-op unless profiling."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.torch_trace(label)
@@ -1,43 +1,85 @@
 import asyncio
 import aiohttp
+import hashlib
 import json
-import requests
 from bs4 import BeautifulSoup
 import re
 from urllib.parse import urljoin
-from typing import List, Dict, Any, Optional, Tuple
+from typing import Callable, List, Dict, Any, Optional, Tuple
 from datetime import datetime, timezone
-from config import BASE_URL, SHOP_ALL_URL, HEADERS, REQUESTS_PER_SECOND, MAX_CONCURRENT_REQUESTS, SOURCE
+from config import (
+    MAX_CONCURRENT_REQUESTS,
+    PIPELINE_QUEUE_SIZE, PIPELINE_FLUSH_SECONDS, EMBEDDING_DELAY, CATEGORY_SCOPE, DISCOVERY_MODE,
+    RUN_MODE, INCREMENTAL_MAX_AGE_HOURS, FULL_SWEEP_INTERVAL_HOURS, SHARD_POLL_SECONDS, SHARD_TIMEOUT_SECONDS,
+    TEXT_EMBEDDING_BATCH_SIZE, IMAGE_EMBEDDING_BATCH_SIZE, EMBEDDING_CACHE_DAYS,
+    GALLERY_EMBEDDINGS, GALLERY_MAX_IMAGES, GALLERY_IMAGE_BUDGET, GALLERY_POOLING,
+)
 from utils import (
-    generate_product_id, clean_text, extract_sizes,
-    extract_categories_from_page, extract_prices_with_currencies,
-    determine_category, determine_gender, is_in_stock, get_all_product_image_urls,
-    setup_session, sync_fetch_url
+    CollectionNavIndex, ProductUrlIndex, canonical_product_url, generate_product_id, clean_text, extract_sizes, build_variant_table,
+    variant_sizes, variant_sizes_in_stock, variant_in_stock,
+    extract_categories_from_page, extract_prices_with_currencies, extract_shopify_product_json,
+    determine_category, determine_gender, is_in_stock, get_all_product_image_urls, normalize_image_url,
 )
-from embedding import generate_image_embedding, generate_text_embedding
-from database import get_db_manager
+from embedding import embed_image_batch, fetch_image_bytes, generate_text_embedding, generate_text_embeddings
+from database import StorageBackend, UPSERT_CHUNK_SIZE, get_db_manager
+from state_store import ProductStateIndex, StaleStateStore, UpsertJournal, VectorCache, refetch_reason
+from export import STRING_COLUMNS, VECTOR_COLUMNS, open_run_snapshot
+from sitemap import read_product_sitemap
+from metrics import get_metrics
+from http_client import HttpClient, get_http_client
+from stores import StoreConfig, default_store
+from sharding import ShardQueueBackend
+from image_dedup import BatchedInference, ImageEmbeddingDeduper
+from gallery import gallery_hash, gallery_image_urls, image_vector_key, pool_vectors
+from text_embedding_cache import TextEmbeddingCache
+from vector_codec import as_vector, to_vector
 import logging
 from tqdm import tqdm
 import time
+from concurrent.futures import ThreadPoolExecutor
 
 logger = logging.getLogger(__name__)
 
-EMBEDDING_DELAY = 0.5
 CONSECUTIVE_MISSES_THRESHOLD = 2
+PRODUCTS_JSON_PAGE_SIZE = 250  # Shopify's maximum `limit` for products.json
 
+# Fields whose change means a product row needs an update (tags are compared separately).
+SYNC_COMPARE_KEYS = (
+    "title", "description", "category", "gender", "price", "size",
+    "image_url", "additional_images", "metadata", "country", "second_hand", "sale", "other",
+)
 
-def _discover_via_shopify_json(base_url: str, collection_handle: str, existing_urls: set) -> List[str]:
-    """Fallback: discover product URLs via Shopify's collection products.json API."""
-    product_urls = []
+# Columns loaded from the db to decide whether a scraped product changed.
+SYNC_COMPARE_SELECT = ",".join([
+    "id",
+    "product_url",
+    "image_url",
+    "title",
+    "description",
+    "category",
+    "gender",
+    "price",
+    "size",
+    "additional_images",
+    "metadata",
+    "tags",
+    "country",
+    "second_hand",
+    "sale",
+    "other",
+])
+
+
+def _discover_via_shopify_json(http: HttpClient, base_url: str, collection_handle: str) -> List[Tuple[str, Optional[str]]]:
+    """Discover (product URL, updated_at) pairs via Shopify's collection products.json API."""
+    entries = []
     page = 1
     base_json_url = f"{base_url}/collections/{collection_handle}/products.json"
 
     while True:
-        url = f"{base_json_url}?page={page}"
+        url = f"{base_json_url}?limit={PRODUCTS_JSON_PAGE_SIZE}&page={page}"
         try:
-            r = requests.get(url, headers=HEADERS, timeout=30)
-            r.raise_for_status()
-            data = r.json()
+            data = http.get(url).json()
         except Exception as e:
             logger.warning(f"Shopify JSON fallback failed for {url}: {e}")
             break
@@ -50,50 +92,247 @@ def _discover_via_shopify_json(base_url: str, collection_handle: str, existing_u
             handle = p.get("handle")
             if not handle:
                 continue
-            full_url = f"{base_url}/products/{handle}"
-            if full_url not in existing_urls:
-                product_urls.append(full_url)
+            entries.append((f"{base_url}/products/{handle}", p.get("updated_at")))
 
-        # Shopify usually returns 50–250 per page; if less, we're done
-        if len(products) < 50:
+        # A short page is the last one
+        if len(products) < PRODUCTS_JSON_PAGE_SIZE:
             break
         page += 1
-        time.sleep(0.5)
 
-    return product_urls
+    return entries
 
 
 class AboutBlankScraper:
-    def __init__(self):
-        self.db_manager = get_db_manager()
+    def __init__(self, db_manager: Optional[StorageBackend] = None, *, embeddings: bool = True,
+                 store: Optional[StoreConfig] = None, http: Optional[HttpClient] = None,
+                 shard: Optional[int] = None):
+        self.db_manager = db_manager if db_manager is not None else get_db_manager()
+        # embeddings=False writes rows without vectors (benchmarks of the non-model stages)
+        self.embeddings = embeddings
+        # One scraper per store; scrapers in one process share the HTTP client (and the embedder)
+        self.store = store or default_store()
+        self.source = self.store.source
+        self.http = http or get_http_client()
+        # Shard workers keep their own local state files and snapshot (see sharding.py)
+        self.shard = shard
         self.semaphore = asyncio.Semaphore(MAX_CONCURRENT_REQUESTS)
+        # Blocking db/state-store calls of the pipeline run here, one at a time, off the event loop
+        self._db_thread = ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"db-{self.source}")
+        self.journal = UpsertJournal(self._local_state_path("upsert_journal"))
+        # Parquet run snapshot, opened at the start of each run and closed at its end
+        self.snapshot = None
+        # Collection handles in the site menu, learned from the listing pages during discovery
+        self.nav_index = CollectionNavIndex()
+        # Canonical product URLs found by any discovery source this run
+        self.url_index = ProductUrlIndex(self.store.base_url)
+        # Incremental runs: per-product state from earlier runs decides what discovery yields.
+        # unmodified_ids = listed products not fetched this run (still count as seen for stale cleanup);
+        # _listing = change signals (lastmod, updated_at) per discovered URL, stored once it is synced
+        self.state_index = ProductStateIndex(
+            self._local_state_path("product_state"),
+            legacy_lastmod_path=self._local_state_path("sitemap_lastmod"),
+            id_for_url=lambda url: generate_product_id(self.source, url),
+        )
+        self.full_sweep = True
+        self.unmodified_ids: List[str] = []
+        self._listing: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+        self._state: Dict[str, Dict[str, Any]] = {}
+        self._run_started = time.time()
+        self.seen_ids: List[str] = []
+        # One inference per distinct image per run, fanned out to every product that uses it.
+        # _image_reuse: product id -> (perceptual hash, stored vector) for products whose image URL
+        # changed; a re-upload of the same picture keeps the stored vector
+        self.image_embeddings = self._new_image_deduper()
+        self._image_reuse: Dict[str, Tuple[str, Any]] = {}
+        # info_embedding by exact info text, independent of the image
+        self.text_cache = TextEmbeddingCache(self._local_state_path("text_embedding_cache"))
+        # Multi-view vectors (GALLERY_EMBEDDINGS): per-image vectors cached by canonical URL, pooled
+        # per product. _gallery_hashes = galleries pooled completely this run, stored once synced
+        self.gallery_vectors = VectorCache(self._local_state_path("gallery_vectors")) if GALLERY_EMBEDDINGS else None
+        self._galleries: Optional[bool] = None
+        self._gallery_hashes: Dict[str, str] = {}
+        self.gallery_stats = {"embedded": 0, "deferred": 0, "backfilled": 0}
+        self._gallery_budget = GALLERY_IMAGE_BUDGET
+
+    async def iter_product_urls(self):
+        """
+        Yield the product URLs to fetch this run, as they are discovered. The listing comes from the
+        product sitemap (lastmod), products.json (updated_at) or the store's collection pages
+        (DISCOVERY_MODE; stores limited to some collections have no sitemap).
+        In a full sweep every listed product is yielded; in an incremental run only those whose
+        change signal differs from the local state index or whose last fetch is too old (see
+        refetch_reason). The rest go to unmodified_ids.
+        """
+        logger.info(f"Starting product URL discovery (source={self.source})...")
+        loop = asyncio.get_event_loop()
+        metrics = get_metrics()
+
+        self.url_index = ProductUrlIndex(self.store.base_url)
+        self.image_embeddings = self._new_image_deduper()
+        self._image_reuse = {}
+        self.text_cache.prune(EMBEDDING_CACHE_DAYS * 86400)
+        if self.gallery_vectors is not None:
+            self.gallery_vectors.prune(EMBEDDING_CACHE_DAYS * 86400)
+        self._gallery_hashes = {}
+        self.gallery_stats = {"embedded": 0, "deferred": 0, "backfilled": 0}
+        self._gallery_budget = GALLERY_IMAGE_BUDGET
+        self.unmodified_ids = []
+        self._listing = {}
+        self._run_started = time.time()
+        self.full_sweep = self._full_sweep_due()
+        self._state = {} if self.full_sweep else self.state_index.load()
+        logger.info(f"Run mode: {'full sweep' if self.full_sweep else 'incremental'} ({len(self._state)} products in state index)")
+
+        source = None
+        if DISCOVERY_MODE == "sitemap":
+            entries = None
+            if self.store.sitemap_url:
+                with metrics.stage("discovery.sitemap"):
+                    entries = await loop.run_in_executor(None, self._read_sitemap)
+            if entries:
+                source = self._iter_listed_urls([(loc, lastmod, None) for loc, lastmod in entries], "sitemap")
+            else:
+                with metrics.stage("discovery.products_json"):
+                    listed = await loop.run_in_executor(None, self._list_products_json)
+                if listed:
+                    source = self._iter_listed_urls([(url, None, updated) for url, updated in listed], "json")
+                else:
+                    logger.info("No product sitemap or products.json; discovering from collection pages")
+        async for url in source or self._iter_collection_urls():
+            yield url
+
+        # Complete listing: refresh last_seen and forget products the store no longer lists
+        listed_ids = [generate_product_id(self.source, url) for url in self.url_index]
+        await self._in_db_thread(self.state_index.mark_seen, self.unmodified_ids, self._run_started)
+        await self._in_db_thread(self.state_index.retain, listed_ids)
+        for source_name, n in self.url_index.duplicates.items():
+            metrics.incr(f"discovery_duplicate_urls_{source_name}", n)
+        logger.info(
+            f"Discovered {len(self.url_index)} product URLs in total "
+            f"({len(self.unmodified_ids)} unchanged since their last fetch, "
+            f"duplicates skipped: {sum(self.url_index.duplicates.values())})"
+        )
 
-    async def discover_product_urls(self) -> List[str]:
-        """Discover ALL product URLs from the shop-all collection (no filter by existing)."""
-        logger.info("Starting product URL discovery...")
+    async def _in_db_thread(self, fn, *args):
+        """Run a blocking database / local state call on the scraper's db thread."""
+        return await asyncio.get_event_loop().run_in_executor(self._db_thread, fn, *args)
 
-        product_urls = set()
+    async def _in_queue_thread(self, fn, *args):
+        """
+        Run a blocking shard queue call (SQLite, or a PostgREST round trip) in the default executor,
+        not on the db thread, so a worker's polling is not held up behind a slow upsert.
+        """
+        return await asyncio.get_event_loop().run_in_executor(None, fn, *args)
+
+    def _new_image_deduper(self) -> ImageEmbeddingDeduper:
+        infer = BatchedInference(embed_image_batch, IMAGE_EMBEDDING_BATCH_SIZE, delay=EMBEDDING_DELAY)
+        return ImageEmbeddingDeduper(fetch_image_bytes, infer)
+
+    def _galleries_enabled(self) -> bool:
+        """GALLERY_EMBEDDINGS is on and the products table has gallery_embedding (checked once)."""
+        if self._galleries is None:
+            wanted = GALLERY_EMBEDDINGS and self.embeddings
+            self._galleries = bool(wanted) and self.db_manager.products_has_column("gallery_embedding")
+            if wanted and not self._galleries:
+                logger.warning("`products.gallery_embedding` column not found (sql/gallery_embedding.sql); skipping gallery vectors.")
+        return self._galleries
+
+    def _full_sweep_due(self) -> bool:
+        if RUN_MODE == "full":
+            return True
+        last = self.state_index.get_meta("last_full_sweep")
+        if last is None:
+            return True
+        return FULL_SWEEP_INTERVAL_HOURS > 0 and time.time() - float(last) > FULL_SWEEP_INTERVAL_HOURS * 3600
+
+    def _admit(self, url: str, lastmod: Optional[str] = None, updated_at: Optional[str] = None) -> bool:
+        """Note a discovered product's change signals; True if it has to be fetched this run."""
+        self._listing[url] = (lastmod, updated_at)
+        product_id = generate_product_id(self.source, url)
+        if self.full_sweep:
+            reason = "full_sweep"
+        else:
+            reason = refetch_reason(
+                self._state.get(product_id), lastmod, updated_at, self._run_started, INCREMENTAL_MAX_AGE_HOURS * 3600,
+            )
+        if reason is None:
+            self.unmodified_ids.append(product_id)
+            return False
+        get_metrics().incr(f"refetch_{reason}")
+        return True
+
+    async def _iter_listed_urls(self, entries: List[Tuple[str, Optional[str], Optional[str]]], source: str):
+        """(url, lastmod, updated_at) listing entries that need a fetch."""
+        if CATEGORY_SCOPE == "product":
+            await self._learn_nav_handles()
+        for loc, lastmod, updated_at in entries:
+            url = self.url_index.add(loc, source)
+            if url and self._admit(url, lastmod, updated_at):
+                yield url
+
+    def _read_sitemap(self) -> Optional[List[Tuple[str, Optional[str]]]]:
+        """(url, lastmod) from the store's product sitemap, each file fetched through the host rate limiter."""
+        return read_product_sitemap(self.store.sitemap_url, self.http.requests, throttle=self.http.limiter.wait_sync)
+
+    def _list_products_json(self) -> List[Tuple[str, Optional[str]]]:
+        """(url, updated_at) for every product in the store's collections, via products.json."""
+        listed = []
+        for handle in self.store.collections:
+            listed += _discover_via_shopify_json(self.http, self.store.base_url, handle)
+        return listed
+
+    async def _learn_nav_handles(self) -> None:
+        """Listing modes skip the collection crawl; one collection page is enough to learn the menu."""
+        html = await asyncio.get_event_loop().run_in_executor(None, self.http.fetch_text, self.store.collection_urls[0])
+        if html:
+            self.nav_index.add_page(BeautifulSoup(html, 'lxml'))
+
+    async def _iter_collection_urls(self):
+        """Product URLs from each of the store's collections page by page (products.json if the HTML has none)."""
+        for collection_url in self.store.collection_urls:
+            async for url in self._iter_collection_pages(collection_url):
+                yield url
+
+        if not len(self.url_index):
+            logger.info("No product links in HTML; trying Shopify collection products.json...")
+            try:
+                listed = await asyncio.get_event_loop().run_in_executor(None, self._list_products_json)
+                logger.info(f"Shopify JSON fallback found {len(listed)} product URLs")
+                for url, updated_at in listed:
+                    full_url = self.url_index.add(url, "json")
+                    if full_url and self._admit(full_url, updated_at=updated_at):
+                        yield full_url
+            except Exception as e:
+                logger.warning(f"Shopify JSON fallback error: {e}")
+
+    async def _iter_collection_pages(self, collection_url: str):
+        loop = asyncio.get_event_loop()
+        metrics = get_metrics()
         page = 1
 
         while True:
-            url = f"{SHOP_ALL_URL}?page={page}" if page > 1 else SHOP_ALL_URL
+            url = f"{collection_url}?page={page}" if page > 1 else collection_url
             logger.info(f"Fetching page {page}: {url}")
 
-            html = sync_fetch_url(url)
+            with metrics.stage("discovery.page_fetch") as t:
+                html = await loop.run_in_executor(None, self.http.fetch_text, url)
+                t.bytes = len(html or "")
             if not html:
                 break
 
-            soup = BeautifulSoup(html, 'lxml')
+            with metrics.stage("discovery.page_parse"):
+                soup = BeautifulSoup(html, 'lxml')
+                self.nav_index.add_page(soup)
             products_found_on_page = 0
 
             for link in soup.find_all('a', href=re.compile(r'/products/')):
                 href = link.get('href')
                 if href and '/products/' in href:
-                    full_url = urljoin(BASE_URL, href) if href.startswith('/') else href
-                    full_url = full_url.split('?')[0].split('#')[0]
-                    if full_url not in product_urls:
-                        product_urls.add(full_url)
+                    full_url = self.url_index.add(urljoin(self.store.base_url, href), "html")
+                    if full_url:
                         products_found_on_page += 1
+                        if self._admit(full_url):
+                            yield full_url
 
             logger.info(f"Found {products_found_on_page} products on page {page}")
 
@@ -104,24 +343,63 @@ class AboutBlankScraper:
                 break
 
             page += 1
-            await asyncio.sleep(1 / REQUESTS_PER_SECOND)
             if page > 50:
                 logger.warning("Reached page limit (50), stopping discovery")
                 break
 
-        if not product_urls:
-            logger.info("No product links in HTML; trying Shopify collection products.json...")
-            try:
-                match = re.search(r'/collections/([^/?#]+)', SHOP_ALL_URL)
-                handle = match.group(1) if match else "shop-all"
-                discovered = _discover_via_shopify_json(BASE_URL, handle, set())
-                product_urls = set(discovered)
-                logger.info(f"Shopify JSON fallback found {len(product_urls)} product URLs")
-            except Exception as e:
-                logger.warning(f"Shopify JSON fallback error: {e}")
+    def _record_synced(self, products: List[Dict[str, Any]]) -> None:
+        """Products fetched this run and now in sync with the db: store their state for the next run."""
+        self.state_index.record(self._synced_state_rows(products))
 
-        logger.info(f"Discovered {len(product_urls)} product URLs in total")
-        return list(product_urls)
+    def _synced_state_rows(self, products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """
+        State index rows for synced products. Reads the run's listing, the deduper's phash cache and
+        the pooled gallery hashes, so the pipeline builds them on the event loop, not the db thread.
+        """
+        rows = []
+        for p in products:
+            url = p.get("product_url")
+            lastmod, updated_at = self._listing.get(url, (None, None))
+            image_hash = _sha1(normalize_image_url(p.get("image_url")) or "")
+            image_phash = self.image_embeddings.phash(p["image_url"]) if p.get("image_url") else None
+            rows.append({
+                "id": p.get("id"), "url": url, "lastmod": lastmod, "updated_at": updated_at,
+                "fetched_at": self._run_started, "last_seen": self._run_started,
+                "content_hash": product_content_hash(p), "image_hash": image_hash,
+                "embedding_hash": _sha1(f"{image_hash}\n{self._build_info_text_for_embedding(p) or ''}"),
+                "image_phash": image_phash,
+                "gallery_hash": self._gallery_hashes.pop(p.get("id"), None),
+            })
+        return rows
+
+    def _finish_full_sweep(self) -> None:
+        if self.full_sweep:
+            self.state_index.set_meta("last_full_sweep", str(self._run_started))
+
+    def _open_snapshot(self) -> None:
+        """New snapshot file for this run (a scraper may be run more than once)."""
+        self._close_snapshot()
+        self.snapshot = open_run_snapshot(self.source if self.shard is None else f"{self.source}_shard{self.shard}")
+
+    def _close_snapshot(self) -> None:
+        if self.snapshot is not None:
+            self.snapshot.close()
+            self.snapshot = None
+
+    def _snapshot_vector_columns(self) -> tuple:
+        """Snapshot vector columns the products table has (gallery_embedding is optional)."""
+        return tuple(c for c in VECTOR_COLUMNS
+                     if c != "gallery_embedding" or self.db_manager.products_has_column(c))
+
+    def _write_unmodified_snapshot(self) -> None:
+        """Products skipped by lastmod still belong in the run snapshot: copy their stored rows."""
+        select = ",".join(STRING_COLUMNS + ("second_hand", "tags") + self._snapshot_vector_columns())
+        for row in self.db_manager.get_products_by_ids(self.unmodified_ids, select=select).values():
+            self.snapshot.write(row)
+
+    async def discover_product_urls(self) -> List[str]:
+        """Discover ALL product URLs from the shop-all collection (no filter by existing)."""
+        return [url async for url in self.iter_product_urls()]
 
     async def scrape_product(
         self,
@@ -131,48 +409,71 @@ class AboutBlankScraper:
         generate_embeddings: bool = True,
     ) -> Optional[Dict[str, Any]]:
         """Scrape individual product page"""
+        metrics = get_metrics()
+        discovered_as = self.url_index.discovered_as(url) or url
+        url = canonical_product_url(url, self.store.base_url)
         async with self.semaphore:
             try:
-                response = await session.get(url)
-                response.raise_for_status()
-                html = await response.text()
-                soup = BeautifulSoup(html, 'lxml')
+                await self.http.limiter.wait(url)
+                with metrics.stage("product.fetch") as t:
+                    response = await session.get(url)
+                    response.raise_for_status()
+                    html = await response.text()
+                    t.bytes = len(html)
+                with metrics.stage("product.parse") as t:
+                    t.bytes = len(html)
+                    soup = BeautifulSoup(html, 'lxml')
 
                 # We now scrape ALL products regardless of stock status
                 # Stock status is determined and stored in metadata
 
                 # Extract basic product info
-                title = self._extract_title(soup)
+                with metrics.stage("extract.title"):
+                    title = self._extract_title(soup)
                 if not title:
                     logger.warning(f"Could not extract title for {url}")
                     return None
 
-                description = self._extract_description(soup)
-                price = extract_prices_with_currencies(soup)  # "20USD, 5EUR" or None
-                all_image_urls = get_all_product_image_urls(soup)
+                with metrics.stage("extract.description"):
+                    description = self._extract_description(soup)
+                # Shopify product JSON decoded once into the variant table; sizes and stock derive from it
+                with metrics.stage("extract.product_json"):
+                    product_json = extract_shopify_product_json(soup)
+                    variants = build_variant_table(product_json)
+                with metrics.stage("extract.prices"):
+                    # "20USD, 5EUR" or None: every currency the page shows, not only the variant's
+                    price = extract_prices_with_currencies(soup, product_json)
+                with metrics.stage("extract.images"):
+                    all_image_urls = get_all_product_image_urls(soup, self.store.base_url, product_json)
                 image_url = all_image_urls[0] if all_image_urls else None
                 additional_images = None
                 if len(all_image_urls) > 1:
                     additional_images = " , ".join(all_image_urls[1:])
-                sizes = extract_sizes(soup)
-                collection = self._extract_collection(url)
+                with metrics.stage("extract.sizes"):
+                    sizes = variant_sizes(variants) or extract_sizes(soup, product_json)
+                collection = self._extract_collection(discovered_as)
 
                 # Category from page (collection links, breadcrumb); fallback to determine_category
-                category = extract_categories_from_page(soup, url)
-                if not category:
-                    category = determine_category(collection, title)
+                with metrics.stage("extract.categories"):
+                    category = extract_categories_from_page(
+                        soup, url, scoped=CATEGORY_SCOPE == "product", nav_handles=self.nav_index.handles,
+                    )
+                    if not category:
+                        category = determine_category(collection, title)
                 gender = determine_gender(category)
 
-                # Check stock status (but don't skip - we want all products)
-                from utils import is_in_stock
-                in_stock = is_in_stock(soup)
+                # Check stock status (but don't skip - we want all products); page heuristics only
+                # when the variant table has no availability
+                with metrics.stage("extract.stock"):
+                    in_stock = variant_in_stock(variants)
+                    if in_stock is None:
+                        in_stock = is_in_stock(soup, product_json)
 
                 # Generate image embedding if main image exists
                 image_embedding = None
                 if generate_embeddings and image_url:
                     logger.info(f"Generating embedding for {title}")
-                    image_embedding = await generate_image_embedding(image_url)
-                    await asyncio.sleep(EMBEDDING_DELAY)
+                    image_embedding = await self.image_embeddings.embed(image_url)
 
                 # Build product info text for text embedding (name, category, size(s), description, etc.)
                 info_parts = [title]
@@ -192,7 +493,7 @@ class AboutBlankScraper:
                         info_parts.append(price)
                     info_text = " ".join(p for p in info_parts if p)
                     if info_text:
-                        info_embedding = await generate_text_embedding(info_text)
+                        info_embedding = to_vector(await generate_text_embedding(info_text))
                         await asyncio.sleep(EMBEDDING_DELAY)
 
                 # Create product data
@@ -204,10 +505,12 @@ class AboutBlankScraper:
                     'sizes': sizes,
                     'category': category,
                     'gender': gender,
-                    'brand': 'About Blank',
+                    'brand': self.store.brand,
                     'image_url': image_url,
                     'additional_images': additional_images,
                     'in_stock': in_stock,
+                    'sizes_in_stock': variant_sizes_in_stock(variants),
+                    'variants': variants,
                     'collection': collection,
                     'country': None,
                     'second_hand': False,
@@ -216,12 +519,12 @@ class AboutBlankScraper:
                 }
 
                 product_data = {
-                    'id': generate_product_id(SOURCE, url),
-                    'source': SOURCE,
+                    'id': generate_product_id(self.source, url),
+                    'source': self.source,
                     'product_url': url,
                     'image_url': image_url,
                     'additional_images': additional_images,
-                    'brand': 'About Blank',
+                    'brand': self.store.brand,
                     'title': title,
                     'description': description,
                     'category': category,
@@ -240,6 +543,7 @@ class AboutBlankScraper:
 
             except Exception as e:
                 logger.error(f"Error scraping product {url}: {e}")
+                metrics.incr("products_failed")
                 return None
 
     def _extract_title(self, soup: BeautifulSoup) -> Optional[str]:
@@ -337,12 +641,10 @@ class AboutBlankScraper:
         """Scrape all products concurrently"""
         logger.info(f"Starting to scrape {len(product_urls)} products...")
 
-        async with setup_session() as session:
-            tasks = []
-            for url in product_urls:
-                # Scrape core fields first; embeddings are generated later only when needed.
-                tasks.append(self.scrape_product(session, url, generate_embeddings=False))
-                await asyncio.sleep(1 / REQUESTS_PER_SECOND)  # Rate limiting
+        async with self.http.open() as session:
+            # Scrape core fields first; embeddings are generated later only when needed.
+            # Requests are paced per host by the shared rate limiter.
+            tasks = [self.scrape_product(session, url, generate_embeddings=False) for url in product_urls]
 
             # Use tqdm for progress tracking
             products = []
@@ -404,99 +706,238 @@ class AboutBlankScraper:
         info_text = " ".join(p for p in info_parts if p)
         return info_text or None
 
-    async def _generate_embeddings_for_products(self, products: List[Dict[str, Any]]) -> None:
-        """Generate image/text embeddings sequentially with staggered delay."""
-        for p in products:
-            image_url = p.get("image_url")
+    async def _generate_embeddings_for_products(self, products: List[Dict[str, Any]],
+                                                image_ids: Optional[set] = None) -> None:
+        """
+        Image embeddings for products in image_ids (all when None; the others keep the stored
+        vector copied in by _classify_products), info embeddings for all from the text cache.
+        Journal and snapshot the rows once ready, so a crash before their upsert loses no vectors.
+        """
+        async def embed_image(p: Dict[str, Any]) -> None:
+            image_url = p.get("image_url") if self.embeddings else None
             if image_url:
-                p["image_embedding"] = await generate_image_embedding(image_url)
-                await asyncio.sleep(EMBEDDING_DELAY)
+                reuse = self._image_reuse.pop(p.get("id"), None)
+                p["image_embedding"] = await self.image_embeddings.embed(image_url, reuse)
             else:
                 p["image_embedding"] = None
 
-            info_text = self._build_info_text_for_embedding(p)
-            if info_text:
-                p["info_embedding"] = await generate_text_embedding(info_text)
-                await asyncio.sleep(EMBEDDING_DELAY)
-            else:
-                p["info_embedding"] = None
+        # Concurrent, so the images share model batches
+        regen = [p for p in products if image_ids is None or p.get("id") in image_ids]
+        await asyncio.gather(*(embed_image(p) for p in regen))
 
-    def _stale_state_path(self) -> str:
-        safe_source = SOURCE.replace("/", "_").replace("\\", "_").replace(":", "_")
-        return f"stale_state_{safe_source}.json"
+        if self.embeddings:
+            await self._embed_info_texts(products)
+            if self._galleries_enabled():
+                await self._embed_galleries(products)
+        else:
+            for p in regen:
+                p["info_embedding"] = None
 
-    def _load_stale_state(self) -> Dict[str, int]:
-        path = self._stale_state_path()
-        try:
-            with open(path, "r", encoding="utf-8") as f:
-                raw = json.load(f)
-            if not isinstance(raw, dict):
-                return {}
-            out: Dict[str, int] = {}
-            for k, v in raw.items():
-                try:
-                    out[str(k)] = int(v)
-                except Exception:
-                    out[str(k)] = 0
-            return out
-        except FileNotFoundError:
-            return {}
-        except Exception as e:
-            logger.warning(f"Could not load stale state file: {e}")
-            return {}
+        await self._in_db_thread(self.journal.record, products)
+        if self.snapshot is not None:
+            for p in products:
+                self.snapshot.write(p)
 
-    def _save_stale_state(self, state: Dict[str, int]) -> None:
-        path = self._stale_state_path()
-        try:
-            with open(path, "w", encoding="utf-8") as f:
-                json.dump(state, f, ensure_ascii=True, indent=2)
-        except Exception as e:
-            logger.warning(f"Could not save stale state file: {e}")
+    async def _embed_info_texts(self, products: List[Dict[str, Any]]) -> None:
+        """
+        info_embedding for each product, keyed by its exact info text: cached vectors are reused,
+        new texts go through the text tower TEXT_EMBEDDING_BATCH_SIZE at a time and are cached.
+        """
+        metrics = get_metrics()
+        keys: Dict[str, Optional[str]] = {}
+        texts: Dict[str, str] = {}
+        for p in products:
+            text = self._build_info_text_for_embedding(p)
+            key = self.text_cache.key(text) if text and text.strip() else None
+            keys[p.get("id")] = key
+            if key:
+                texts[key] = text
+        vectors = self.text_cache.get_many(texts)
+        missing = [k for k in texts if k not in vectors]
+        metrics.incr("embedding_text_requests", sum(1 for k in keys.values() if k))
+        metrics.incr("embedding_text_cache_hits", len(texts) - len(missing))
+        for i in range(0, len(missing), TEXT_EMBEDDING_BATCH_SIZE):
+            batch = missing[i:i + TEXT_EMBEDDING_BATCH_SIZE]
+            computed = dict(zip(batch, map(to_vector, await generate_text_embeddings([texts[k] for k in batch]))))
+            metrics.incr("embedding_text_inferences", len(batch))
+            self.text_cache.put(computed)
+            vectors.update(computed)
+            await asyncio.sleep(EMBEDDING_DELAY)
+        for p in products:
+            key = keys.get(p.get("id"))
+            p["info_embedding"] = vectors.get(key) if key else None
 
-    async def sync_products_to_db(self, products: List[Dict[str, Any]]) -> Dict[str, int]:
+    async def _embed_galleries(self, products: List[Dict[str, Any]]) -> None:
         """
-        Smart full sync:
-        - Batch upsert (50 rows/request) for new + changed products.
-        - Skip unchanged products entirely (no embedding regen, no product upsert).
-        - Delete stale products after 2 consecutive misses using consecutive_misses.
+        gallery_embedding: pooled vector (GALLERY_POOLING) of each product's gallery, up to
+        GALLERY_MAX_IMAGES views. Views come from the local per-image cache or the product's own
+        image_embedding, or are embedded (batched, deduped) while the run's GALLERY_IMAGE_BUDGET
+        lasts. A gallery cut short by the budget is pooled from the views it has and completed on a
+        later run (its gallery_hash is only stored once complete).
         """
-        logger.info(f"Syncing {len(products)} scraped products to database (source={SOURCE})...")
+        galleries = {p.get("id"): gallery_image_urls(p, GALLERY_MAX_IMAGES) for p in products}
+        keys = {url: image_vector_key(url) for urls in galleries.values() for url in urls}
+        cached = self.gallery_vectors.get_many(keys.values())
+        vectors = {url: cached[k] for url, k in keys.items() if k in cached}
+        fresh: Dict[str, Any] = {}
+        for p in products:
+            urls = galleries[p.get("id")]
+            if urls and urls[0] not in vectors and p.get("image_embedding") is not None:
+                vectors[urls[0]] = fresh[keys[urls[0]]] = as_vector(p["image_embedding"])
+
+        missing = [url for url in keys if url not in vectors]
+        allowed = missing if GALLERY_IMAGE_BUDGET <= 0 else missing[:max(self._gallery_budget, 0)]
+        deferred = set(missing[len(allowed):])
+        self._gallery_budget -= len(allowed)
+        results = await asyncio.gather(*(self.image_embeddings.embed(url) for url in allowed))
+        for url, vector in zip(allowed, results):
+            if vector is not None:
+                vectors[url] = fresh[keys[url]] = vector
+        self.gallery_vectors.put(fresh)
+        self.gallery_stats["embedded"] += len(allowed)
+        self.gallery_stats["deferred"] += len(deferred)
+        get_metrics().incr("gallery_images_embedded", len(allowed))
+        get_metrics().incr("gallery_images_deferred", len(deferred))
 
-        if not products:
-            return {"inserted": 0, "updated": 0, "skipped": 0, "deleted": 0}
+        for p in products:
+            urls = galleries[p.get("id")]
+            p["gallery_embedding"] = to_vector(pool_vectors([vectors.get(u) for u in urls], GALLERY_POOLING))
+            if not deferred.intersection(urls):
+                self._gallery_hashes[p.get("id")] = gallery_hash(urls)
 
-        now = datetime.now(timezone.utc).isoformat()
+    def _gallery_backfill(self, products: List[Dict[str, Any]], gallery_budget: int) -> List[Dict[str, Any]]:
+        """
+        Unchanged products whose pooled gallery vector is missing or incomplete (gallery_hash
+        differs), as many as `gallery_budget` (what is left of GALLERY_IMAGE_BUDGET) can complete.
+        """
+        state = self.state_index.get_many(p.get("id") for p in products)
+        pending = []
+        for p in products:
+            urls = gallery_image_urls(p, GALLERY_MAX_IMAGES)
+            if (state.get(p.get("id")) or {}).get("gallery_hash") != gallery_hash(urls):
+                pending.append((p, urls))
+        if not pending or GALLERY_IMAGE_BUDGET <= 0:
+            return [p for p, _ in pending]
+        cached = set(self.gallery_vectors.get_many(image_vector_key(u) for _, urls in pending for u in urls))
+        budget, out = gallery_budget, []
+        for p, urls in pending:
+            # the main image's vector comes from the stored row
+            need = sum(1 for u in urls[1:] if image_vector_key(u) not in cached)
+            if need <= budget:
+                budget -= need
+                out.append(p)
+        return out
+
+    def _local_state_path(self, name: str, ext: str = "sqlite3") -> str:
+        shard = "" if self.shard is None else f"_shard{self.shard}"
+        return f"{name}_{self.store.safe_source}{shard}.{ext}"
+
+    def _stale_state_path(self, ext: str = "sqlite3") -> str:
+        return self._local_state_path("stale_state", ext)
+
+    def _open_stale_state(self) -> StaleStateStore:
+        """Open the local stale-state store, importing the legacy JSON file on first use."""
+        return StaleStateStore(self._stale_state_path(), legacy_json_path=self._stale_state_path("json"))
+
+    def _sweep_stale_locally(self, seen_ids_set: set) -> int:
+        """Client-side stale tracking (local SQLite store keyed by product id). Returns deleted count."""
+        existing_rows = self.db_manager.get_existing_products_for_sync(self.source)
+        existing_ids = {r.get("id") for r in existing_rows if r.get("id")}
+        unseen_ids = existing_ids - seen_ids_set
+
+        store = self._open_stale_state()
+        try:
+            # Seen now => reset counter; not seen now => increment counter.
+            store.mark_seen(seen_ids_set)
+            store.mark_missed(unseen_ids)
+
+            ids_to_delete = [pid for pid in store.ids_at_threshold(CONSECUTIVE_MISSES_THRESHOLD) if pid in unseen_ids]
+            deleted = self.db_manager.delete_products_by_ids(ids_to_delete) if ids_to_delete else 0
+
+            # Remove deleted and rows no longer present in db from local tracker.
+            store.retain(existing_ids - set(ids_to_delete))
+        finally:
+            store.close()
+        return deleted
+
+    def _write_unchanged_snapshot(self, unchanged_products: List[Dict[str, Any]]) -> None:
+        """Unchanged rows go to the Parquet snapshot with their stored vectors (embedded rows are written when ready)."""
+        for row in self._unchanged_snapshot_rows(unchanged_products):
+            self.snapshot.write(row)
+
+    def _unchanged_snapshot_rows(self, unchanged_products: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Unchanged rows with their stored vectors (reads the db)."""
+        unchanged_ids = [p.get("id") for p in unchanged_products if p.get("id")]
+        columns = self._snapshot_vector_columns()
+        stored = self.db_manager.get_products_by_ids(unchanged_ids, select=",".join(("id",) + columns))
+        rows = []
+        for p in unchanged_products:
+            row = stored.get(p.get("id")) or {}
+            rows.append({**p, **{c: row.get(c) for c in columns}})
+        return rows
+
+    def _upsert_journaled(self, rows: List[Dict[str, Any]]) -> List[Dict[str, Any]]:
+        """Upsert rows already recorded in the journal; ack successes. Returns failed rows."""
+        _, _, failed_products = self.db_manager.upsert_products_batch(rows)
+        failed_ids = {fp.get("id") for fp in failed_products if fp.get("id")}
+        self.journal.ack(r.get("id") for r in rows if r.get("id") not in failed_ids)
+        self.journal.mark_failed(failed_ids)
+        return failed_products
+
+    def replay_upsert_journal(self) -> int:
+        """
+        Upsert rows (embeddings included) journaled by an interrupted run before doing new work.
+        Returns the number of rows written.
+        """
+        pending = self.journal.pending()
+        if not pending:
+            return 0
+        logger.info(f"Replaying {len(pending)} journaled rows from an interrupted run...")
+        if self.db_manager.products_has_column("updated_at"):
+            now = datetime.now(timezone.utc).isoformat()
+            for row in pending:
+                row["updated_at"] = row.get("updated_at") or now
+        failed_products = self._upsert_journaled(pending)
+        replayed = len(pending) - len(failed_products)
+        logger.info(f"Replayed {replayed}/{len(pending)} journaled rows")
+        return replayed
+
+    def _classify_products(self, products: List[Dict[str, Any]], gallery_budget: int) -> Dict[str, List[Any]]:
+        """
+        Diff scraped products against stored rows (one id-batched read).
+        Returns lists: new, updated, unchanged, regen (needs a new image embedding: new or image URL
+        changed), backfill (unchanged products moved to updated to complete their gallery vector)
+        and reuse. Updated products that keep their image get their stored embeddings copied in
+        (info_embedding is then refreshed from the text cache when embedding). For those whose
+        image URL changed, reuse holds (id, perceptual hash of the stored vector's image, vector),
+        so embedding can skip a re-upload of the same picture.
+        Outside a full sweep, products whose content hash matches the state index are unchanged
+        without reading their row.
+        Only reads the db and local stores; _note_classified applies the result to the run state.
+        """
+        groups: Dict[str, List[Any]] = {
+            "new": [], "updated": [], "unchanged": [], "regen": [], "backfill": [], "reuse": [],
+        }
+        if not self.full_sweep:
+            state = self.state_index.get_many([p.get("id") for p in products if p.get("id")])
+            to_diff = []
+            for p in products:
+                known = state.get(p.get("id"))
+                if known and known.get("content_hash") == product_content_hash(p):
+                    groups["unchanged"].append(p)
+                else:
+                    to_diff.append(p)
+            get_metrics().incr("sync_unchanged_by_hash", len(groups["unchanged"]))
+            products = to_diff
+
+        ids = [p.get("id") for p in products if p.get("id")]
+        existing_map = {}
+        if ids:
+            with get_metrics().stage("sync.diff_read"):
+                existing_map = self.db_manager.get_products_by_ids(ids, select=SYNC_COMPARE_SELECT)
 
-        seen_ids = [p.get("id") for p in products if p.get("id")]
-        seen_ids_set = set(seen_ids)
-
-        # 1) Load existing rows for diffing.
-        compare_select = ",".join([
-            "id",
-            "product_url",
-            "image_url",
-            "title",
-            "description",
-            "category",
-            "gender",
-            "price",
-            "size",
-            "additional_images",
-            "metadata",
-            "tags",
-            "country",
-            "second_hand",
-            "sale",
-            "other",
-        ])
-        existing_map = self.db_manager.get_products_by_ids(seen_ids, select=compare_select)
-
-        new_products: List[Dict[str, Any]] = []
-        updated_products: List[Dict[str, Any]] = []
-        unchanged_count = 0
-
-        regen_embedding_products: List[Dict[str, Any]] = []
         no_regen_embedding_ids: List[str] = []
+        image_changed_ids: List[str] = []
 
         for p in products:
             product_id = p.get("id")
@@ -505,103 +946,465 @@ class AboutBlankScraper:
 
             existing = existing_map.get(product_id)
             if existing is None:
-                new_products.append(p)
-                regen_embedding_products.append(p)
+                groups["new"].append(p)
+                groups["regen"].append(p)
                 continue
 
             if _scraped_equals_existing(existing, p):
-                unchanged_count += 1
+                groups["unchanged"].append(p)
                 continue
 
-            updated_products.append(p)
+            groups["updated"].append(p)
 
-            # Only regenerate embeddings when the product image URL changed.
-            existing_image_url = _normalize_product_url(existing.get("image_url"))
-            scraped_image_url = _normalize_product_url(p.get("image_url"))
+            # Only regenerate embeddings when the product image changed. Canonical CDN URLs, so rows
+            # stored with ?v=/width= params (before normalize_image_url) keep their vectors.
+            existing_image_url = normalize_image_url(_normalize_product_url(existing.get("image_url")))
+            scraped_image_url = normalize_image_url(_normalize_product_url(p.get("image_url")))
             if existing_image_url != scraped_image_url:
-                regen_embedding_products.append(p)
+                groups["regen"].append(p)
+                image_changed_ids.append(product_id)
             else:
                 no_regen_embedding_ids.append(product_id)
 
-        # 2) Generate embeddings only for new/where image URL changed.
-        if regen_embedding_products:
-            logger.info(f"Generating embeddings for {len(regen_embedding_products)} products...")
-            await self._generate_embeddings_for_products(regen_embedding_products)
-
-        # 3) For updated products where we did not regenerate embeddings, reuse existing embeddings.
-        regen_ids = {p.get("id") for p in regen_embedding_products}
-        no_regen_embedding_ids = [pid for pid in no_regen_embedding_ids if pid and pid not in regen_ids]
-        if no_regen_embedding_ids:
-            embed_select = "id,image_embedding,info_embedding"
-            existing_emb_map = self.db_manager.get_products_by_ids(
-                no_regen_embedding_ids,
-                select=embed_select,
-            )
-            for p in updated_products:
+        # Unchanged rows without a complete gallery vector are rewritten with one (stored embeddings kept)
+        if groups["unchanged"] and self._galleries_enabled():
+            backfill = self._gallery_backfill(groups["unchanged"], gallery_budget)
+            backfill_ids = {p.get("id") for p in backfill}
+            groups["unchanged"] = [p for p in groups["unchanged"] if p.get("id") not in backfill_ids]
+            groups["updated"].extend(backfill)
+            groups["backfill"] = backfill
+            no_regen_embedding_ids.extend(backfill_ids)
+
+        phashes: Dict[str, str] = {}
+        if image_changed_ids:
+            phashes = {
+                pid: s["image_phash"] for pid, s in self.state_index.get_many(image_changed_ids).items()
+                if s.get("image_phash")
+            }
+
+        # For updated products where we do not regenerate embeddings, reuse existing embeddings.
+        if no_regen_embedding_ids or phashes:
+            with get_metrics().stage("sync.embedding_read"):
+                existing_emb_map = self.db_manager.get_products_by_ids(
+                    no_regen_embedding_ids + list(phashes),
+                    select="id,image_embedding,info_embedding",
+                )
+            for p in groups["updated"]:
                 pid = p.get("id")
-                if pid in existing_emb_map and pid not in regen_ids:
-                    p["image_embedding"] = existing_emb_map[pid].get("image_embedding")
-                    p["info_embedding"] = existing_emb_map[pid].get("info_embedding")
-
-        # 4) Upsert new + changed products in batches of 50 (handled by db layer).
-        upsert_products = new_products + updated_products
-
-        failed_ids: set = set()
-        failed_count = 0
-        if upsert_products:
-            # Some environments may not have this column yet; avoid hard-failing upserts.
-            if self.db_manager.products_has_column("updated_at"):
-                for p in upsert_products:
-                    p["updated_at"] = now
-            else:
-                logger.warning("`products.updated_at` column not found; skipping updated_at writes.")
+                if pid in phashes:
+                    vector = existing_emb_map.get(pid, {}).get("image_embedding")
+                    if vector is not None:
+                        groups["reuse"].append((pid, phashes[pid], vector))
+                elif pid in existing_emb_map:
+                    p["image_embedding"] = to_vector(existing_emb_map[pid].get("image_embedding"))
+                    p["info_embedding"] = to_vector(existing_emb_map[pid].get("info_embedding"))
+        return groups
+
+    def _note_classified(self, groups: Dict[str, List[Any]]) -> None:
+        """Apply a _classify_products result to the run state: image reuse candidates, gallery backfill counts."""
+        for pid, phash, vector in groups["reuse"]:
+            self._image_reuse[pid] = (phash, vector)
+        self.gallery_stats["backfilled"] += len(groups["backfill"])
+        get_metrics().incr("gallery_backfill", len(groups["backfill"]))
+
+    def _upsert_products(self, upsert_products: List[Dict[str, Any]], now: str) -> set:
+        """
+        Batch upsert (50 rows/request, handled by db layer) of rows journaled when their embeddings
+        were ready; acks them in the journal. Returns failed ids.
+        """
+        if not upsert_products:
+            return set()
+        # Some environments may not have this column yet; avoid hard-failing upserts.
+        if self.db_manager.products_has_column("updated_at"):
+            for p in upsert_products:
+                p["updated_at"] = now
+        else:
+            logger.warning("`products.updated_at` column not found; skipping updated_at writes.")
+
+        with get_metrics().stage("sync.upsert"):
+            failed_products = self._upsert_journaled(upsert_products)
+        return {fp.get("id") for fp in failed_products if fp.get("id")}
+
+    def _sweep_stale(self, seen_ids: List[str]) -> int:
+        """
+        Stale cleanup (2 consecutive runs): one server-side mark-and-sweep RPC;
+        fall back to local state only when the function is not installed. A failed RPC
+        skips cleanup for this run (it may have been applied server-side).
+        """
+        with get_metrics().stage("sync.stale_sweep"):
+            try:
+                sweep = self.db_manager.mark_and_sweep_products(self.source, seen_ids, CONSECUTIVE_MISSES_THRESHOLD)
+            except Exception as e:
+                logger.error(f"Stale cleanup failed, skipped this run: {e}")
+                return 0
+            if sweep is not None:
+                return sweep["deleted"]
+            return self._sweep_stale_locally(set(seen_ids))
 
-            _, failed_count, failed_products = self.db_manager.upsert_products_batch(upsert_products)
-            failed_ids = {fp.get("id") for fp in failed_products if fp.get("id")}
+    def _log_run_summary(self, result: Dict[str, int]) -> None:
+        summary = (
+            f"Run summary ({self.source}): {result['inserted']} new products added; "
+            f"{result['updated']} products updated; "
+            f"{result['skipped']} products unchanged (skipped); "
+            f"{result['deleted']} stale products deleted."
+        )
+        if result.get("unmodified"):
+            summary += f" {result['unmodified']} products not fetched (unchanged since their last fetch)."
+        if any(self.gallery_stats.values()):
+            summary += (
+                f" Gallery images: {self.gallery_stats['embedded']} embedded, {self.gallery_stats['deferred']} deferred"
+                f" by the run budget; {self.gallery_stats['backfilled']} unchanged products backfilled."
+            )
+        dedup = self.image_embeddings
+        if dedup.requests:
+            summary += (
+                f" Image embeddings: {dedup.requests} requested, {dedup.inferences} computed"
+                f" (dedup ratio {dedup.dedup_ratio:.0%})."
+            )
+        logger.info(summary)
+        print(summary)
 
-        inserted_success = len([p for p in new_products if p.get("id") not in failed_ids])
-        updated_success = len([p for p in updated_products if p.get("id") not in failed_ids])
+    async def sync_products_to_db(self, products: List[Dict[str, Any]], sweep: bool = True) -> Dict[str, int]:
+        """
+        Smart full sync:
+        - Batch upsert (50 rows/request) for new + changed products.
+        - Skip unchanged products entirely (no embedding regen, no product upsert).
+        - Delete stale products after 2 consecutive misses (mark_and_sweep_products RPC).
+          Pass sweep=False when `products` is not the whole catalog (a truncated URL list):
+          every product left out would count as missed.
+        - Stream every scraped product to the Parquet snapshot when EXPORT_DIR is set.
+        """
+        self._open_snapshot()
+        try:
+            return await self._sync_products(products, sweep)
+        finally:
+            await self.image_embeddings.aclose()
+            self._close_snapshot()
 
-        # 5) Stale cleanup (2 consecutive runs) using local state, keyed by product id.
-        existing_rows = self.db_manager.get_existing_products_for_sync(SOURCE)
-        existing_ids = {r.get("id") for r in existing_rows if r.get("id")}
-        unseen_ids = list(existing_ids - seen_ids_set)
+    async def _sync_products(self, products: List[Dict[str, Any]], sweep: bool = True) -> Dict[str, int]:
+        logger.info(f"Syncing {len(products)} scraped products to database (source={self.source})...")
 
-        stale_state = self._load_stale_state()
+        if not products and not self.unmodified_ids:
+            return {"inserted": 0, "updated": 0, "skipped": 0, "deleted": 0}
 
-        # Seen now => reset counter.
-        for pid in seen_ids_set:
-            stale_state[pid] = 0
+        now = datetime.now(timezone.utc).isoformat()
+        seen_ids = [p.get("id") for p in products if p.get("id")] + self.unmodified_ids
+
+        # 1) Diff against existing rows.
+        groups = self._classify_products(products, self._gallery_budget)
+        self._note_classified(groups)
+
+        # 2) Image embeddings only for new/where image URL changed; info embeddings by text.
+        if groups["new"] or groups["updated"]:
+            logger.info(f"Generating embeddings for {len(groups['new']) + len(groups['updated'])} products "
+                        f"({len(groups['regen'])} images)...")
+            await self._generate_embeddings_for_products(
+                groups["new"] + groups["updated"], {p.get("id") for p in groups["regen"]},
+            )
 
-        # Not seen now => increment counter.
-        for pid in unseen_ids:
-            stale_state[pid] = int(stale_state.get(pid, 0) or 0) + 1
+        if self.snapshot is not None:
+            self._write_unchanged_snapshot(groups["unchanged"])
+            self._write_unmodified_snapshot()
 
-        ids_to_delete = [
-            pid for pid in unseen_ids
-            if int(stale_state.get(pid, 0) or 0) >= CONSECUTIVE_MISSES_THRESHOLD
-        ]
-        deleted = self.db_manager.delete_products_by_ids(ids_to_delete) if ids_to_delete else 0
+        # 3) Upsert new + changed products.
+        failed_ids = self._upsert_products(groups["new"] + groups["updated"], now)
+        self._record_synced(
+            groups["unchanged"] + [p for p in groups["new"] + groups["updated"] if p.get("id") not in failed_ids]
+        )
 
-        # Remove deleted and rows no longer present in db from local tracker.
-        for pid in ids_to_delete:
-            stale_state.pop(pid, None)
-        for pid in list(stale_state.keys()):
-            if pid not in existing_ids and pid not in seen_ids_set:
-                stale_state.pop(pid, None)
+        result = {
+            "inserted": len([p for p in groups["new"] if p.get("id") not in failed_ids]),
+            "updated": len([p for p in groups["updated"] if p.get("id") not in failed_ids]),
+            "skipped": len(groups["unchanged"]),
+            "deleted": 0,
+            "unmodified": len(self.unmodified_ids),
+            "image_dedup_ratio": self.image_embeddings.dedup_ratio,
+        }
+        # 4) Stale cleanup (listed but not refetched products count as seen), complete catalogs only.
+        if sweep:
+            result["deleted"] = self._sweep_stale(seen_ids)
+            self._finish_full_sweep()
+        else:
+            logger.info("Partial product list; skipping stale cleanup")
+        self._log_run_summary(result)
+        return result
+
+    async def run_pipeline(self, limit: int = 0, urls=None) -> Dict[str, int]:
+        """
+        Streaming run: discover -> fetch/parse -> diff -> embed -> upsert, connected by bounded
+        queues so rows are written while discovery is still running and memory stays flat.
+        Only stale detection waits for the end. `limit` > 0 caps the number of product URLs.
+        `urls` (async iterable) replaces discovery, e.g. a shard worker's queue; stale detection
+        is then left to the caller (ids of the scraped products are in self.seen_ids).
+        Returns sync counts plus "discovered" and "scraped".
+        """
+        self._open_snapshot()
+        try:
+            return await self._run_pipeline(limit, urls)
+        finally:
+            await self.image_embeddings.aclose()
+            self._close_snapshot()
 
-        self._save_stale_state(stale_state)
+    async def _run_pipeline(self, limit: int, urls) -> Dict[str, int]:
+        url_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        product_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        embed_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
+        upsert_q: asyncio.Queue = asyncio.Queue(maxsize=PIPELINE_QUEUE_SIZE)
 
-        summary = (
-            f"Run summary: {inserted_success} new products added; "
-            f"{updated_success} products updated; "
-            f"{unchanged_count} products unchanged (skipped); "
-            f"{deleted} stale products deleted."
-        )
-        logger.info(summary)
-        print(summary)
+        now = datetime.now(timezone.utc).isoformat()
+        stats = {
+            "discovered": 0, "scraped": 0, "inserted": 0, "updated": 0, "skipped": 0, "deleted": 0, "unmodified": 0,
+        }
+        seen_ids: List[str] = []
+        new_ids: set = set()
+        regen_ids: set = set()
+        fetch_workers = MAX_CONCURRENT_REQUESTS
+
+        async def discover() -> None:
+            async for url in (self.iter_product_urls() if urls is None else urls):
+                if limit and stats["discovered"] >= limit:
+                    break
+                stats["discovered"] += 1
+                await url_q.put(url)  # fetches are paced per host by the shared rate limiter
+            for _ in range(fetch_workers):
+                await url_q.put(None)
+
+        async def fetch(session: aiohttp.ClientSession, pbar: tqdm) -> None:
+            while (url := await url_q.get()) is not None:
+                product = await self.scrape_product(session, url, generate_embeddings=False)
+                pbar.update(1)
+                if product:
+                    stats["scraped"] += 1
+                    seen_ids.append(product["id"])
+                    await product_q.put(product)
+
+        async def fetch_all() -> None:
+            async with self.http.open() as session:
+                with tqdm(desc=f"Scraping products ({self.source})") as pbar:
+                    await asyncio.gather(*(fetch(session, pbar) for _ in range(fetch_workers)))
+            await product_q.put(None)
+
+        # diff and upsert read/write the db and state stores on the db thread, so the fetch and
+        # embed stages keep running during a slow PostgREST read or batch upsert. The db thread only
+        # does store I/O: run state shared with the embed stage (image reuse, gallery budget, stats,
+        # hashes, the deduper's caches) is read and updated here on the event loop.
+        async def diff() -> None:
+            async for batch in _iter_batches(product_q, UPSERT_CHUNK_SIZE, PIPELINE_FLUSH_SECONDS):
+                groups = await self._in_db_thread(self._classify_products, batch, self._gallery_budget)
+                self._note_classified(groups)
+                stats["skipped"] += len(groups["unchanged"])
+                await self._in_db_thread(self.state_index.record, self._synced_state_rows(groups["unchanged"]))
+                new_ids.update(p.get("id") for p in groups["new"])
+                regen_ids.update(p.get("id") for p in groups["regen"])
+                if self.snapshot is not None:
+                    for row in await self._in_db_thread(self._unchanged_snapshot_rows, groups["unchanged"]):
+                        self.snapshot.write(row)
+                for p in groups["new"] + groups["updated"]:
+                    await embed_q.put(p)
+            await embed_q.put(None)
+
+        async def embed() -> None:
+            # Batches so cache-missing info texts share text-tower passes
+            async for batch in _iter_batches(embed_q, TEXT_EMBEDDING_BATCH_SIZE, PIPELINE_FLUSH_SECONDS):
+                await self._generate_embeddings_for_products(batch, regen_ids)
+                for p in batch:
+                    await upsert_q.put(p)
+            await upsert_q.put(None)
+
+        async def upsert() -> None:
+            async for batch in _iter_batches(upsert_q, UPSERT_CHUNK_SIZE, PIPELINE_FLUSH_SECONDS):
+                failed_ids = await self._in_db_thread(self._upsert_products, batch, now)
+                synced = [p for p in batch if p.get("id") not in failed_ids]
+                for p in synced:
+                    stats["inserted" if p.get("id") in new_ids else "updated"] += 1
+                await self._in_db_thread(self.state_index.record, self._synced_state_rows(synced))
+
+        logger.info(f"Starting streaming pipeline (source={self.source})...")
+        self._galleries_enabled()  # column check once, before the embed stage needs it
+        tasks = [asyncio.create_task(c) for c in (discover(), fetch_all(), diff(), embed(), upsert())]
+        try:
+            await asyncio.gather(*tasks)
+        except BaseException:
+            for t in tasks:
+                t.cancel()
+            raise
+
+        self.seen_ids = seen_ids
+        stats["unmodified"] = len(self.unmodified_ids)
+        stats["image_dedup_ratio"] = self.image_embeddings.dedup_ratio
+        if self.snapshot is not None:
+            await self._in_db_thread(self._write_unmodified_snapshot)
+
+        # Stale detection is the only step that needs the complete seen set.
+        if urls is not None:
+            logger.info("URLs supplied by the caller; stale cleanup is left to it")
+        elif limit and stats["discovered"] >= limit:
+            logger.info(f"Discovery truncated at limit={limit}; skipping stale cleanup")
+        elif seen_ids or self.unmodified_ids:
+            stats["deleted"] = await self._in_db_thread(self._sweep_stale, seen_ids + self.unmodified_ids)
+            await self._in_db_thread(self._finish_full_sweep)
+        else:
+            logger.warning("No products were successfully scraped; skipping stale cleanup")
+        self._log_run_summary(stats)
+        return stats
+
+    async def run_shard_coordinator(self, queue: ShardQueueBackend, n_shards: int,
+                                    workers_alive: Optional[Callable[[], bool]] = None) -> Dict[str, int]:
+        """
+        Sharded run, coordinator side (see sharding.py): discover and queue this store's products
+        across n_shards, wait for every worker's report, then run the one stale sweep.
+        `workers_alive` returning False (e.g. all locally spawned workers exited) stops the wait early.
+        """
+        self._open_snapshot()
+        try:
+            return await self._run_shard_coordinator(queue, n_shards, workers_alive)
+        finally:
+            self._close_snapshot()
+
+    async def _run_shard_coordinator(self, queue: ShardQueueBackend, n_shards: int,
+                                     workers_alive: Optional[Callable[[], bool]]) -> Dict[str, int]:
+        run_id = await self._in_queue_thread(queue.create_run, self.source, n_shards, self._full_sweep_due())
+        logger.info(f"Sharded run {run_id} (source={self.source}): queueing products for {n_shards} workers")
+        stats = {
+            "discovered": 0, "scraped": 0, "inserted": 0, "updated": 0, "skipped": 0, "deleted": 0, "unmodified": 0,
+        }
+        batch = []
+        nav_handles = frozenset()
+
+        async def flush() -> None:
+            # Handles first: a worker reading these tasks then sees at least the menu they were listed with
+            nonlocal nav_handles
+            if self.nav_index.handles != nav_handles:
+                nav_handles = self.nav_index.handles
+                await self._in_queue_thread(queue.set_nav_handles, run_id, nav_handles)
+            await self._in_queue_thread(queue.enqueue, run_id, n_shards, batch)
+
+        try:
+            async for url in self.iter_product_urls():
+                lastmod, updated_at = self._listing.get(url, (None, None))
+                batch.append((generate_product_id(self.source, url), url, self.url_index.discovered_as(url), lastmod, updated_at))
+                if len(batch) >= UPSERT_CHUNK_SIZE:
+                    await flush()
+                    batch = []
+                stats["discovered"] += 1
+            await flush()
+        except BaseException as e:
+            await self._mark_shard_run_incomplete(queue, run_id, e)  # workers finish what was queued and stop
+            raise
+        await self._in_queue_thread(queue.set_status, run_id, "listed")
+        stats["unmodified"] = len(self.unmodified_ids)
+        if self.snapshot is not None:
+            await self._in_db_thread(self._write_unmodified_snapshot)
+
+        deadline = time.monotonic() + SHARD_TIMEOUT_SECONDS
+        while len(reports := await self._in_queue_thread(queue.results, run_id)) < n_shards:
+            if time.monotonic() > deadline or (workers_alive is not None and not workers_alive()):
+                break
+            await asyncio.sleep(SHARD_POLL_SECONDS)
+
+        seen = set(self.unmodified_ids)
+        for report in reports.values():
+            if not report["ok"]:
+                continue
+            for key, value in report["stats"].items():
+                if key in ("scraped", "inserted", "updated", "skipped"):
+                    stats[key] += value
+            seen.update(report["seen_ids"])
+            await self._in_db_thread(self.state_index.record, report["state"])
+
+        failed = sorted(set(range(n_shards)) - {s for s, r in reports.items() if r["ok"]})
+        if failed:
+            await self._in_queue_thread(queue.set_status, run_id, "incomplete")
+            raise RuntimeError(f"Shards {failed} of run {run_id} did not report successfully; stale cleanup skipped")
+        if seen:
+            stats["deleted"] = await self._in_db_thread(self._sweep_stale, list(seen))
+            await self._in_db_thread(self._finish_full_sweep)
+        else:
+            logger.warning("No products were successfully scraped; skipping stale cleanup")
+        await self._in_queue_thread(queue.set_status, run_id, "done")
+        self._log_run_summary(stats)
+        return stats
+
+    async def _mark_shard_run_incomplete(self, queue: ShardQueueBackend, run_id: str, error: BaseException) -> None:
+        """
+        Best effort while `error` propagates: a queue failure is logged, never raised in its place.
+        Off the event loop, unless the run is being cancelled or interrupted and must not await.
+        """
+        try:
+            if isinstance(error, Exception):
+                await self._in_queue_thread(queue.set_status, run_id, "incomplete")
+            else:
+                queue.set_status(run_id, "incomplete")
+        except Exception as e:
+            logger.warning(f"Could not mark sharded run {run_id} incomplete: {e}")
 
-        return {"inserted": inserted_success, "updated": updated_success, "skipped": unchanged_count, "deleted": deleted}
+    async def run_shard_worker(self, queue: ShardQueueBackend, shard: int) -> Dict[str, int]:
+        """
+        Sharded run, worker side: wait for an open run of this store, stream this shard's queued URLs
+        through the pipeline, and report counts, seen ids and synced product state to the coordinator.
+        """
+        deadline = time.monotonic() + SHARD_TIMEOUT_SECONDS
+        while (run := await self._in_queue_thread(queue.find_run, self.source, shard)) is None:
+            if time.monotonic() > deadline:
+                raise RuntimeError(f"No open sharded run for {self.source} (shard {shard})")
+            await asyncio.sleep(SHARD_POLL_SECONDS)
+        run_id, n_shards, full_sweep = run
+        logger.info(f"Worker for shard {shard}/{n_shards} of run {run_id} (source={self.source})")
+        self.full_sweep = full_sweep
+        self._run_started = time.time()
+
+        async def shard_urls():
+            after = 0
+            while True:
+                # status before the tasks: "listed" means none are still coming
+                status = await self._in_queue_thread(queue.run_status, run_id)
+                rows = await self._in_queue_thread(queue.tasks_after, run_id, shard, after)
+                # the coordinator's menu handles, so categories match a single-process run
+                self.nav_index.handles = await self._in_queue_thread(queue.nav_handles, run_id)
+                for after, url, discovered_as, lastmod, updated_at in rows:
+                    self.url_index.add(discovered_as or url, "queue")
+                    self._listing[url] = (lastmod, updated_at)
+                    yield url
+                if not rows:
+                    if status != "listing":
+                        return
+                    await asyncio.sleep(SHARD_POLL_SECONDS)
+
+        try:
+            stats = await self.run_pipeline(urls=shard_urls())
+        except Exception as e:
+            try:
+                await self._in_queue_thread(queue.report, run_id, shard, False, {"error": str(e)})
+            except Exception as report_error:
+                logger.warning(f"Could not report the failure of shard {shard} of run {run_id}: {report_error}")
+            raise
+        synced = self.state_index.get_many(self.seen_ids)
+        await self._in_queue_thread(queue.report, run_id, shard, True, {
+            "stats": stats,
+            "seen_ids": self.seen_ids,
+            "state": [{"id": pid, **row} for pid, row in synced.items() if (row["fetched_at"] or 0) >= self._run_started],
+        })
+        return stats
+
+
+async def _iter_batches(queue: asyncio.Queue, size: int, max_wait: float):
+    """Yield lists of up to `size` items from `queue` until a None sentinel; flush a partial batch after `max_wait` idle seconds."""
+    batch: List[Any] = []
+    while True:
+        try:
+            item = await (asyncio.wait_for(queue.get(), timeout=max_wait) if batch else queue.get())
+        except asyncio.TimeoutError:
+            yield batch
+            batch = []
+            continue
+        if item is None:
+            if batch:
+                yield batch
+            return
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
 
 
 def _norm(v: Any) -> Any:
@@ -625,13 +1428,19 @@ def _normalize_product_url(url: str) -> str:
     return url
 
 
+def _sha1(text: str) -> str:
+    return hashlib.sha1(text.encode("utf-8")).hexdigest()
+
+
+def product_content_hash(product: Dict[str, Any]) -> str:
+    """Hash of the fields _scraped_equals_existing compares (normalized the same way)."""
+    values = [_norm(product.get(k)) for k in SYNC_COMPARE_KEYS + ("tags",)]
+    return _sha1(json.dumps(values, sort_keys=True, default=str))
+
+
 def _scraped_equals_existing(existing: Dict[str, Any], scraped: Dict[str, Any]) -> bool:
     """True if comparable fields are the same (no update needed). Ignores embeddings and created_at."""
-    compare_keys = [
-        "title", "description", "category", "gender", "price", "size",
-        "image_url", "additional_images", "metadata", "country", "second_hand", "sale", "other",
-    ]
-    for k in compare_keys:
+    for k in SYNC_COMPARE_KEYS:
         ev = _norm(existing.get(k))
         sv = _norm(scraped.get(k))
         if ev != sv:
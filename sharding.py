@@ -0,0 +1,291 @@
+"""
+Sharded runs: one coordinator and N worker processes exchange work through a shard queue
+(SHARD_QUEUE_BACKEND):
+- "postgrest": Postgres tables behind PostgREST RPCs (sql/shard_queue.sql) in the Supabase project
+  the products live in, so workers can run on any machine that can reach it.
+- "sqlite": a local queue file (SHARD_QUEUE_PATH) for processes on one host and for tests. The file
+  must be on a local disk: it is in WAL mode, whose shared-memory index does not work over network
+  filesystems (NFS, SMB), so processes on other machines could lose or corrupt claims.
+- Coordinator: runs discovery (incremental admission included), assigns each product to
+  shard_for(product_id, N) and queues its URL, waits for every shard's report, then runs the
+  single stale sweep over the union of the seen ids.
+- Worker: streams its shard's URLs from the queue through the normal pipeline (scrape, diff,
+  embed, upsert) and reports counts, seen ids and the product state rows it synced. Menu
+  collection handles learned by the coordinator's discovery travel on the run row, so workers
+  extract the same categories as a single-process run.
+See AboutBlankScraper.run_shard_coordinator / run_shard_worker.
+"""
+import json
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Protocol, Tuple
+
+import requests
+
+from config import SHARD_QUEUE_BACKEND, SUPABASE_KEY, SUPABASE_URL
+from database import MAX_RETRIES, RETRY_DELAY
+from metrics import get_metrics
+from state_store import connect_sqlite
+
+logger = logging.getLogger(__name__)
+
+# Run status: listing (coordinator still queueing) -> listed -> done | incomplete; abandoned when
+# a newer run for the same source started before this one finished
+OPEN_STATUSES = ("listing", "listed")
+
+
+def shard_for(product_id: str, n_shards: int) -> int:
+    """Stable shard of a product (generate_product_id is a sha256 hex digest)."""
+    return int(product_id[:16], 16) % n_shards
+
+
+class ShardQueueBackend(Protocol):
+    """Queue shared by a sharded run's coordinator and workers (ShardQueue, PostgrestShardQueue)."""
+
+    def create_run(self, source: str, n_shards: int, full_sweep: bool) -> str: ...
+
+    def enqueue(self, run_id: str, n_shards: int,
+                tasks: Iterable[Tuple[str, str, Optional[str], Optional[str], Optional[str]]]) -> None: ...
+
+    def set_status(self, run_id: str, status: str) -> None: ...
+
+    def set_nav_handles(self, run_id: str, handles: Iterable[str]) -> None: ...
+
+    def results(self, run_id: str) -> Dict[int, Dict[str, Any]]: ...
+
+    def find_run(self, source: str, shard: int) -> Optional[Tuple[str, int, bool]]: ...
+
+    def run_status(self, run_id: str) -> Optional[str]: ...
+
+    def nav_handles(self, run_id: str) -> frozenset: ...
+
+    def tasks_after(self, run_id: str, shard: int, after: int, limit: int = 500) -> List[tuple]: ...
+
+    def report(self, run_id: str, shard: int, ok: bool, result: Dict[str, Any]) -> None: ...
+
+    def close(self) -> None: ...
+
+
+class ShardQueue:
+    """
+    Runs, per-shard URL tasks and worker reports in one SQLite file shared by the processes of one
+    host. One connection per process, shared by its stores' threads (calls are serialized).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self.conn = connect_sqlite(path)
+        self.conn.execute("PRAGMA busy_timeout = 30000")
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS shard_runs ("
+                " run_id TEXT PRIMARY KEY, source TEXT NOT NULL, n_shards INTEGER NOT NULL,"
+                " full_sweep INTEGER NOT NULL, status TEXT NOT NULL, created REAL NOT NULL, nav_handles TEXT)"
+            )
+            columns = {r[1] for r in self.conn.execute("PRAGMA table_info(shard_runs)")}
+            if "nav_handles" not in columns:
+                self.conn.execute("ALTER TABLE shard_runs ADD COLUMN nav_handles TEXT")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS shard_tasks ("
+                " run_id TEXT NOT NULL, shard INTEGER NOT NULL, product_id TEXT NOT NULL, url TEXT NOT NULL,"
+                " discovered_as TEXT, lastmod TEXT, updated_at TEXT, PRIMARY KEY (run_id, product_id))"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS shard_tasks_by_shard ON shard_tasks (run_id, shard)")
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS shard_results ("
+                " run_id TEXT NOT NULL, shard INTEGER NOT NULL, ok INTEGER NOT NULL, result TEXT NOT NULL,"
+                " finished REAL NOT NULL, PRIMARY KEY (run_id, shard))"
+            )
+
+    # -- coordinator -------------------------------------------------------
+
+    def create_run(self, source: str, n_shards: int, full_sweep: bool) -> str:
+        run_id = uuid.uuid4().hex
+        with self._lock, self.conn:
+            self.conn.execute(
+                f"UPDATE shard_runs SET status = 'abandoned' WHERE source = ? AND status IN {OPEN_STATUSES}",
+                (source,),
+            )
+            self.conn.execute(
+                "INSERT INTO shard_runs (run_id, source, n_shards, full_sweep, status, created) VALUES (?, ?, ?, ?, 'listing', ?)",
+                (run_id, source, n_shards, int(full_sweep), time.time()),
+            )
+        return run_id
+
+    def enqueue(self, run_id: str, n_shards: int,
+                tasks: Iterable[Tuple[str, str, Optional[str], Optional[str], Optional[str]]]) -> None:
+        """(product_id, url, discovered_as, lastmod, updated_at) tasks; each goes to its product's shard."""
+        with self._lock, self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO shard_tasks (run_id, shard, product_id, url, discovered_as, lastmod, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                ((run_id, shard_for(t[0], n_shards), *t) for t in tasks),
+            )
+
+    def set_status(self, run_id: str, status: str) -> None:
+        with self._lock, self.conn:
+            self.conn.execute("UPDATE shard_runs SET status = ? WHERE run_id = ?", (status, run_id))
+
+    def set_nav_handles(self, run_id: str, handles: Iterable[str]) -> None:
+        """Menu collection handles learned by discovery so far (product-scoped categories skip them)."""
+        with self._lock, self.conn:
+            self.conn.execute(
+                "UPDATE shard_runs SET nav_handles = ? WHERE run_id = ?", (json.dumps(sorted(handles)), run_id),
+            )
+
+    def results(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        """shard -> report ({"ok": bool, ...worker payload})."""
+        with self._lock:
+            rows = self.conn.execute("SELECT shard, ok, result FROM shard_results WHERE run_id = ?", (run_id,)).fetchall()
+        return {shard: {"ok": bool(ok), **json.loads(result)} for shard, ok, result in rows}
+
+    # -- worker ------------------------------------------------------------
+
+    def find_run(self, source: str, shard: int) -> Optional[Tuple[str, int, bool]]:
+        """Newest open run for `source` this shard has not reported on: (run_id, n_shards, full_sweep)."""
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT run_id, n_shards, full_sweep FROM shard_runs r WHERE source = ? AND status IN {OPEN_STATUSES}"
+                " AND ? < n_shards AND NOT EXISTS (SELECT 1 FROM shard_results s WHERE s.run_id = r.run_id AND s.shard = ?)"
+                " ORDER BY created DESC LIMIT 1",
+                (source, shard, shard),
+            ).fetchone()
+        return (row[0], row[1], bool(row[2])) if row else None
+
+    def run_status(self, run_id: str) -> Optional[str]:
+        with self._lock:
+            row = self.conn.execute("SELECT status FROM shard_runs WHERE run_id = ?", (run_id,)).fetchone()
+        return row[0] if row else None
+
+    def nav_handles(self, run_id: str) -> frozenset:
+        with self._lock:
+            row = self.conn.execute("SELECT nav_handles FROM shard_runs WHERE run_id = ?", (run_id,)).fetchone()
+        return frozenset(json.loads(row[0])) if row and row[0] else frozenset()
+
+    def tasks_after(self, run_id: str, shard: int, after: int, limit: int = 500) -> List[tuple]:
+        """(rowid, url, discovered_as, lastmod, updated_at) queued for the shard after rowid `after`."""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT rowid, url, discovered_as, lastmod, updated_at FROM shard_tasks"
+                " WHERE run_id = ? AND shard = ? AND rowid > ? ORDER BY rowid LIMIT ?",
+                (run_id, shard, after, limit),
+            ).fetchall()
+
+    def report(self, run_id: str, shard: int, ok: bool, result: Dict[str, Any]) -> None:
+        with self._lock, self.conn:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO shard_results (run_id, shard, ok, result, finished) VALUES (?, ?, ?, ?, ?)",
+                (run_id, shard, int(ok), json.dumps(result), time.time()),
+            )
+
+    def close(self) -> None:
+        with self._lock:
+            self.conn.close()
+
+
+class PostgrestShardQueue:
+    """
+    The same queue in Postgres, one PostgREST RPC per operation (sql/shard_queue.sql), for workers
+    on other machines. Task sequence numbers only grow within a run because its one coordinator
+    enqueues batch after batch, so tasks_after never skips a task.
+    """
+
+    def __init__(self):
+        if not SUPABASE_URL or not SUPABASE_KEY:
+            raise RuntimeError("Set SUPABASE_URL and SUPABASE_KEY (or SUPABASE_ANON_KEY) in .env")
+        self.base_url = f"{SUPABASE_URL}/rest/v1"
+        self.session = requests.Session()
+        self.session.headers.update({
+            "apikey": SUPABASE_KEY,
+            "Authorization": f"Bearer {SUPABASE_KEY}",
+            "Content-Type": "application/json",
+            "Accept": "application/json",
+        })
+        self.session.hooks["response"].append(get_metrics().requests_hook("postgrest"))
+
+    def _rpc(self, name: str, **params: Any) -> Any:
+        """
+        POST /rpc/<name>; retries connection errors, timeouts and 5xx. Every call is safe to repeat:
+        a repeated create_run only abandons the run the lost response created.
+        """
+        error: Exception = RuntimeError(f"RPC {name} not attempted")
+        for attempt in range(1, MAX_RETRIES + 1):
+            try:
+                r = self.session.post(f"{self.base_url}/rpc/{name}", data=json.dumps(params), timeout=60)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            else:
+                if r.status_code == 404:
+                    raise RuntimeError(f"RPC {name} not found; run sql/shard_queue.sql")
+                if r.status_code in (401, 403):
+                    raise RuntimeError(f"RPC {name} denied; the shard queue needs the service-role key in SUPABASE_KEY")
+                if r.status_code < 500:
+                    r.raise_for_status()
+                    return r.json() if r.text else None
+                error = RuntimeError(f"RPC {name}: HTTP {r.status_code} {r.text[:200]}")
+            if attempt < MAX_RETRIES:
+                logger.warning(f"Shard queue RPC {name} failed (attempt {attempt}/{MAX_RETRIES}): {error}")
+                time.sleep(RETRY_DELAY * attempt)
+        raise error
+
+    # -- coordinator -------------------------------------------------------
+
+    def create_run(self, source: str, n_shards: int, full_sweep: bool) -> str:
+        return self._rpc("shard_create_run", p_source=source, p_n_shards=n_shards, p_full_sweep=full_sweep)
+
+    def enqueue(self, run_id: str, n_shards: int,
+                tasks: Iterable[Tuple[str, str, Optional[str], Optional[str], Optional[str]]]) -> None:
+        """(product_id, url, discovered_as, lastmod, updated_at) tasks; each goes to its product's shard."""
+        rows = [
+            {"shard": shard_for(pid, n_shards), "product_id": pid, "url": url,
+             "discovered_as": discovered_as, "lastmod": lastmod, "updated_at": updated_at}
+            for pid, url, discovered_as, lastmod, updated_at in tasks
+        ]
+        if rows:
+            self._rpc("shard_enqueue", p_run_id=run_id, p_tasks=rows)
+
+    def set_status(self, run_id: str, status: str) -> None:
+        self._rpc("shard_set_status", p_run_id=run_id, p_status=status)
+
+    def set_nav_handles(self, run_id: str, handles: Iterable[str]) -> None:
+        """Menu collection handles learned by discovery so far (product-scoped categories skip them)."""
+        self._rpc("shard_set_nav_handles", p_run_id=run_id, p_handles=sorted(handles))
+
+    def results(self, run_id: str) -> Dict[int, Dict[str, Any]]:
+        """shard -> report ({"ok": bool, ...worker payload})."""
+        rows = self._rpc("shard_results", p_run_id=run_id) or []
+        return {r["shard"]: {"ok": bool(r["ok"]), **r["result"]} for r in rows}
+
+    # -- worker ------------------------------------------------------------
+
+    def find_run(self, source: str, shard: int) -> Optional[Tuple[str, int, bool]]:
+        """Newest open run for `source` this shard has not reported on: (run_id, n_shards, full_sweep)."""
+        rows = self._rpc("shard_find_run", p_source=source, p_shard=shard) or []
+        return (rows[0]["run_id"], rows[0]["n_shards"], bool(rows[0]["full_sweep"])) if rows else None
+
+    def run_status(self, run_id: str) -> Optional[str]:
+        return self._rpc("shard_run_status", p_run_id=run_id)
+
+    def nav_handles(self, run_id: str) -> frozenset:
+        return frozenset(self._rpc("shard_nav_handles", p_run_id=run_id) or ())
+
+    def tasks_after(self, run_id: str, shard: int, after: int, limit: int = 500) -> List[tuple]:
+        """(seq, url, discovered_as, lastmod, updated_at) queued for the shard after seq `after`."""
+        rows = self._rpc("shard_tasks_after", p_run_id=run_id, p_shard=shard, p_after=after, p_limit=limit) or []
+        return [(r["seq"], r["url"], r["discovered_as"], r["lastmod"], r["updated_at"]) for r in rows]
+
+    def report(self, run_id: str, shard: int, ok: bool, result: Dict[str, Any]) -> None:
+        self._rpc("shard_report", p_run_id=run_id, p_shard=shard, p_ok=ok, p_result=result)
+
+    def close(self) -> None:
+        self.session.close()
+
+
+def open_shard_queue(path: str) -> ShardQueueBackend:
+    """The queue selected by SHARD_QUEUE_BACKEND; `path` is the SQLite file (unused by postgrest)."""
+    if SHARD_QUEUE_BACKEND == "postgrest":
+        return PostgrestShardQueue()
+    return ShardQueue(path)
@@ -0,0 +1,120 @@
+"""
+Sitemap discovery source. Shopify publishes /sitemap.xml (a <sitemapindex>) pointing at
+sitemap_products_N.xml files with one <url><loc/><lastmod/></url> per product. Each file is
+streamed from the socket through iterparse (gunzipped on the fly when served as .xml.gz), so
+memory stays flat however large the catalogue is.
+"""
+import gzip
+import io
+import logging
+from typing import Callable, Iterator, List, Optional, Tuple
+from xml.etree.ElementTree import ParseError, iterparse
+
+import requests
+
+from config import HEADERS
+
+logger = logging.getLogger(__name__)
+
+GZIP_MAGIC = b"\x1f\x8b"
+MAX_SITEMAP_DEPTH = 3
+
+
+def is_product_sitemap(url: str) -> bool:
+    """Shopify names product sitemaps sitemap_products_<n>.xml (other children: pages, collections, blogs)."""
+    return "sitemap_products" in url
+
+
+def _local(tag: str) -> str:
+    return tag.rsplit("}", 1)[-1]
+
+
+class _Prefixed(io.RawIOBase):
+    """Re-attach bytes already read (the gzip sniff) in front of a non-seekable stream."""
+
+    def __init__(self, head: bytes, stream):
+        self._head = head
+        self._stream = stream
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, b) -> int:
+        if self._head:
+            n = min(len(b), len(self._head))
+            b[:n], self._head = self._head[:n], self._head[n:]
+            return n
+        data = self._stream.read(len(b))
+        b[:len(data)] = data
+        return len(data)
+
+
+def parse_sitemap(stream) -> Iterator[Tuple[str, str, Optional[str]]]:
+    """
+    Incrementally parse a sitemap file object (plain or gzipped XML).
+    Yields ("url" | "sitemap", loc, lastmod) as each entry closes; parsed entries are freed.
+    Only the entry's own <loc>/<lastmod> count (not e.g. <image:image><image:loc>).
+    """
+    head = stream.read(2)
+    buffered = _Prefixed(head, stream)
+    if head == GZIP_MAGIC:
+        buffered = gzip.GzipFile(fileobj=buffered)
+    root = None
+    depth = 0  # root element = 1, entries = 2, their fields = 3
+    loc = lastmod = None
+    for event, elem in iterparse(buffered, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            if root is None:
+                root = elem
+            continue
+        depth -= 1
+        tag = _local(elem.tag)
+        if depth == 2 and tag == "loc":
+            loc = (elem.text or "").strip()
+        elif depth == 2 and tag == "lastmod":
+            lastmod = (elem.text or "").strip() or None
+        elif depth == 1 and tag in ("url", "sitemap"):
+            if loc:
+                yield tag, loc, lastmod
+            loc = lastmod = None
+            root.clear()
+
+
+def iter_sitemap(url: str, session: Optional[requests.Session] = None, timeout: float = 30,
+                 child_filter: Callable[[str], bool] = is_product_sitemap,
+                 throttle: Optional[Callable[[str], None]] = None,
+                 _depth: int = 0) -> Iterator[Tuple[str, Optional[str]]]:
+    """
+    (loc, lastmod) for every <url> reachable from `url`. Child sitemaps of a <sitemapindex>
+    are followed when child_filter(loc) is true. throttle(url), if given, is called before each
+    file is requested (e.g. HostRateLimiter.wait_sync). Raises on HTTP or XML errors.
+    """
+    session = session or requests.Session()
+    children = []
+    if throttle is not None:
+        throttle(url)
+    with session.get(url, headers=HEADERS, timeout=timeout, stream=True) as r:
+        r.raise_for_status()
+        r.raw.decode_content = True  # undo Content-Encoding: gzip; a .gz payload is handled in parse_sitemap
+        for kind, loc, lastmod in parse_sitemap(r.raw):
+            if kind == "url":
+                yield loc, lastmod
+            elif child_filter(loc):
+                children.append(loc)
+    if children and _depth >= MAX_SITEMAP_DEPTH:
+        logger.warning(f"Sitemap nesting deeper than {MAX_SITEMAP_DEPTH} at {url}; not following")
+        return
+    for child in children:
+        yield from iter_sitemap(child, session, timeout, child_filter, throttle, _depth + 1)
+
+
+def read_product_sitemap(url: str, session: Optional[requests.Session] = None, timeout: float = 30,
+                         throttle: Optional[Callable[[str], None]] = None) -> Optional[List[Tuple[str, Optional[str]]]]:
+    """All (loc, lastmod) product entries, or None when the sitemap is missing or malformed."""
+    try:
+        entries = iter_sitemap(url, session, timeout, throttle=throttle)
+        return [(loc, lastmod) for loc, lastmod in entries if "/products/" in loc]
+    except (requests.RequestException, ParseError, OSError, EOFError) as e:
+        logger.warning(f"Sitemap discovery failed for {url}: {e}")
+        return None
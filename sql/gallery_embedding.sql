@@ -0,0 +1,4 @@
+-- Pooled multi-view product vector written when GALLERY_EMBEDDINGS is on.
+-- Run once in Supabase SQL Editor; without the column the scraper skips gallery vectors.
+
+alter table public.products add column if not exists gallery_embedding public.vector(768) null;
@@ -0,0 +1,48 @@
+-- Stale-product mark-and-sweep in a single PostgREST RPC call.
+-- Run once in Supabase SQL Editor. Called by SupabaseManager.mark_and_sweep_products()
+-- via POST {SUPABASE_URL}/rest/v1/rpc/mark_and_sweep_products.
+
+alter table public.products add column if not exists last_seen timestamp with time zone null;
+alter table public.products add column if not exists consecutive_misses integer not null default 0;
+
+create index if not exists products_source_idx on public.products (source);
+
+create or replace function public.mark_and_sweep_products(
+  p_source text,
+  p_seen_ids text[],
+  p_threshold integer default 2
+)
+returns table (seen integer, missed integer, deleted integer)
+language plpgsql
+as $$
+declare
+  v_seen integer := 0;
+  v_missed integer := 0;
+  v_deleted integer := 0;
+  v_ids text[] := coalesce(p_seen_ids, '{}');
+begin
+  -- Seen this run: refresh last_seen and reset the miss counter.
+  update public.products
+     set last_seen = now(),
+         consecutive_misses = 0
+   where source = p_source
+     and id = any(v_ids);
+  get diagnostics v_seen = row_count;
+
+  -- Not seen this run: one more consecutive miss.
+  update public.products
+     set consecutive_misses = coalesce(consecutive_misses, 0) + 1
+   where source = p_source
+     and not (id = any(v_ids));
+  get diagnostics v_missed = row_count;
+
+  -- Sweep rows that reached the threshold.
+  delete from public.products
+   where source = p_source
+     and not (id = any(v_ids))
+     and consecutive_misses >= p_threshold;
+  get diagnostics v_deleted = row_count;
+
+  return query select v_seen, v_missed, v_deleted;
+end;
+$$;
@@ -0,0 +1,197 @@
+-- Shard queue for sharded runs across machines (SHARD_QUEUE_BACKEND=postgrest, see sharding.py).
+-- Run once in Supabase SQL Editor. Called by sharding.PostgrestShardQueue via
+-- POST {SUPABASE_URL}/rest/v1/rpc/shard_<name>; same semantics as the local SQLite ShardQueue.
+-- Finished runs of a source are deleted (tasks and reports with them) a week after they started.
+-- Only the service role can use the queue: the tables have row-level security and no policies,
+-- and the functions can only be executed by service_role. SUPABASE_KEY must be the service-role
+-- key when SHARD_QUEUE_BACKEND=postgrest (the anon key could forge a shard's report).
+
+create table if not exists public.shard_runs (
+  run_id text primary key,
+  source text not null,
+  n_shards integer not null,
+  full_sweep boolean not null,
+  -- listing (coordinator still queueing) -> listed -> done | incomplete; abandoned when a newer
+  -- run for the same source started before this one finished
+  status text not null,
+  created timestamp with time zone not null default now(),
+  nav_handles jsonb null
+);
+
+create index if not exists shard_runs_source_idx on public.shard_runs (source, created desc);
+
+create table if not exists public.shard_tasks (
+  -- only grows within a run: its one coordinator enqueues batch after batch
+  seq bigint generated always as identity,
+  run_id text not null references public.shard_runs (run_id) on delete cascade,
+  shard integer not null,
+  product_id text not null,
+  url text not null,
+  discovered_as text null,
+  lastmod text null,
+  updated_at text null,
+  primary key (run_id, product_id)
+);
+
+create index if not exists shard_tasks_by_shard on public.shard_tasks (run_id, shard, seq);
+
+create table if not exists public.shard_results (
+  run_id text not null references public.shard_runs (run_id) on delete cascade,
+  shard integer not null,
+  ok boolean not null,
+  result jsonb not null,
+  finished timestamp with time zone not null default now(),
+  primary key (run_id, shard)
+);
+
+-- Coordinator ---------------------------------------------------------------
+
+create or replace function public.shard_create_run(p_source text, p_n_shards integer, p_full_sweep boolean)
+returns text
+language plpgsql
+as $$
+declare
+  v_run_id text := replace(gen_random_uuid()::text, '-', '');
+begin
+  -- One coordinator per source at a time: serialize concurrent starts.
+  perform pg_advisory_xact_lock(hashtext('shard_create_run:' || p_source));
+
+  update public.shard_runs
+     set status = 'abandoned'
+   where source = p_source
+     and status in ('listing', 'listed');
+
+  delete from public.shard_runs
+   where source = p_source
+     and created < now() - interval '7 days';
+
+  insert into public.shard_runs (run_id, source, n_shards, full_sweep, status)
+  values (v_run_id, p_source, p_n_shards, p_full_sweep, 'listing');
+  return v_run_id;
+end;
+$$;
+
+create or replace function public.shard_enqueue(p_run_id text, p_tasks jsonb)
+returns void
+language sql
+as $$
+  insert into public.shard_tasks (run_id, shard, product_id, url, discovered_as, lastmod, updated_at)
+  select p_run_id, t.shard, t.product_id, t.url, t.discovered_as, t.lastmod, t.updated_at
+    from jsonb_to_recordset(p_tasks) as t (
+      shard integer, product_id text, url text, discovered_as text, lastmod text, updated_at text
+    )
+  on conflict (run_id, product_id) do nothing;
+$$;
+
+create or replace function public.shard_set_status(p_run_id text, p_status text)
+returns void
+language sql
+as $$
+  update public.shard_runs set status = p_status where run_id = p_run_id;
+$$;
+
+create or replace function public.shard_set_nav_handles(p_run_id text, p_handles jsonb)
+returns void
+language sql
+as $$
+  update public.shard_runs set nav_handles = p_handles where run_id = p_run_id;
+$$;
+
+create or replace function public.shard_results(p_run_id text)
+returns table (shard integer, ok boolean, result jsonb)
+language sql
+stable
+as $$
+  select r.shard, r.ok, r.result from public.shard_results r where r.run_id = p_run_id;
+$$;
+
+-- Worker --------------------------------------------------------------------
+
+create or replace function public.shard_find_run(p_source text, p_shard integer)
+returns table (run_id text, n_shards integer, full_sweep boolean)
+language sql
+stable
+as $$
+  select r.run_id, r.n_shards, r.full_sweep
+    from public.shard_runs r
+   where r.source = p_source
+     and r.status in ('listing', 'listed')
+     and p_shard < r.n_shards
+     and not exists (
+       select 1 from public.shard_results s where s.run_id = r.run_id and s.shard = p_shard
+     )
+   order by r.created desc
+   limit 1;
+$$;
+
+create or replace function public.shard_run_status(p_run_id text)
+returns text
+language sql
+stable
+as $$
+  select status from public.shard_runs where run_id = p_run_id;
+$$;
+
+create or replace function public.shard_nav_handles(p_run_id text)
+returns jsonb
+language sql
+stable
+as $$
+  select nav_handles from public.shard_runs where run_id = p_run_id;
+$$;
+
+create or replace function public.shard_tasks_after(p_run_id text, p_shard integer, p_after bigint, p_limit integer)
+returns table (seq bigint, url text, discovered_as text, lastmod text, updated_at text)
+language sql
+stable
+as $$
+  select t.seq, t.url, t.discovered_as, t.lastmod, t.updated_at
+    from public.shard_tasks t
+   where t.run_id = p_run_id
+     and t.shard = p_shard
+     and t.seq > p_after
+   order by t.seq
+   limit p_limit;
+$$;
+
+create or replace function public.shard_report(p_run_id text, p_shard integer, p_ok boolean, p_result jsonb)
+returns void
+language sql
+as $$
+  insert into public.shard_results (run_id, shard, ok, result)
+  values (p_run_id, p_shard, p_ok, p_result)
+  on conflict (run_id, shard) do update
+    set ok = excluded.ok, result = excluded.result, finished = now();
+$$;
+
+-- Access ----------------------------------------------------------------------
+
+alter table public.shard_runs enable row level security;
+alter table public.shard_tasks enable row level security;
+alter table public.shard_results enable row level security;
+
+revoke execute on function
+  public.shard_create_run(text, integer, boolean),
+  public.shard_enqueue(text, jsonb),
+  public.shard_set_status(text, text),
+  public.shard_set_nav_handles(text, jsonb),
+  public.shard_results(text),
+  public.shard_find_run(text, integer),
+  public.shard_run_status(text),
+  public.shard_nav_handles(text),
+  public.shard_tasks_after(text, integer, bigint, integer),
+  public.shard_report(text, integer, boolean, jsonb)
+from public, anon, authenticated;
+
+grant execute on function
+  public.shard_create_run(text, integer, boolean),
+  public.shard_enqueue(text, jsonb),
+  public.shard_set_status(text, text),
+  public.shard_set_nav_handles(text, jsonb),
+  public.shard_results(text),
+  public.shard_find_run(text, integer),
+  public.shard_run_status(text),
+  public.shard_nav_handles(text),
+  public.shard_tasks_after(text, integer, bigint, integer),
+  public.shard_report(text, integer, boolean, jsonb)
+to service_role;
@@ -0,0 +1,424 @@
+"""
+Local crash-safe state stores (SQLite in WAL mode).
+Stale tracking: consecutive-miss counters keyed by the 32-byte binary product id.
+Upsert journal: prepared rows awaiting upsert, replayed after a crash.
+Product state index: per-product change signals, fetch time and hashes for incremental runs.
+Vector cache: embeddings by content key (info text, gallery image), pruned when unused.
+"""
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+from typing import Any, Callable, Dict, Iterable, List, Optional
+
+from vector_codec import blob_to_vector, json_default, vector_to_blob
+
+logger = logging.getLogger(__name__)
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """
+    Open a SQLite database in WAL mode (atomic commits, readers never block the writer).
+    The connection may be handed to another thread (the scraper's db thread), one user at a time.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    return conn
+
+
+def _id_to_key(product_id: str) -> bytes:
+    """sha256 hex id (generate_product_id) -> 32 raw bytes; other ids are stored as utf-8."""
+    if len(product_id) == 64:
+        try:
+            return bytes.fromhex(product_id)
+        except ValueError:
+            pass
+    return product_id.encode("utf-8")
+
+
+def _key_to_id(key: bytes) -> str:
+    return key.hex() if len(key) == 32 else key.decode("utf-8")
+
+
+class StaleStateStore:
+    """
+    Consecutive-miss counters for products not seen in recent runs.
+    Only non-zero counters are stored: "seen" deletes the row, "missed" increments it.
+    Each call is one transaction, so a crash never leaves a half-written file.
+    """
+
+    def __init__(self, path: str, legacy_json_path: Optional[str] = None):
+        self.path = path
+        self.conn = connect_sqlite(path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS stale_misses ("
+                " id BLOB PRIMARY KEY,"
+                " misses INTEGER NOT NULL"
+                ") WITHOUT ROWID"
+            )
+        if legacy_json_path:
+            self._migrate_json(legacy_json_path)
+
+    def _migrate_json(self, json_path: str) -> None:
+        """One-time import of the old stale_state_<source>.json dict, then rename it aside."""
+        if not os.path.exists(json_path):
+            return
+        try:
+            with open(json_path, "r", encoding="utf-8") as f:
+                raw = json.load(f)
+        except Exception as e:
+            logger.warning(f"Could not read legacy stale state {json_path}: {e}")
+            return
+        rows = []
+        if isinstance(raw, dict):
+            for k, v in raw.items():
+                try:
+                    misses = int(v)
+                except Exception:
+                    misses = 0
+                if misses > 0:
+                    rows.append((_id_to_key(str(k)), misses))
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO stale_misses (id, misses) VALUES (?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET misses = max(misses, excluded.misses)",
+                rows,
+            )
+        os.replace(json_path, json_path + ".migrated")
+        logger.info(f"Migrated {len(rows)} stale counters from {json_path} to {self.path}")
+
+    def mark_seen(self, product_ids: Iterable[str]) -> None:
+        """Seen this run: drop the counter (absent == 0 misses)."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM stale_misses WHERE id = ?",
+                ((_id_to_key(pid),) for pid in product_ids if pid),
+            )
+
+    def mark_missed(self, product_ids: Iterable[str]) -> None:
+        """Not seen this run: increment the counter."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO stale_misses (id, misses) VALUES (?, 1)"
+                " ON CONFLICT(id) DO UPDATE SET misses = misses + 1",
+                ((_id_to_key(pid),) for pid in product_ids if pid),
+            )
+
+    def ids_at_threshold(self, threshold: int) -> List[str]:
+        """Ids whose counter reached `threshold`."""
+        rows = self.conn.execute("SELECT id FROM stale_misses WHERE misses >= ?", (int(threshold),))
+        return [_key_to_id(r[0]) for r in rows]
+
+    def retain(self, product_ids: Iterable[str]) -> None:
+        """Drop counters for ids no longer present in the db."""
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (id BLOB PRIMARY KEY) WITHOUT ROWID")
+            self.conn.execute("DELETE FROM _keep")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO _keep (id) VALUES (?)",
+                ((_id_to_key(pid),) for pid in product_ids if pid),
+            )
+            self.conn.execute("DELETE FROM stale_misses WHERE id NOT IN (SELECT id FROM _keep)")
+
+    def get(self, product_id: str) -> int:
+        row = self.conn.execute("SELECT misses FROM stale_misses WHERE id = ?", (_id_to_key(product_id),)).fetchone()
+        return int(row[0]) if row else 0
+
+    def items(self) -> Dict[str, int]:
+        return {_key_to_id(k): int(v) for k, v in self.conn.execute("SELECT id, misses FROM stale_misses")}
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class UpsertJournal:
+    """
+    Write-ahead journal of prepared product rows (embeddings included) not yet acknowledged
+    by the database. Rows are recorded as soon as they are ready and deleted once upserted,
+    so a crashed run replays only the remaining delta on the next start.
+    """
+
+    def __init__(self, path: str, max_attempts: int = 3):
+        self.path = path
+        self.max_attempts = max_attempts
+        self.conn = connect_sqlite(path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS upsert_journal ("
+                " id TEXT PRIMARY KEY,"
+                " row TEXT NOT NULL,"
+                " attempts INTEGER NOT NULL DEFAULT 0,"
+                " recorded_at TEXT NOT NULL DEFAULT (datetime('now'))"
+                ")"
+            )
+
+    def record(self, rows: Iterable[Dict]) -> None:
+        """Journal rows (latest version per id wins)."""
+        with self.conn:
+            self.conn.executemany(
+                "INSERT INTO upsert_journal (id, row) VALUES (?, ?)"
+                " ON CONFLICT(id) DO UPDATE SET row = excluded.row, attempts = 0,"
+                " recorded_at = datetime('now')",
+                ((r["id"], json.dumps(r, ensure_ascii=False, default=json_default)) for r in rows if r.get("id")),
+            )
+
+    def pending(self) -> List[Dict]:
+        """Unacknowledged rows, oldest first."""
+        rows = self.conn.execute("SELECT row FROM upsert_journal ORDER BY recorded_at, id")
+        return [json.loads(r[0]) for r in rows]
+
+    def ack(self, product_ids: Iterable[str]) -> None:
+        """Rows confirmed by the database."""
+        with self.conn:
+            self.conn.executemany(
+                "DELETE FROM upsert_journal WHERE id = ?",
+                ((pid,) for pid in product_ids if pid),
+            )
+
+    def mark_failed(self, product_ids: Iterable[str]) -> int:
+        """Count a failed upsert attempt; rows over max_attempts are dropped. Returns dropped count."""
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE upsert_journal SET attempts = attempts + 1 WHERE id = ?",
+                ((pid,) for pid in product_ids if pid),
+            )
+            dropped = self.conn.execute(
+                "DELETE FROM upsert_journal WHERE attempts >= ?", (self.max_attempts,)
+            ).rowcount
+        if dropped:
+            logger.error(f"Dropped {dropped} journaled rows after {self.max_attempts} failed upserts")
+        return dropped
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM upsert_journal").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class VectorCache:
+    """
+    key -> vector (EMBEDDING_PRECISION); entries not used for a while can be pruned.
+    Thread-safe: the gallery cache is read by the pipeline's diff (db thread) and embed stages.
+    """
+
+    def __init__(self, path: str, table: str = "vectors"):
+        self.path = path
+        self.table = table
+        self.conn = connect_sqlite(path)
+        self._lock = threading.Lock()
+        with self.conn:
+            self.conn.execute(
+                f"CREATE TABLE IF NOT EXISTS {table} ("
+                " key TEXT PRIMARY KEY, vector BLOB NOT NULL, used_at REAL NOT NULL) WITHOUT ROWID"
+            )
+
+    def get_many(self, keys: Iterable[str]) -> Dict[str, Any]:
+        """Cached vectors for the keys that have one; marks them used."""
+        keys = list(dict.fromkeys(keys))
+        out: Dict[str, Any] = {}
+        with self._lock:
+            for i in range(0, len(keys), 500):
+                batch = keys[i:i + 500]
+                rows = self.conn.execute(
+                    f"SELECT key, vector FROM {self.table} WHERE key IN ({','.join('?' * len(batch))})", batch,
+                )
+                out.update({k: blob_to_vector(blob) for k, blob in rows})
+            if out:
+                now = time.time()
+                with self.conn:
+                    self.conn.executemany(f"UPDATE {self.table} SET used_at = ? WHERE key = ?", ((now, k) for k in out))
+        return out
+
+    def put(self, vectors: Dict[str, Any]) -> None:
+        """Store vectors (None values, i.e. failed embeddings, are skipped)."""
+        now = time.time()
+        with self._lock, self.conn:
+            self.conn.executemany(
+                f"INSERT OR REPLACE INTO {self.table} (key, vector, used_at) VALUES (?, ?, ?)",
+                ((k, vector_to_blob(v), now) for k, v in vectors.items() if v is not None),
+            )
+
+    def prune(self, max_age: float) -> int:
+        """Drop entries not used for max_age seconds."""
+        with self._lock, self.conn:
+            cur = self.conn.execute(f"DELETE FROM {self.table} WHERE used_at < ?", (time.time() - max_age,))
+        if cur.rowcount:
+            logger.info(f"Pruned {cur.rowcount} unused vectors from {self.path}")
+        return cur.rowcount
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self.conn.execute(f"SELECT count(*) FROM {self.table}").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+class ProductStateIndex:
+    """
+    Per-product sync state for incremental runs: canonical URL, change signals from the listing
+    (sitemap lastmod, products.json updated_at), last fetch time, content/image/embedding-input
+    hashes, the perceptual hash of the image its vector came from, the gallery its pooled
+    multi-view vector covers, and last seen time. Rows are written only once the product is in
+    sync with the db, so a failed fetch or upsert is retried next run.
+    """
+
+    COLUMNS = (
+        "url", "lastmod", "updated_at", "fetched_at", "content_hash", "image_hash", "embedding_hash",
+        "last_seen", "image_phash", "gallery_hash",
+    )
+    # Only known when the image (gallery) was embedded this run; other syncs keep the stored value
+    KEEP_IF_NULL = ("image_phash", "gallery_hash")
+
+    def __init__(self, path: str, legacy_lastmod_path: Optional[str] = None,
+                 id_for_url: Optional[Callable[[str], str]] = None):
+        self.path = path
+        self.conn = connect_sqlite(path)
+        with self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS product_state ("
+                " id BLOB PRIMARY KEY,"
+                " url TEXT NOT NULL,"
+                " lastmod TEXT,"
+                " updated_at TEXT,"
+                " fetched_at REAL,"
+                " content_hash TEXT,"
+                " image_hash TEXT,"
+                " embedding_hash TEXT,"
+                " last_seen REAL,"
+                " image_phash TEXT,"
+                " gallery_hash TEXT"
+                ") WITHOUT ROWID"
+            )
+            columns = {r[1] for r in self.conn.execute("PRAGMA table_info(product_state)")}
+            for c in self.COLUMNS:
+                if c not in columns:
+                    self.conn.execute(f"ALTER TABLE product_state ADD COLUMN {c}")
+                    logger.info(f"Added column product_state.{c}")
+            self.conn.execute("CREATE TABLE IF NOT EXISTS run_state (key TEXT PRIMARY KEY, value TEXT)")
+        if legacy_lastmod_path and id_for_url:
+            self._migrate_lastmods(legacy_lastmod_path, id_for_url)
+
+    def _migrate_lastmods(self, legacy_path: str, id_for_url: Callable[[str], str]) -> None:
+        """
+        One-time import of the old sitemap_lastmod_<source>.sqlite3 index, then rename it aside.
+        Its products count as fetched when that file was last written, and so does the last full
+        sweep, so the first run after the upgrade stays incremental.
+        """
+        if not os.path.exists(legacy_path):
+            return
+        synced_at = max(os.path.getmtime(p) for p in (legacy_path, legacy_path + "-wal") if os.path.exists(p))
+        try:
+            legacy = connect_sqlite(legacy_path)
+            try:
+                rows = legacy.execute("SELECT url, lastmod FROM sitemap_lastmod").fetchall()
+            finally:
+                legacy.close()  # last connection: checkpoints and removes the -wal file
+        except sqlite3.Error as e:
+            logger.warning(f"Could not read legacy lastmod index {legacy_path}: {e}")
+            return
+        with self.conn:
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO product_state (id, url, lastmod, fetched_at) VALUES (?, ?, ?, ?)",
+                ((_id_to_key(id_for_url(url)), url, lastmod, synced_at) for url, lastmod in rows),
+            )
+            self.conn.execute(
+                "INSERT OR IGNORE INTO run_state (key, value) VALUES ('last_full_sweep', ?)", (str(synced_at),)
+            )
+        os.replace(legacy_path, legacy_path + ".migrated")
+        for suffix in ("-wal", "-shm"):
+            if os.path.exists(legacy_path + suffix):
+                os.remove(legacy_path + suffix)
+        logger.info(f"Migrated {len(rows)} sitemap lastmods from {legacy_path} to {self.path}")
+
+    def load(self) -> Dict[str, Dict]:
+        """id -> state row (the whole index; one local read per run)."""
+        rows = self.conn.execute(f"SELECT id, {', '.join(self.COLUMNS)} FROM product_state")
+        return {_key_to_id(r[0]): dict(zip(self.COLUMNS, r[1:])) for r in rows}
+
+    def get_many(self, product_ids: Iterable[str]) -> Dict[str, Dict]:
+        keys = [_id_to_key(pid) for pid in product_ids if pid]
+        out = {}
+        for i in range(0, len(keys), 500):
+            batch = keys[i:i + 500]
+            rows = self.conn.execute(
+                f"SELECT id, {', '.join(self.COLUMNS)} FROM product_state"
+                f" WHERE id IN ({','.join('?' * len(batch))})",
+                batch,
+            )
+            out.update({_key_to_id(r[0]): dict(zip(self.COLUMNS, r[1:])) for r in rows})
+        return out
+
+    def record(self, rows: Iterable[Dict]) -> None:
+        """Upsert state for synced products (dicts with "id" plus any of COLUMNS)."""
+        with self.conn:
+            self.conn.executemany(
+                f"INSERT INTO product_state (id, {', '.join(self.COLUMNS)})"
+                f" VALUES (?, {', '.join('?' * len(self.COLUMNS))})"
+                " ON CONFLICT(id) DO UPDATE SET "
+                + ", ".join(
+                    f"{c} = COALESCE(excluded.{c}, {c})" if c in self.KEEP_IF_NULL else f"{c} = excluded.{c}"
+                    for c in self.COLUMNS
+                ),
+                ((_id_to_key(r["id"]), *(r.get(c) for c in self.COLUMNS)) for r in rows if r.get("id") and r.get("url")),
+            )
+
+    def mark_seen(self, product_ids: Iterable[str], seen_at: float) -> None:
+        with self.conn:
+            self.conn.executemany(
+                "UPDATE product_state SET last_seen = ? WHERE id = ?",
+                ((seen_at, _id_to_key(pid)) for pid in product_ids if pid),
+            )
+
+    def retain(self, product_ids: Iterable[str]) -> None:
+        """Forget products no longer listed by the store."""
+        with self.conn:
+            self.conn.execute("CREATE TEMP TABLE IF NOT EXISTS _keep (id BLOB PRIMARY KEY) WITHOUT ROWID")
+            self.conn.execute("DELETE FROM _keep")
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO _keep (id) VALUES (?)",
+                ((_id_to_key(pid),) for pid in product_ids if pid),
+            )
+            self.conn.execute("DELETE FROM product_state WHERE id NOT IN (SELECT id FROM _keep)")
+
+    def get_meta(self, key: str) -> Optional[str]:
+        row = self.conn.execute("SELECT value FROM run_state WHERE key = ?", (key,)).fetchone()
+        return row[0] if row else None
+
+    def set_meta(self, key: str, value: str) -> None:
+        with self.conn:
+            self.conn.execute(
+                "INSERT INTO run_state (key, value) VALUES (?, ?)"
+                " ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+                (key, value),
+            )
+
+    def __len__(self) -> int:
+        return self.conn.execute("SELECT count(*) FROM product_state").fetchone()[0]
+
+    def close(self) -> None:
+        self.conn.close()
+
+
+def refetch_reason(state: Optional[Dict], lastmod: Optional[str], updated_at: Optional[str],
+                   now: float, max_age: float) -> Optional[str]:
+    """
+    Why a listed product must be fetched this run ("new", "lastmod", "updated_at", "age"),
+    or None when its state is current. max_age <= 0 disables the age check.
+    """
+    if not state or state.get("fetched_at") is None:
+        return "new"
+    if lastmod and lastmod != state.get("lastmod"):
+        return "lastmod"
+    if updated_at and updated_at != state.get("updated_at"):
+        return "updated_at"
+    if max_age > 0 and now - state["fetched_at"] > max_age:
+        return "age"
+    if not lastmod and not updated_at and max_age <= 0:
+        return "age"  # no change signal at all: only the age bound could justify skipping
+    return None
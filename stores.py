@@ -0,0 +1,76 @@
+"""
+Store/collection configs for scraping several Shopify stores in one process. STORES_FILE points at a
+JSON list of objects ({"source", "base_url", optional "brand", "collections", "sitemap_url"}); without
+it the single store configured in config.py is scraped. Each store keeps its own SOURCE, so product
+ids, stale state and local state files never mix.
+"""
+import json
+from typing import Any, Dict, List, Optional
+
+from config import BASE_URL, BRAND, SITEMAP_URL, SOURCE, STORES_FILE
+
+DEFAULT_COLLECTIONS = ["shop-all"]
+
+
+class StoreConfig:
+    """One store (or a set of its collections) scraped under one source."""
+
+    def __init__(self, source: str, base_url: str, brand: str = BRAND,
+                 collections: Optional[List[str]] = None, sitemap_url: Optional[str] = None):
+        if not source or not base_url:
+            raise ValueError("store config needs a source and a base_url")
+        self.source = source
+        self.base_url = base_url.rstrip("/")
+        self.brand = brand
+        self.collections = list(collections or DEFAULT_COLLECTIONS)
+        # The sitemap lists the whole catalogue, so it only drives discovery when set
+        self.sitemap_url = sitemap_url or None
+
+    @classmethod
+    def from_dict(cls, data: Dict[str, Any]) -> "StoreConfig":
+        """The sitemap defaults to <base_url>/sitemap.xml unless specific collections are listed."""
+        base_url = (data.get("base_url") or "").rstrip("/")
+        if "sitemap_url" in data:
+            sitemap_url = data["sitemap_url"]
+        else:
+            sitemap_url = None if data.get("collections") else f"{base_url}/sitemap.xml"
+        return cls(
+            source=data.get("source"),
+            base_url=base_url,
+            brand=data.get("brand") or BRAND,
+            collections=data.get("collections"),
+            sitemap_url=sitemap_url,
+        )
+
+    @property
+    def collection_urls(self) -> List[str]:
+        return [f"{self.base_url}/collections/{handle}" for handle in self.collections]
+
+    @property
+    def safe_source(self) -> str:
+        """Source usable in local file names."""
+        return self.source.replace("/", "_").replace("\\", "_").replace(":", "_")
+
+    def __repr__(self) -> str:
+        return f"StoreConfig(source={self.source!r}, base_url={self.base_url!r}, collections={self.collections!r})"
+
+
+def default_store() -> StoreConfig:
+    """The store from config.py (SCRAPER_BASE_URL, SOURCE)."""
+    return StoreConfig(SOURCE, BASE_URL, BRAND, DEFAULT_COLLECTIONS, SITEMAP_URL)
+
+
+def load_store_configs(path: str = STORES_FILE) -> List[StoreConfig]:
+    """Stores to scrape this run: STORES_FILE entries, or the default store. Sources must be unique."""
+    if not path:
+        return [default_store()]
+    with open(path, "r", encoding="utf-8") as f:
+        entries = json.load(f)
+    if not isinstance(entries, list) or not entries:
+        raise ValueError(f"{path} must contain a non-empty JSON list of store configs")
+    stores = [StoreConfig.from_dict(e) for e in entries]
+    sources = [s.source for s in stores]
+    duplicates = sorted({s for s in sources if sources.count(s) > 1})
+    if duplicates:
+        raise ValueError(f"Duplicate store sources in {path}: {', '.join(duplicates)}")
+    return stores
@@ -0,0 +1,38 @@
+"""Fixture store/server used by benchmark.py: URL rewriting, misses and error injection."""
+import requests
+
+from bench_fixtures import FixtureServer, FixtureStore, build_synthetic_store, fixture_key
+
+
+def test_fixture_key_ignores_scheme_and_fragment():
+    assert fixture_key("https://Shop.com/products/a?x=1#top") == "shop.com/products/a?x=1"
+    assert fixture_key("http://shop.com") == "shop.com/"
+
+
+def test_server_rewrites_hosts_and_reports_misses(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    build_synthetic_store(store, "shop.com", n_products=3, with_images=False)
+    store.put("https://cdn.shop.com/img.jpg", b"\xff\xd8", "image/jpeg")
+    store.put("https://shop.com/products/with-cdn", b'<img src="https://cdn.shop.com/img.jpg">', "text/html")
+    store.save()
+
+    with FixtureServer(FixtureStore(str(tmp_path)), "shop.com") as server:
+        page = requests.get(f"{server.origin}/products/item-0", timeout=5)
+        assert page.status_code == 200
+        assert server.origin + "/cdn/shop/files/item-0.jpg" in page.text
+        assert "shop.com" not in page.text.replace("127.0.0.1", "")
+
+        cdn = requests.get(f"{server.origin}/products/with-cdn", timeout=5).text
+        assert f"{server.origin}/_h/cdn.shop.com/img.jpg" in cdn
+        assert requests.get(f"{server.origin}/_h/cdn.shop.com/img.jpg", timeout=5).content == b"\xff\xd8"
+
+        assert requests.get(f"{server.origin}/products/missing", timeout=5).status_code == 404
+        assert server.stats["missing"] == 1
+
+
+def test_server_injects_errors(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    build_synthetic_store(store, "shop.com", n_products=1, with_images=False)
+    with FixtureServer(store, "shop.com", error_rate=1.0) as server:
+        assert requests.get(f"{server.origin}/products/item-0", timeout=5).status_code == 503
+        assert server.stats["injected_errors"] == 1
@@ -0,0 +1,135 @@
+"""Compiled category classifier: parity with the original nested keyword loops."""
+import itertools
+import random
+
+from bs4 import BeautifulSoup
+
+from bench_fixtures import FixtureStore, build_synthetic_store
+import utils
+from config import CATEGORY_MAPPING
+from utils import (
+    CollectionNavIndex, KeywordClassifier, determine_category, extract_categories_from_page,
+    map_raw_categories_to_canonical,
+)
+
+TITLE_ACCESSORIES = ['hat', 'cap', 'beanie', 'scarf', 'belt', 'bag', 'wallet']
+TITLE_CLOTHES = ['t-shirt', 'hoodie', 'sweatshirt', 'jacket', 'coat', 'pants', 'jeans', 'shirt', 'vest', 'knitwear']
+
+STORE_NAMES = [
+    "Shop All", "T-Shirts", "Hoodies & Sweats", "Knitwear", "Outerwear", "Headwear", "Accessories",
+    "Box Cap", "Monogram Cap", "Monogram Wool Scarf", "Everyday Tote", "Tote Bag", "Digital Gift Cards",
+    "Waffle Long Sleeve", "Relaxed Wide Leg Trousers", "Liner Quilted Jacket", "Herb Grinder",
+    "Dominoes", "Sneakers", "Sale", "New In", "home", "", "   ", "Caps", "BAGS", "footwear & socks",
+]
+
+
+def _reference_map(raw_names):
+    canonical = set()
+    for raw in raw_names:
+        if not raw or not raw.strip():
+            continue
+        lower = raw.lower().strip()
+        for canonical_name, keywords in CATEGORY_MAPPING.items():
+            if any(kw in lower for kw in keywords):
+                canonical.add(canonical_name)
+                break
+    return ", ".join(sorted(canonical)) if canonical else None
+
+
+def _reference_determine(collection_name, product_title):
+    collection_lower = collection_name.lower() if collection_name else ""
+    title_lower = product_title.lower() if product_title else ""
+    for category, keywords in CATEGORY_MAPPING.items():
+        if any(keyword in collection_lower for keyword in keywords):
+            return category
+    if any(word in title_lower for word in TITLE_ACCESSORIES):
+        return 'accessories'
+    if any(word in title_lower for word in TITLE_CLOTHES):
+        return 'clothes'
+    return None
+
+
+def _candidate_names():
+    keywords = [kw for kws in CATEGORY_MAPPING.values() for kw in kws] + TITLE_ACCESSORIES + TITLE_CLOTHES
+    names = list(STORE_NAMES) + keywords
+    names += [f"{a} {b}" for a, b in itertools.permutations(keywords, 2)]
+    rng = random.Random(7)
+    blob = " ".join(keywords)
+    for _ in range(2000):  # random windows cut across keyword boundaries
+        i = rng.randrange(len(blob))
+        names.append(blob[i:i + rng.randrange(1, 25)].upper() if rng.random() < 0.2 else blob[i:i + rng.randrange(1, 25)])
+    return names
+
+
+def test_classifier_matches_reference_per_name():
+    for name in _candidate_names():
+        assert map_raw_categories_to_canonical([name]) == _reference_map([name]), name
+        assert determine_category(name, None) == _reference_determine(name, None), name
+        assert determine_category(None, name) == _reference_determine(None, name), name
+
+
+def test_classifier_matches_reference_on_batches_and_fixture_pages(tmp_path, monkeypatch):
+    names = _candidate_names()
+    rng = random.Random(11)
+    for _ in range(300):
+        batch = rng.sample(names, rng.randrange(1, 40))
+        assert map_raw_categories_to_canonical(batch) == _reference_map(batch)
+
+    # Names extract_categories_from_page collects from fixture product pages (nav links included)
+    collected = []
+
+    def spy(raw_names):
+        collected.append(list(raw_names))
+        return map_raw_categories_to_canonical(raw_names)
+
+    monkeypatch.setattr(utils, "map_raw_categories_to_canonical", spy)
+    store = FixtureStore(str(tmp_path))
+    build_synthetic_store(store, "shop.com", n_products=5, with_images=False)
+    pages = [k for k in store.index if "/products/" in k]
+    for key in pages:
+        result = extract_categories_from_page(BeautifulSoup(store.get(key)[2], "lxml"), "https://shop.com")
+        assert result == _reference_map(collected[-1])
+    assert len(collected) == len(pages) and all(collected)
+
+
+def test_keyword_classifier_prefers_first_label_in_mapping_order():
+    clf = KeywordClassifier({"a": ["box"], "b": ["box cap", "cap"], "c": ["x"]})
+    assert clf.classify_many(["box cap", "cap", "nylon cap box", "", "xylophone", "zzz"]) == [
+        "a", "b", "a", None, "c", None,
+    ]
+
+
+def test_scoped_categories_match_labelled_fixtures(tmp_path):
+    store = FixtureStore(str(tmp_path))
+    build_synthetic_store(store, "shop.com", n_products=12, per_page=5, with_images=False)
+    store = FixtureStore(str(tmp_path))  # labels round-trip through labels.json
+    nav = CollectionNavIndex()
+    for key in store.index:
+        if "/collections/" in key:
+            nav.add_page(BeautifulSoup(store.get(key)[2], "lxml"))
+    assert nav.pages == 3 and "caps" in nav.handles and "shop-all" in nav.handles
+
+    pages = [k for k in store.index if "/products/" in k]
+    assert len(store.labels) == len(pages) == 12
+    for key in pages:
+        soup = BeautifulSoup(store.get(key)[2], "lxml")
+        scoped = extract_categories_from_page(soup, "https://shop.com", scoped=True, nav_handles=nav.handles)
+        assert scoped == store.labels[key]["category"], key
+        # the whole-page mode also picks up every menu category
+        whole_page = set(extract_categories_from_page(soup, "https://shop.com").split(", "))
+        assert {"accessories", "clothes"} | set(scoped.split(", ")) == whole_page
+
+
+def test_scoped_categories_skip_menu_links_outside_header():
+    soup = BeautifulSoup(
+        '<html><body><div class="menu-drawer"><a href="/collections/caps">Caps</a>'
+        '<a href="/collections/t-shirts">T-Shirts</a></div>'
+        '<main><ol class="breadcrumbs"><li><a href="/collections/caps">Caps</a></li></ol>'
+        '<a href="/collections/sneakers">Sneakers</a></main>'
+        '<aside><a href="/collections/knitwear">Knitwear</a></aside></body></html>',
+        "lxml",
+    )
+    # learned menu handles are dropped outside the breadcrumb; other product-section links are kept
+    nav = frozenset({"caps", "t-shirts"})
+    assert extract_categories_from_page(soup, "https://shop.com", scoped=True, nav_handles=nav) == "accessories, footwear"
+    assert extract_categories_from_page(soup, "https://shop.com", scoped=True) == "accessories, clothes, footwear"
@@ -0,0 +1,70 @@
+"""Canonical product URLs, the dedup index shared by discovery sources, and sitemap discovery."""
+import gzip
+import io
+
+from bench_fixtures import SYNTHETIC_LASTMOD, FixtureServer, FixtureStore, build_synthetic_store
+from sitemap import iter_sitemap, parse_sitemap
+from utils import ProductUrlIndex, canonical_product_url, generate_product_id
+
+URLSET = b"""<?xml version="1.0" encoding="UTF-8"?>
+<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:image="http://www.google.com/schemas/sitemap-image/1.1">
+<url><loc>https://shop.com/products/a</loc><lastmod>2026-03-01T10:00:00-04:00</lastmod>
+<image:image><image:loc>https://cdn.shopify.com/a.jpg</image:loc></image:image></url>
+<url><loc>https://shop.com/products/b</loc></url>
+</urlset>"""
+
+
+def test_canonical_product_url_variants_collapse():
+    variants = [
+        "https://Shop.COM/products/tee-1",
+        "https://shop.com/products/tee-1/",
+        "https://shop.com/collections/shop-all/products/tee-1?variant=123",
+        "/collections/t-shirts/products/tee-1#reviews",
+        "/products/tee-1?utm_source=newsletter&_pos=2&_sid=ab12&_ss=r",
+    ]
+    assert {canonical_product_url(u, "https://shop.com") for u in variants} == {"https://shop.com/products/tee-1"}
+    assert len({generate_product_id("s", canonical_product_url(u, "https://shop.com")) for u in variants}) == 1
+    assert canonical_product_url("/collections/sale", "https://shop.com") == "https://shop.com/collections/sale"
+    assert canonical_product_url("http://127.0.0.1:8000/products/a/") == "http://127.0.0.1:8000/products/a"
+
+
+def test_index_dedups_across_sources_and_keeps_first_context():
+    index = ProductUrlIndex("https://shop.com")
+    assert index.add("/collections/caps/products/cap-1?variant=9", "html") == "https://shop.com/products/cap-1"
+    assert index.add("/products/cap-1", "html") is None
+    assert index.add("https://shop.com/products/cap-1", "json") is None
+    assert index.add("https://shop.com/products/cap-2", "sitemap") == "https://shop.com/products/cap-2"
+
+    assert len(index) == 2 and "https://SHOP.com/products/cap-1/" in index
+    assert index.added == {"html": 1, "sitemap": 1}
+    assert index.duplicates == {"html": 1, "json": 1}
+    assert index.discovered_as("https://shop.com/products/cap-1") == "/collections/caps/products/cap-1?variant=9"
+    assert index.discovered_as("https://shop.com/products/unknown") is None
+
+
+def test_parse_sitemap_plain_and_gzipped():
+    expected = [
+        ("url", "https://shop.com/products/a", "2026-03-01T10:00:00-04:00"),
+        ("url", "https://shop.com/products/b", None),
+    ]
+    assert list(parse_sitemap(io.BytesIO(URLSET))) == expected
+    assert list(parse_sitemap(io.BytesIO(gzip.compress(URLSET)))) == expected
+
+
+def test_sitemap_index_is_followed(tmp_path):
+    store = FixtureStore(str(tmp_path / "fx"))
+    build_synthetic_store(store, "shop.com", n_products=4, with_images=False)
+    with FixtureServer(store, "shop.com") as server:
+        entries = list(iter_sitemap(f"{server.origin}/sitemap.xml"))
+    products = [(loc, lastmod) for loc, lastmod in entries if "/products/" in loc]
+    assert products == [(f"{server.origin}/products/item-{i}", SYNTHETIC_LASTMOD) for i in range(4)]
+
+
+def test_sitemap_files_are_throttled(tmp_path):
+    store = FixtureStore(str(tmp_path / "fx"))
+    build_synthetic_store(store, "shop.com", n_products=4, with_images=False)
+    throttled = []
+    with FixtureServer(store, "shop.com") as server:
+        entries = list(iter_sitemap(f"{server.origin}/sitemap.xml", throttle=throttled.append))
+    assert entries and throttled[0] == f"{server.origin}/sitemap.xml"
+    assert len(throttled) > 1 and all("sitemap" in url for url in throttled)
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the Parquet run snapshot (skipped when pyarrow is not installed).
+Run: python -m pytest -q test_export.py
+"""
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from config import EMBEDDING_DIM
+import export
+from export import ParquetSnapshotWriter
+
+
+def test_rows_stream_in_row_groups(tmp_path):
+    path = str(tmp_path / "run.parquet")
+    writer = ParquetSnapshotWriter(path, row_group_size=2)
+    for i in range(5):
+        writer.write({
+            "id": f"p{i}",
+            "title": f"Product {i}",
+            "tags": ["clothes"],
+            "second_hand": False,
+            "image_embedding": [float(i)] * EMBEDDING_DIM,
+            "info_embedding": None,
+        })
+    writer.write({"id": "p0", "title": "duplicate"})
+    assert writer.rows_written == 4  # two full row groups flushed before close
+    writer.close()
+
+    meta = pq.ParquetFile(path).metadata
+    assert (meta.num_rows, meta.num_row_groups) == (5, 3)
+    table = pq.read_table(path)
+    assert table.schema.field("image_embedding").type.list_size == EMBEDDING_DIM
+    assert table.column("title").to_pylist()[0] == "Product 0"
+    assert table.column("image_embedding").to_pylist()[4][0] == 4.0
+    assert table.column("info_embedding").null_count == 5
+
+
+def test_each_run_gets_its_own_file(tmp_path, monkeypatch):
+    monkeypatch.setattr(export, "EXPORT_DIR", str(tmp_path))
+    paths = []
+    for run in range(2):
+        writer = export.open_run_snapshot("store.example")
+        writer.write({"id": f"p{run}", "gallery_embedding": [0.5] * EMBEDDING_DIM})
+        writer.close()
+        paths.append(writer.path)
+    assert paths[0] != paths[1]
+    assert [pq.read_table(p).column("id").to_pylist() for p in paths] == [["p0"], ["p1"]]
+    assert pq.read_table(paths[1]).column("gallery_embedding").to_pylist()[0][0] == 0.5
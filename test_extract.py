@@ -0,0 +1,132 @@
+"""Shopify product JSON fast path for prices/sizes/stock, and the fallbacks without it."""
+import json
+
+from bs4 import BeautifulSoup
+
+from utils import (
+    build_variant_table, extract_prices_with_currencies, extract_shopify_product_json, extract_sizes,
+    get_all_product_image_urls, is_in_stock, normalize_image_url, variant_in_stock,
+    variant_sizes, variant_sizes_in_stock, _is_price_element,
+)
+
+VARIANTS = [
+    {"id": 1, "option1": "Black", "option2": "S", "price": 4500, "available": False, "sku": "AB-1-S"},
+    {"id": 2, "option1": "Black", "option2": "M", "price": 4500, "available": True, "sku": "AB-1-M"},
+]
+
+
+def _page(body: str) -> BeautifulSoup:
+    return BeautifulSoup(f"<html><head></head><body>{body}</body></html>", "lxml")
+
+
+def test_product_json_single_decode():
+    product = {"options": [{"name": "Color"}, {"name": "Size"}], "variants": VARIANTS}
+    soup = _page(
+        '<script>Shopify.currency = {"active":"EUR","rate":"1.0"};</script>'
+        f'<script type="application/json" id="ProductJson-main">{json.dumps(product)}</script>'
+    )
+    pj = extract_shopify_product_json(soup)
+    assert pj["currency"] == "EUR"
+    assert pj["options"] == ["Color", "Size"]
+    assert [v["price_minor"] for v in pj["variants"]] == [4500, 4500]
+    assert [v["available"] for v in pj["variants"]] == [False, True]
+
+    assert extract_prices_with_currencies(soup, pj) == "45EUR, 45USD"
+    assert extract_sizes(soup, pj) == ["S", "M"]  # only the Size option, not Color
+    assert is_in_stock(soup, pj) is True
+
+
+def test_analytics_meta_without_availability():
+    meta = {"product": {"variants": [{"price": 8000, "public_title": "XL"}]}, "currency": "GBP"}
+    soup = _page(f"<script>var meta = {json.dumps(meta)};\nwindow.x = meta;</script>")
+    pj = extract_shopify_product_json(soup)
+    assert pj["variants"][0]["options"] == ["XL"] and pj["variants"][0]["available"] is None
+    assert extract_prices_with_currencies(soup, pj) == "80EUR, 80GBP, 80USD"
+    assert extract_sizes(soup, pj) == ["XL"]
+
+
+def test_fallbacks_without_product_json():
+    soup = _page(
+        '<span class="money">€30,00</span>'
+        '<script>var product = { variants: [{"option1":"L","price":"3000"}] }; "available":true</script>'
+    )
+    pj = extract_shopify_product_json(soup)
+    assert pj["variants"] == []
+    assert extract_prices_with_currencies(soup, pj) == "30EUR, 30USD"
+    assert extract_sizes(soup, pj) == ["L"]
+    assert is_in_stock(soup, pj) is True
+
+
+def test_price_element_filter_matches_css_selector():
+    soup = _page(
+        '<div class="price">1</div><span class="sale money">2</span><p data-price="3">3</p>'
+        '<b class="product-price current-price">4</b><i class="prices">x</i><em data-prices="y">y</em>'
+    )
+    css = soup.select(".price, .product-price, [data-price], .current-price, .money")
+    assert soup.find_all(_is_price_element) == css
+
+
+def test_variant_table_drives_size_and_stock():
+    product = {"options": ["Color", "Size"], "variants": VARIANTS + [
+        {"option1": "White", "option2": "S", "price": 5000, "available": True, "sku": "AB-2-S"},
+    ]}
+    offer = {"@type": "Product", "offers": {"price": "49.00", "priceCurrency": "USD"}}
+    soup = _page(
+        '<script>Shopify.currency = {"active":"EUR","rate":"1.0"};</script>'
+        f'<script type="application/ld+json">{json.dumps(offer)}</script>'
+        f'<script type="application/json" id="ProductJson-main">{json.dumps(product)}</script>'
+    )
+    product_json = extract_shopify_product_json(soup)
+    variants = build_variant_table(product_json)
+    assert variants[0] == {
+        "sku": "AB-1-S", "options": {"Color": "Black", "Size": "S"}, "size": "S",
+        "price_minor": 4500, "currency": "EUR", "available": False,
+    }
+    assert variant_sizes(variants) == ["S", "M"]
+    assert variant_sizes_in_stock(variants) == ["M", "S"]  # S is in stock in White
+    assert variant_in_stock(variants) is True
+    # price keeps every currency the page shows, not the variant price copied to EUR and USD
+    assert extract_prices_with_currencies(soup, product_json) == "45EUR, 49USD"
+
+
+def test_variant_table_unknowns_fall_back():
+    meta = {"product": {"variants": [{"price": 12000, "public_title": "Default Title"}]}}
+    variants = build_variant_table(extract_shopify_product_json(_page(f"<script>var meta = {json.dumps(meta)};</script>")))
+    assert variants == [{"options": {"option1": "Default Title"}, "price_minor": 12000}]
+    assert variant_sizes(variants) == []
+    assert variant_in_stock(variants) is None and variant_sizes_in_stock(variants) is None
+
+
+def test_images_from_product_json_then_json_ld():
+    product = {"variants": VARIANTS, "featured_image": "//shop.com/cdn/shop/files/front_600x.jpg?v=9", "media": [
+        {"media_type": "image", "src": "//shop.com/cdn/shop/files/front.jpg?v=9&width=1080"},
+        {"media_type": "video", "src": "//shop.com/cdn/shop/videos/clip.mp4"},
+        {"media_type": "image", "src": "//shop.com/cdn/shop/files/back.jpg?v=9"},
+    ], "images": ["//shop.com/cdn/shop/files/unused.jpg"]}
+    ld = {"@type": "Product", "image": [{"url": "https://shop.com/cdn/shop/files/ld.jpg"}]}
+    soup = _page(
+        f'<script type="application/ld+json">{json.dumps(ld)}</script>'
+        f'<script type="application/json" id="ProductJson-main">{json.dumps(product)}</script>'
+        '<header><img src="/cdn/shop/files/banner.jpg" alt="Summer banner"></header>'
+    )
+    assert get_all_product_image_urls(soup, "https://shop.com", extract_shopify_product_json(soup)) == [
+        "https://shop.com/cdn/shop/files/front.jpg", "https://shop.com/cdn/shop/files/back.jpg",
+    ]
+    soup = _page(f'<script type="application/ld+json">{json.dumps(ld)}</script>')
+    assert get_all_product_image_urls(soup, "https://shop.com") == ["https://shop.com/cdn/shop/files/ld.jpg"]
+
+
+def test_dom_image_fallback_uses_srcset_and_skips_chrome():
+    soup = _page(
+        '<header><img src="/cdn/shop/files/menu-promo.jpg" alt="New season"></header>'
+        '<img src="data:image/gif;base64,R0lG" data-srcset="/cdn/shop/files/a.jpg?width=200 200w, '
+        '/cdn/shop/files/a.jpg?width=1600 1600w" alt="">'
+        '<img src="/cdn/shop/files/b_300x.jpg?v=2" alt="Item back view">'
+        '<img src="/assets/logo.png" alt="logo"><img src="https://other.com/x.jpg" alt="badge">'
+    )
+    assert get_all_product_image_urls(soup, "https://shop.com", {"images": []}) == [
+        "https://shop.com/cdn/shop/files/b.jpg", "https://shop.com/cdn/shop/files/a.jpg",
+    ]
+    assert normalize_image_url("/cdn/shop/files/c_{width}x.png?v=1&foo=bar", "https://shop.com") == \
+        "https://shop.com/cdn/shop/files/c.png?foo=bar"
+    assert normalize_image_url("https://other.com/x.jpg?v=1") == "https://other.com/x.jpg?v=1"
@@ -0,0 +1,32 @@
+"""Multi-view product vectors: gallery URLs and pooling."""
+import numpy as np
+
+from gallery import gallery_hash, gallery_image_urls, pool_vectors
+
+
+def test_gallery_urls_are_canonical_main_first_and_capped():
+    product = {
+        "image_url": "https://shop.com/cdn/shop/files/front.jpg?v=1",
+        "additional_images": "https://shop.com/cdn/shop/files/front_800x.jpg?v=2 , "
+                             "https://shop.com/cdn/shop/files/back.jpg?v=1&width=360 , "
+                             "https://shop.com/cdn/shop/files/detail.jpg",
+    }
+    urls = gallery_image_urls(product)
+    assert urls == [
+        "https://shop.com/cdn/shop/files/front.jpg",
+        "https://shop.com/cdn/shop/files/back.jpg",
+        "https://shop.com/cdn/shop/files/detail.jpg",
+    ]
+    assert gallery_image_urls(product, limit=2) == urls[:2]
+    assert gallery_image_urls({"image_url": None}) == []
+    assert gallery_hash(urls) != gallery_hash(urls[:2])
+
+
+def test_pooling_mean_and_attention():
+    front, back, chart = [1.0, 0.0, 0.0], [0.8, 0.6, 0.0], [0.0, 0.0, 1.0]
+    mean = np.array(pool_vectors([front, back, None, chart]))
+    assert abs(np.linalg.norm(mean) - 1) < 1e-6
+    attention = np.array(pool_vectors([front, back, chart], "attention"))
+    # the odd view out (a size chart) weighs less than in the plain mean
+    assert attention[2] < mean[2] and attention @ np.array(front) > mean @ np.array(front)
+    assert pool_vectors([None]) is None and pool_vectors([front], "attention") == front
@@ -0,0 +1,152 @@
+"""Image embedding dedup: by canonical URL and content within a run, by perceptual hash across runs."""
+import asyncio
+import io
+
+import numpy as np
+from PIL import Image
+
+from image_dedup import BatchedInference, ImageEmbeddingDeduper, LruCache, hamming_distance, perceptual_hash
+
+
+def test_images_are_embedded_once_per_url_and_content():
+    photos = {
+        "https://shop.com/cdn/shop/files/a.jpg": b"photo-a",
+        "https://shop.com/cdn/shop/files/a-copy.jpg": b"photo-a",  # re-upload under another name
+        "https://shop.com/cdn/shop/files/b.jpg": b"photo-b",
+    }
+    fetched, inferred = [], []
+
+    async def fetch(url):
+        fetched.append(url)
+        await asyncio.sleep(0)
+        return photos.get(url.split("?")[0].replace("_800x", ""))
+
+    async def infer(data, url):
+        inferred.append(data)
+        await asyncio.sleep(0)
+        return [float(len(data)), float(data[-1])]
+
+    async def run():
+        deduper = ImageEmbeddingDeduper(fetch, infer)
+        urls = [
+            "https://shop.com/cdn/shop/files/a.jpg?v=1",
+            "https://shop.com/cdn/shop/files/a_800x.jpg?v=2&width=800",
+            "https://shop.com/cdn/shop/files/a-copy.jpg",
+            "https://shop.com/cdn/shop/files/b.jpg",
+            "https://shop.com/cdn/shop/files/missing.jpg",
+        ]
+        vectors = await asyncio.gather(*(deduper.embed(u) for u in urls))
+        return deduper, vectors
+
+    deduper, vectors = asyncio.run(run())
+    assert vectors[0] == vectors[1] == vectors[2] and vectors[3] != vectors[0]
+    assert vectors[4] is None
+    assert sorted(inferred) == [b"photo-a", b"photo-b"]
+    assert len(fetched) == 4  # the resized variant of a.jpg is never downloaded
+    assert (deduper.requests, deduper.url_hits, deduper.content_hits, deduper.inferences) == (5, 1, 1, 2)
+    assert deduper.dedup_ratio == 0.4
+
+
+def _jpeg(color, size=(600, 750), quality=85, box=(1, 1, 3, 4)):
+    """A photo-like JPEG: shaded background with a light box at `box` (in sixths of the image)."""
+    w, h = size
+    shade = np.linspace(0.6, 1.0, w)[None, :, None] * np.linspace(1.0, 0.7, h)[:, None, None]
+    image = Image.fromarray((shade * np.array(color)).astype(np.uint8))
+    image.paste((255, 255, 255), tuple(v * d // 6 for v, d in zip(box, (w, h, w, h))))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=quality)
+    return buf.getvalue()
+
+
+def test_perceptual_hash_survives_reencoding():
+    original = perceptual_hash(_jpeg((180, 40, 40)))
+    reencoded = perceptual_hash(_jpeg((182, 40, 38), size=(1200, 1500), quality=60))
+    moved = perceptual_hash(_jpeg((180, 40, 40), box=(3, 3, 5, 6)))
+    assert len(original) == 16
+    assert hamming_distance(original, reencoded) <= 4
+    assert hamming_distance(original, moved) > 4
+    assert perceptual_hash(b"not an image") is None
+
+
+def test_reupload_of_same_picture_reuses_stored_vector():
+    photos = {"new.jpg": _jpeg((182, 40, 38), quality=60), "other.jpg": _jpeg((20, 20, 200), size=(300, 300), box=(3, 0, 6, 2))}
+    inferred = []
+
+    async def fetch(url):
+        return photos[url]
+
+    async def infer(data, url):
+        inferred.append(url)
+        return [0.0, 1.0]
+
+    async def run():
+        deduper = ImageEmbeddingDeduper(fetch, infer, max_distance=4)
+        stored = (perceptual_hash(_jpeg((180, 40, 40))), "[1.0,0.0]")  # pgvector text, as Supabase returns it
+        return deduper, await deduper.embed("new.jpg", stored), await deduper.embed("other.jpg", stored)
+
+    deduper, reused, fresh = asyncio.run(run())
+    assert reused == [1.0, 0.0] and fresh == [0.0, 1.0] and inferred == ["other.jpg"]
+    assert deduper.phash_hits == 1 and deduper.dedup_ratio == 0.5
+    # the stored hash stays anchored to the image the vector came from
+    assert deduper.phash("new.jpg") == perceptual_hash(_jpeg((180, 40, 40)))
+
+
+def test_concurrent_inferences_share_model_batches():
+    calls = []
+
+    async def infer_batch(datas, labels):
+        calls.append(list(labels))
+        return [[float(len(d))] for d in datas]
+
+    async def run():
+        infer = BatchedInference(infer_batch, size=3, max_wait=0.01)
+        return await asyncio.gather(*(infer(b"x" * n, f"img-{n}") for n in range(1, 6)))
+
+    vectors = asyncio.run(run())
+    assert vectors == [[1.0], [2.0], [3.0], [4.0], [5.0]]
+    assert calls == [["img-1", "img-2", "img-3"], ["img-4", "img-5"]]  # a full batch, then the rest after max_wait
+
+
+def test_dedup_cache_keeps_only_recent_images():
+    cache = LruCache(2)
+    cache["a"], cache["b"] = 1, 2
+    assert cache.get("a") == 1  # a is now the most recent
+    cache["c"] = 3
+    assert (cache.get("b"), cache.get("a"), cache.get("c"), len(cache)) == (None, 1, 3, 2)
+
+    inferred = []
+
+    async def fetch(url):
+        return url.encode()
+
+    async def infer(data, url):
+        inferred.append(url)
+        return [1.0]
+
+    async def run():
+        deduper = ImageEmbeddingDeduper(fetch, infer, cache_size=2)
+        for url in ("a.jpg", "b.jpg", "c.jpg", "a.jpg", "c.jpg"):
+            await deduper.embed(url)
+        return deduper
+
+    deduper = asyncio.run(run())
+    assert inferred == ["a.jpg", "b.jpg", "c.jpg", "a.jpg"]  # a.jpg was evicted, c.jpg was not
+    assert len(deduper._by_url) == len(deduper._by_content) == 2
+
+
+def test_batch_tasks_are_tracked_and_failures_answer_none():
+    async def short_batch(datas, labels):
+        await asyncio.sleep(0)
+        return [[1.0]]  # one vector for a batch of two
+
+    async def run():
+        infer = BatchedInference(short_batch, size=2, max_wait=10, delay=0.01)
+        calls = [asyncio.ensure_future(infer(b"x", "a")), asyncio.ensure_future(infer(b"y", "b")),
+                 asyncio.ensure_future(infer(b"z", "c"))]
+        await asyncio.sleep(0)
+        assert len(infer._tasks) == 1  # the full batch; "c" waits for max_wait
+        await infer.join()  # runs the partial batch too and waits for both
+        return infer, await asyncio.gather(*calls)
+
+    infer, vectors = asyncio.run(run())
+    assert vectors == [[1.0], None, [1.0]] and not infer._tasks and infer.batches == 2
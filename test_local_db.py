@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Tests for the local SQLite storage backend (no Supabase needed).
+Run: python -m pytest -q test_local_db.py
+"""
+from local_db import SQLiteManager
+
+SOURCE = "scraper-test"
+
+
+def _row(pid, **extra):
+    row = {
+        "id": pid,
+        "source": SOURCE,
+        "product_url": f"https://example.com/products/{pid}",
+        "title": f"Product {pid}",
+        "tags": ["clothes"],
+        "second_hand": False,
+        "image_embedding": [0.5, -0.25, 1.0],
+        "info_embedding": None,
+    }
+    row.update(extra)
+    return row
+
+
+def test_upsert_roundtrip_and_merge():
+    db = SQLiteManager(":memory:")
+    assert db.upsert_products_batch([_row("a"), _row("b")]) == (2, 0, [])
+    assert db.upsert_products_batch([_row("a", title="Renamed", updated_at="now")]) == (1, 0, [])
+
+    rows = db.get_products_by_ids(["a", "b", "missing"], select="id,title,tags,image_embedding,second_hand")
+    assert set(rows) == {"a", "b"}
+    assert rows["a"]["title"] == "Renamed"
+    assert rows["a"]["tags"] == ["clothes"]
+    assert rows["a"]["image_embedding"] == [0.5, -0.25, 1.0]
+    assert rows["a"]["second_hand"] is False
+    assert db.products_has_column("updated_at")
+    assert db.get_existing_product_urls(SOURCE) == {
+        "https://example.com/products/a",
+        "https://example.com/products/b",
+    }
+
+
+def test_mark_and_sweep_matches_rpc_semantics():
+    db = SQLiteManager(":memory:")
+    db.upsert_products_batch([_row("a"), _row("b"), _row("c")])
+
+    assert db.mark_and_sweep_products(SOURCE, ["a", "b"]) == {"seen": 2, "missed": 1, "deleted": 0}
+    assert db.mark_and_sweep_products(SOURCE, ["a"]) == {"seen": 1, "missed": 2, "deleted": 1}
+    assert {r["id"] for r in db.get_existing_products_for_sync(SOURCE)} == {"a", "b"}
@@ -0,0 +1,35 @@
+#!/usr/bin/env python3
+"""
+Tests for run instrumentation and the JSON / Prometheus run report.
+Run: python -m pytest -q test_metrics.py
+"""
+import json
+
+import pytest
+
+from metrics import RunMetrics
+
+
+def test_stage_percentiles_bytes_and_errors(tmp_path):
+    m = RunMetrics()
+    for i in range(1, 101):
+        m.record("product.fetch", i / 100.0, nbytes=10)
+    with pytest.raises(ValueError):
+        with m.stage("product.parse") as t:
+            t.bytes = 5
+            raise ValueError("bad page")
+    m.incr("products_failed")
+
+    report = m.write_json(str(tmp_path / "run_report.json"), {"result": {"inserted": 3}})
+    fetch = report["stages"]["product.fetch"]
+    assert (fetch["count"], fetch["bytes"]) == (100, 1000)
+    assert (fetch["p50_seconds"], fetch["p95_seconds"], fetch["p99_seconds"]) == (0.5, 0.95, 0.99)
+    assert report["stages"]["product.parse"]["errors"] == 1
+    assert json.loads((tmp_path / "run_report.json").read_text())["result"] == {"inserted": 3}
+
+    prom = tmp_path / "scraper.prom"
+    m.write_prometheus(str(prom), "scraper-test", {"result": {"inserted": 3}})
+    text = prom.read_text()
+    assert 'scraper_stage_count{source="scraper-test",stage="product.fetch"} 100' in text
+    assert 'scraper_stage_latency_seconds{source="scraper-test",stage="product.fetch",quantile="0.95"} 0.95' in text
+    assert 'scraper_run_result{source="scraper-test",name="inserted"} 3' in text
@@ -0,0 +1,75 @@
+"""Preprocessing fast path: draft-mode decode, one resize, batch normalization into a reused buffer."""
+import io
+
+import numpy as np
+import pytest
+from PIL import Image
+
+from preprocess import ImageBatchPreprocessor, decode_to_size, processor_reference
+
+
+def _jpeg(seed, size=(1200, 1500)):
+    w, h = size
+    shade = np.linspace(0.3, 1.0, w)[None, :, None] * np.linspace(1.0, 0.5, h)[:, None, None]
+    image = Image.fromarray((shade * np.array([200, 40 + seed * 30, 90])).astype(np.uint8))
+    image.paste((255, 255, 255), (w // 4, h // 3, w // 2, 2 * h // 3))
+    buf = io.BytesIO()
+    image.save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def test_draft_decode_matches_full_decode():
+    data = _jpeg(1)
+    full = Image.open(io.BytesIO(data)).convert("RGB").resize((384, 384), Image.Resampling.BICUBIC)
+    fast = decode_to_size(data, 384)
+    assert fast.shape == (384, 384, 3) and fast.dtype == np.uint8
+    assert np.abs(fast.astype(np.int16) - np.asarray(full, dtype=np.int16)).mean() < 2.0
+
+
+def test_batch_is_normalized_into_a_reused_buffer():
+    allocations = []
+
+    def allocate(shape):
+        allocations.append(shape)
+        return np.empty(shape, dtype=np.float32)
+
+    pre = ImageBatchPreprocessor(size=64, allocate=allocate)
+    batch, ok = pre([_jpeg(0, (200, 160)), b"not an image", _jpeg(2, (90, 90))], ["a", "bad", "c"])
+    assert ok == [0, 2] and batch.shape == (2, 3, 64, 64) and batch.dtype == np.float32
+    expected = decode_to_size(_jpeg(2, (90, 90)), 64).transpose(2, 0, 1) / 127.5 - 1.0  # mean = std = 0.5
+    assert np.allclose(batch[1], expected, atol=1e-5)
+    assert batch.min() >= -1.0 and batch.max() <= 1.0
+
+    again, _ = pre([_jpeg(1, (120, 120))])
+    assert np.shares_memory(batch, again) and allocations == [(3, 3, 64, 64)]  # smaller batches reuse it
+    pre([_jpeg(i, (80, 80)) for i in range(5)])
+    assert allocations[-1] == (5, 3, 64, 64)
+
+
+def _textured_jpeg(seed, size=(1200, 1500)):
+    """Product-photo-sized JPEG with fine detail, where resampling differences show most."""
+    w, h = size
+    detail = np.random.default_rng(seed).integers(0, 255, (h // 8, w // 8, 3)).astype(np.uint8)
+    buf = io.BytesIO()
+    Image.fromarray(detail).resize((w, h), Image.Resampling.BICUBIC).save(buf, format="JPEG", quality=90)
+    return buf.getvalue()
+
+
+def test_fast_path_stays_within_tolerance_of_the_processor_path():
+    datas = [_jpeg(0), _jpeg(2, (800, 800)), _textured_jpeg(0), _textured_jpeg(1, (1000, 1000))]
+    fast, ok = ImageBatchPreprocessor()(datas)
+    diff = np.abs(fast - processor_reference(datas))
+    assert ok == [0, 1, 2, 3]
+    # normalized units span [-1, 1]: 0.02 is ~2.5 of 255 levels; hard edges differ most
+    assert diff.mean() < 0.02 and np.percentile(diff, 99.9) < 0.15 and diff.max() < 0.4
+
+
+def test_processor_reference_matches_the_siglip_processor():
+    transformers = pytest.importorskip("transformers")
+    processor = transformers.SiglipImageProcessor(size={"height": 384, "width": 384})
+    datas = [_jpeg(1), _textured_jpeg(2)]
+    images = [Image.open(io.BytesIO(d)).convert("RGB").resize((384, 384), Image.Resampling.LANCZOS) for d in datas]
+    expected = processor(images, return_tensors="np")["pixel_values"]
+    assert np.allclose(processor_reference(datas), expected, atol=1e-5)
+    fast, _ = ImageBatchPreprocessor()(datas)
+    assert np.abs(fast - expected).mean() < 0.02
@@ -0,0 +1,50 @@
+"""--profile output: stage-attributed samples, tracemalloc snapshots, cProfile dump."""
+import os
+import threading
+import time
+
+import profiling
+from metrics import get_metrics
+
+
+def _busy_parse(seconds):
+    end = time.perf_counter() + seconds
+    n = 0
+    while time.perf_counter() < end:
+        n += sum(range(200))
+    return n
+
+
+def _busy_fetch(seconds):
+    end = time.perf_counter() + seconds
+    while time.perf_counter() < end:
+        [str(i) for i in range(200)]
+
+
+def test_profile_attributes_samples_to_stages(tmp_path):
+    out = profiling.start_profiler(str(tmp_path)).out_dir
+    try:
+        metrics = get_metrics()
+
+        def worker():
+            with metrics.stage("test.fetch"):
+                _busy_fetch(0.3)
+
+        t = threading.Thread(target=worker)
+        t.start()
+        with metrics.stage("test.parse"):
+            _busy_parse(0.3)
+        t.join()
+    finally:
+        assert profiling.stop_profiler() == out
+
+    stages = open(os.path.join(out, "stages.txt"), encoding="utf-8").read()
+    parse_section = stages.split("== test.parse")[1].split("\n== ")[0]
+    fetch_section = stages.split("== test.fetch")[1].split("\n== ")[0]
+    assert "_busy_parse" in parse_section and "_busy_fetch" not in parse_section
+    assert "_busy_fetch" in fetch_section and "_busy_parse" not in fetch_section
+
+    memory = open(os.path.join(out, "memory.txt"), encoding="utf-8").read()
+    assert "test.parse" in memory and "Top growth" in memory
+    assert os.path.exists(os.path.join(out, "cpu.prof"))
+    assert profiling.torch_profile("image_inference").__class__.__name__ == "nullcontext"
@@ -0,0 +1,145 @@
+"""
+Shard assignment and the queue between a sharded run's coordinator and its workers: the SQLite
+queue, and PostgrestShardQueue against the PostgREST stand-in (conftest.py) with its RPCs
+(sql/shard_queue.sql) served by a SQLite ShardQueue.
+"""
+from collections import Counter
+
+import pytest
+
+import sharding
+from sharding import PostgrestShardQueue, ShardQueue, shard_for
+from utils import generate_product_id
+
+
+class ShardRpcs:
+    """The shard_* RPCs (sql/shard_queue.sql) served from a local SQLite ShardQueue."""
+
+    def __init__(self, path):
+        self.queue = ShardQueue(path)
+
+    def __call__(self, name, params):
+        return getattr(self, name)(**params)
+
+    def shard_create_run(self, p_source, p_n_shards, p_full_sweep):
+        return self.queue.create_run(p_source, p_n_shards, p_full_sweep)
+
+    def shard_enqueue(self, p_run_id, p_tasks):
+        with self.queue.conn:
+            self.queue.conn.executemany(
+                "INSERT OR IGNORE INTO shard_tasks (run_id, shard, product_id, url, discovered_as, lastmod, updated_at)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(p_run_id, t["shard"], t["product_id"], t["url"], t["discovered_as"], t["lastmod"], t["updated_at"])
+                 for t in p_tasks],
+            )
+
+    def shard_set_status(self, p_run_id, p_status):
+        self.queue.set_status(p_run_id, p_status)
+
+    def shard_set_nav_handles(self, p_run_id, p_handles):
+        self.queue.set_nav_handles(p_run_id, p_handles)
+
+    def shard_results(self, p_run_id):
+        return [
+            {"shard": shard, "ok": r.pop("ok"), "result": r}
+            for shard, r in self.queue.results(p_run_id).items()
+        ]
+
+    def shard_find_run(self, p_source, p_shard):
+        run = self.queue.find_run(p_source, p_shard)
+        return [dict(zip(("run_id", "n_shards", "full_sweep"), run))] if run else []
+
+    def shard_run_status(self, p_run_id):
+        return self.queue.run_status(p_run_id)
+
+    def shard_nav_handles(self, p_run_id):
+        return sorted(self.queue.nav_handles(p_run_id)) or None
+
+    def shard_tasks_after(self, p_run_id, p_shard, p_after, p_limit):
+        rows = self.queue.tasks_after(p_run_id, p_shard, p_after, p_limit)
+        return [dict(zip(("seq", "url", "discovered_as", "lastmod", "updated_at"), r)) for r in rows]
+
+    def shard_report(self, p_run_id, p_shard, p_ok, p_result):
+        self.queue.report(p_run_id, p_shard, p_ok, p_result)
+
+
+def _postgrest_queue(stand_in):
+    queue = PostgrestShardQueue.__new__(PostgrestShardQueue)
+    queue.base_url = "http://localhost/rest/v1"
+    queue.session = stand_in
+    return queue
+
+
+@pytest.fixture(params=["sqlite", "postgrest"])
+def queues(request, tmp_path, postgrest):
+    """(coordinator, worker) queues with separate connections, as across processes (or hosts)."""
+    path = str(tmp_path / "queue.sqlite3")
+    if request.param == "sqlite":
+        return ShardQueue(path), ShardQueue(path)
+    stand_in = postgrest(ShardRpcs(path))
+    return _postgrest_queue(stand_in), _postgrest_queue(stand_in)
+
+
+def test_shard_assignment_is_stable_and_spread():
+    ids = [generate_product_id("scraper-x", f"https://shop.com/products/item-{i}") for i in range(3000)]
+    assert [shard_for(pid, 4) for pid in ids] == [shard_for(pid, 4) for pid in ids]
+    counts = Counter(shard_for(pid, 4) for pid in ids)
+    assert set(counts) == {0, 1, 2, 3} and min(counts.values()) > 600
+    assert {shard_for(pid, 1) for pid in ids} == {0}
+
+
+def test_queue_round_trip_between_coordinator_and_workers(queues):
+    coordinator, worker = queues
+    assert worker.find_run("x", 0) is None
+
+    run_id = coordinator.create_run("x", 2, full_sweep=True)
+    urls = [f"https://shop.com/products/item-{i}" for i in range(10)]
+    tasks = [(generate_product_id("x", u), u, None, "2026-01-01", None) for u in urls]
+    coordinator.enqueue(run_id, 2, tasks[:6])
+    assert worker.find_run("x", 1) == (run_id, 2, True) and worker.find_run("x", 2) is None
+    coordinator.enqueue(run_id, 2, tasks[4:])  # re-queued products are ignored
+    coordinator.set_status(run_id, "listed")
+    assert worker.nav_handles(run_id) == frozenset()
+    coordinator.set_nav_handles(run_id, {"shop-all", "sale"})
+    assert worker.nav_handles(run_id) == frozenset({"shop-all", "sale"})
+
+    got = {}
+    for shard in (0, 1):
+        rows = worker.tasks_after(run_id, shard, 0, limit=3)
+        rows += worker.tasks_after(run_id, shard, rows[-1][0])
+        got[shard] = [r[1] for r in rows]
+        assert all(shard_for(generate_product_id("x", u), 2) == shard for u in got[shard])
+    assert sorted(got[0] + got[1]) == sorted(urls)
+
+    worker.report(run_id, 0, True, {"seen_ids": [tasks[0][0]]})
+    assert worker.find_run("x", 0) is None and worker.find_run("x", 1) == (run_id, 2, True)
+    assert coordinator.results(run_id) == {0: {"ok": True, "seen_ids": [tasks[0][0]]}}
+
+    newer = coordinator.create_run("x", 2, full_sweep=False)
+    assert worker.run_status(run_id) == "abandoned"
+    assert worker.find_run("x", 0) == (newer, 2, False)
+    coordinator.close()
+    worker.close()
+
+
+def test_postgrest_queue_retries_server_errors(tmp_path, monkeypatch, postgrest):
+    monkeypatch.setattr(sharding, "RETRY_DELAY", 0)
+    rpcs = ShardRpcs(str(tmp_path / "queue.sqlite3"))
+    stand_in = postgrest(rpcs, fail_first=2)
+    run_id = _postgrest_queue(stand_in).create_run("x", 2, full_sweep=False)
+    assert stand_in.calls == ["shard_create_run"] * 3
+    assert rpcs.queue.run_status(run_id) == "listing"
+
+
+def test_postgrest_queue_not_installed(tmp_path, postgrest):
+    stand_in = postgrest(ShardRpcs(str(tmp_path / "queue.sqlite3")), installed=False)
+    with pytest.raises(RuntimeError, match="sql/shard_queue.sql"):
+        _postgrest_queue(stand_in).find_run("x", 0)
+    assert stand_in.calls == ["shard_find_run"]
+
+
+def test_postgrest_queue_denied_without_the_service_role(tmp_path, postgrest):
+    stand_in = postgrest(ShardRpcs(str(tmp_path / "queue.sqlite3")), denied=True)
+    with pytest.raises(RuntimeError, match="service-role key"):
+        _postgrest_queue(stand_in).report("run", 0, True, {"seen_ids": []})
+    assert stand_in.calls == ["shard_report"]
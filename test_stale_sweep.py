@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+"""
+Tests for SupabaseManager.mark_and_sweep_products against the PostgREST stand-in (conftest.py) whose RPC is
+served by local_db.SQLiteManager.mark_and_sweep_products (same semantics as
+sql/mark_and_sweep_products.sql; no Supabase needed).
+Run: python -m pytest -q test_stale_sweep.py
+"""
+import pytest
+import requests
+
+from database import SupabaseManager
+from local_db import SQLiteManager
+
+SOURCE = "scraper-test"
+
+
+class SweepStore:
+    """Products in a local SQLite store; serves the mark_and_sweep_products RPC."""
+
+    def __init__(self):
+        self.db = SQLiteManager(":memory:")
+
+    def __call__(self, name, params):
+        assert name == "mark_and_sweep_products"
+        return [self.db.mark_and_sweep_products(params["p_source"], params["p_seen_ids"], params["p_threshold"])]
+
+    def add(self, pid, source=SOURCE, misses=0):
+        with self.db.conn:
+            self.db.conn.execute(
+                "INSERT INTO products (id, source, product_url, consecutive_misses) VALUES (?, ?, ?, ?)",
+                (pid, source, f"https://shop.com/products/{pid}", misses),
+            )
+
+    def ids(self, source=SOURCE):
+        rows = self.db.conn.execute("SELECT id FROM products WHERE source = ? ORDER BY id", (source,))
+        return [r[0] for r in rows]
+
+    def misses(self, pid):
+        return self.db.conn.execute("SELECT consecutive_misses FROM products WHERE id = ?", (pid,)).fetchone()[0]
+
+
+def _manager(stand_in):
+    db = SupabaseManager.__new__(SupabaseManager)
+    db.base_url = "http://localhost/rest/v1"
+    db.session = stand_in
+    return db
+
+
+def test_mark_and_sweep_deletes_after_threshold(postgrest):
+    store = SweepStore()
+    for pid in ("a", "b", "c"):
+        store.add(pid)
+    store.add("other", source="another-scraper")
+    pg = postgrest(store)
+    db = _manager(pg)
+
+    assert db.mark_and_sweep_products(SOURCE, ["a", "b"], threshold=2) == {"seen": 2, "missed": 1, "deleted": 0}
+    assert store.misses("c") == 1
+
+    assert db.mark_and_sweep_products(SOURCE, ["a", "b"], threshold=2) == {"seen": 2, "missed": 1, "deleted": 1}
+    assert store.ids() == ["a", "b"]
+    assert store.ids("another-scraper") == ["other"]
+    assert pg.calls == ["mark_and_sweep_products"] * 2
+
+
+def test_mark_and_sweep_resets_misses_when_seen_again(postgrest):
+    store = SweepStore()
+    store.add("a", misses=1)
+    db = _manager(postgrest(store))
+
+    assert db.mark_and_sweep_products(SOURCE, ["a"]) == {"seen": 1, "missed": 0, "deleted": 0}
+    assert store.misses("a") == 0
+
+
+def test_mark_and_sweep_returns_none_when_not_installed(postgrest):
+    store = SweepStore()
+    store.add("a")
+    assert _manager(postgrest(store, installed=False)).mark_and_sweep_products(SOURCE, []) is None
+    assert store.ids() == ["a"]
+
+
+def test_mark_and_sweep_raises_when_the_outcome_is_unknown(postgrest):
+    store = SweepStore()
+    store.add("a")
+    with pytest.raises(requests.Timeout):  # not None: the caller must not sweep again locally
+        _manager(postgrest(store, fail=requests.Timeout("read timed out"))).mark_and_sweep_products(SOURCE, [])
+    assert store.misses("a") == 1
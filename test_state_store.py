@@ -0,0 +1,135 @@
+#!/usr/bin/env python3
+"""
+Tests for the local SQLite state stores (no network needed).
+Run: python -m pytest -q test_state_store.py
+"""
+import json
+import sqlite3
+
+from state_store import ProductStateIndex, StaleStateStore, UpsertJournal, refetch_reason
+
+A = "a" * 64
+B = "b" * 64
+C = "c" * 64
+
+
+def test_migrates_legacy_json(tmp_path):
+    legacy = tmp_path / "stale_state_x.json"
+    legacy.write_text(json.dumps({A: 1, B: 0, C: "2"}), encoding="utf-8")
+
+    store = StaleStateStore(str(tmp_path / "stale_state_x.sqlite3"), legacy_json_path=str(legacy))
+    assert store.items() == {A: 1, C: 2}
+    assert not legacy.exists()
+    assert (tmp_path / "stale_state_x.json.migrated").exists()
+    store.close()
+
+
+def test_counters_persist_across_runs(tmp_path):
+    path = str(tmp_path / "stale_state_x.sqlite3")
+
+    store = StaleStateStore(path)
+    store.mark_seen([A])
+    store.mark_missed([B, C])
+    store.close()
+
+    store = StaleStateStore(path)
+    store.mark_seen([C])
+    store.mark_missed([B])
+    assert store.ids_at_threshold(2) == [B]
+    store.retain([A])
+    assert store.items() == {}
+    store.close()
+
+
+def test_journal_replays_unacknowledged_rows(tmp_path):
+    path = str(tmp_path / "upsert_journal_x.sqlite3")
+
+    journal = UpsertJournal(path, max_attempts=2)
+    journal.record([{"id": A, "title": "old", "image_embedding": [0.5, 0.25]}, {"id": B, "title": "b"}])
+    journal.record([{"id": A, "title": "new", "image_embedding": [0.5, 0.25]}])
+    journal.ack([B])
+    journal.close()
+
+    # Simulated crash: reopen and read back what is still pending.
+    journal = UpsertJournal(path, max_attempts=2)
+    assert journal.pending() == [{"id": A, "title": "new", "image_embedding": [0.5, 0.25]}]
+    assert journal.mark_failed([A]) == 0
+    assert journal.mark_failed([A]) == 1
+    assert len(journal) == 0
+    journal.close()
+
+
+def test_product_state_index_round_trips_and_forgets_unlisted(tmp_path):
+    index = ProductStateIndex(str(tmp_path / "product_state_x.sqlite3"))
+    index.record([
+        {"id": A, "url": "https://shop.com/products/a", "lastmod": "2026-01-01", "fetched_at": 100.0,
+         "content_hash": "h1", "image_phash": "00c0c0c0c0000000"},
+        {"id": B, "url": "https://shop.com/products/b", "updated_at": "2026-02-01", "fetched_at": 100.0},
+        {"id": C, "url": None},  # not synced: never stored
+    ])
+    index.record([{"id": A, "url": "https://shop.com/products/a", "lastmod": "2026-03-01", "fetched_at": 200.0}])
+    index.mark_seen([B], 300.0)
+    index.set_meta("last_full_sweep", "300")
+    index.close()
+
+    index = ProductStateIndex(str(tmp_path / "product_state_x.sqlite3"))
+    state = index.load()
+    assert set(state) == {A, B}
+    assert state[A]["lastmod"] == "2026-03-01" and state[A]["content_hash"] is None
+    assert state[A]["image_phash"] == "00c0c0c0c0000000"  # kept until the image is embedded again
+    assert state[B]["last_seen"] == 300.0
+    assert index.get_many([B, C]) == {B: state[B]}
+    assert index.get_meta("last_full_sweep") == "300" and index.get_meta("missing") is None
+    index.retain([B])
+    assert len(index) == 1 and set(index.load()) == {B}
+    index.close()
+
+
+def test_product_state_index_migrates_the_sitemap_lastmod_index(tmp_path):
+    legacy = tmp_path / "sitemap_lastmod_x.sqlite3"
+    conn = sqlite3.connect(str(legacy))
+    conn.execute("CREATE TABLE sitemap_lastmod (url TEXT PRIMARY KEY, lastmod TEXT NOT NULL) WITHOUT ROWID")
+    conn.executemany("INSERT INTO sitemap_lastmod VALUES (?, ?)", [("https://shop.com/products/a", "2026-01-01"),
+                                                                   ("https://shop.com/products/b", "2026-02-01")])
+    conn.commit()
+    conn.close()
+    ids = {"https://shop.com/products/a": A, "https://shop.com/products/b": B}
+    last_written = legacy.stat().st_mtime
+
+    index = ProductStateIndex(str(tmp_path / "product_state_x.sqlite3"), str(legacy), ids.get)
+    state = index.load()
+    assert set(state) == {A, B} and state[B]["lastmod"] == "2026-02-01"
+    synced_at = state[A]["fetched_at"]
+    assert synced_at == last_written
+    assert not legacy.exists() and (tmp_path / "sitemap_lastmod_x.sqlite3.migrated").exists()
+    assert refetch_reason(state[A], "2026-01-01", None, synced_at + 60, 3600) is None
+    assert refetch_reason(state[B], "2026-03-01", None, synced_at + 60, 3600) == "lastmod"
+    assert index.get_meta("last_full_sweep") == str(synced_at)  # no forced full sweep after the upgrade
+    index.close()
+
+
+def test_product_state_index_adds_new_columns(tmp_path):
+    path = str(tmp_path / "product_state_x.sqlite3")
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE product_state (id BLOB PRIMARY KEY, url TEXT NOT NULL, lastmod TEXT,"
+                 " updated_at TEXT, fetched_at REAL, content_hash TEXT, image_hash TEXT,"
+                 " embedding_hash TEXT, last_seen REAL) WITHOUT ROWID")
+    conn.commit()
+    conn.close()
+    index = ProductStateIndex(path)
+    index.record([{"id": A, "url": "https://shop.com/products/a", "image_phash": "ff"}])
+    assert index.load()[A]["image_phash"] == "ff"
+    index.close()
+
+
+def test_refetch_reason():
+    state = {"lastmod": "2026-01-01", "updated_at": None, "fetched_at": 1000.0}
+    day = 86400.0
+    assert refetch_reason(None, "2026-01-01", None, 1000.0, day) == "new"
+    assert refetch_reason(state, "2026-01-01", None, 1000.0 + day / 2, day) is None
+    assert refetch_reason(state, "2026-01-02", None, 1000.0, day) == "lastmod"
+    assert refetch_reason(state, None, "2026-01-02", 1000.0, day) == "updated_at"
+    assert refetch_reason(state, "2026-01-01", None, 1000.0 + 2 * day, day) == "age"
+    # without an age bound, only a change signal lets a product be skipped
+    assert refetch_reason(state, "2026-01-01", None, 1000.0 + 2 * day, 0) is None
+    assert refetch_reason(state, None, None, 1001.0, 0) == "age"
@@ -0,0 +1,43 @@
+"""Store configs for multi-store runs and the per-host rate limiter they share."""
+import json
+
+import pytest
+
+from config import SOURCE
+from http_client import HostRateLimiter
+from stores import StoreConfig, load_store_configs
+
+
+def test_store_configs_load_with_defaults(tmp_path):
+    assert [s.source for s in load_store_configs("")] == [SOURCE]
+
+    path = tmp_path / "stores.json"
+    path.write_text(json.dumps([
+        {"source": "scraper-a", "base_url": "https://a.com/"},
+        {"source": "scraper-b:sale", "base_url": "https://b.com", "brand": "B", "collections": ["sale", "new-in"]},
+    ]), encoding="utf-8")
+    a, b = load_store_configs(str(path))
+    assert a.base_url == "https://a.com" and a.sitemap_url == "https://a.com/sitemap.xml"
+    assert a.collection_urls == ["https://a.com/collections/shop-all"]
+    # a subset of collections is not what the store-wide sitemap lists
+    assert b.sitemap_url is None and b.brand == "B"
+    assert b.collection_urls == ["https://b.com/collections/sale", "https://b.com/collections/new-in"]
+    assert b.safe_source == "scraper-b_sale"
+
+    path.write_text(json.dumps([{"source": "x", "base_url": "https://a.com"}] * 2), encoding="utf-8")
+    with pytest.raises(ValueError, match="Duplicate"):
+        load_store_configs(str(path))
+    with pytest.raises(ValueError):
+        StoreConfig.from_dict({"source": "x"})
+
+
+def test_rate_limiter_spaces_requests_per_host(monkeypatch):
+    clock = [100.0]
+    monkeypatch.setattr("http_client.time.monotonic", lambda: clock[0])
+    limiter = HostRateLimiter(rate=2)
+    delays = [limiter.reserve("https://a.com/products/x") for _ in range(3)]
+    assert delays == [0.0, 0.5, 1.0]
+    assert limiter.reserve("https://B.com/") == 0.0  # other hosts have their own budget
+    clock[0] = 102.0
+    assert limiter.reserve("https://a.com/products/y") == 0.0
+    assert HostRateLimiter(rate=0).reserve("https://a.com/") == 0.0
@@ -0,0 +1,29 @@
+"""Info-text embedding cache: keyed by the exact (stripped) text and the model."""
+import time
+
+import numpy as np
+
+from text_embedding_cache import TextEmbeddingCache, info_text_key
+
+
+def test_keys_follow_the_exact_text_and_model():
+    text = "Linen shirt Tops Women S M L Relaxed fit 89.00"
+    assert info_text_key(text) == info_text_key(f"  {text}\n")  # the tokenizer sees text.strip()
+    assert info_text_key(text) != info_text_key(text.replace("89.00", "79.00"))  # price-only change
+    assert info_text_key(text, "model-a") != info_text_key(text, "model-b")
+
+
+def test_cache_round_trips_and_prunes_unused(tmp_path):
+    path = str(tmp_path / "text_embedding_cache_x.sqlite3")
+    cache = TextEmbeddingCache(path)
+    a, b = cache.key("shirt 89.00"), cache.key("shirt 79.00")
+    vector = np.random.rand(768).astype(np.float32).tolist()
+    cache.put({a: vector, b: None})  # failed embeddings are not cached
+    cache.close()
+
+    cache = TextEmbeddingCache(path)
+    assert cache.get_many([a, b, a]) == {a: vector} and len(cache) == 1
+    cache.conn.execute("UPDATE text_embeddings SET used_at = ?", (time.time() - 10 * 86400,))
+    assert cache.prune(30 * 86400) == 0
+    assert cache.prune(5 * 86400) == 1 and len(cache) == 0
+    cache.close()
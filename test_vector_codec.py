@@ -0,0 +1,50 @@
+"""Half-precision vectors: compact text and blobs that read back exactly, and similarity error within the rounding bound."""
+import json
+
+import numpy as np
+
+from vector_codec import (
+    as_vector, bfloat16_bits, bfloat16_to_float32, blob_to_vector, round_trip, vector_text,
+)
+
+
+def test_bfloat16_rounds_to_nearest_even():
+    values = np.array([1.0, 1 + 2 ** -8, 1 + 3 * 2 ** -8, -2.5], dtype=np.float32)
+    assert bfloat16_bits(values).tolist() == [0x3F80, 0x3F80, 0x3F82, 0xC020]
+    assert bfloat16_to_float32(bfloat16_bits(values)).tolist() == [1.0, 1.0, 1 + 2 ** -6, -2.5]
+
+
+def test_half_precision_text_and_blobs_read_back_exactly():
+    v = np.random.default_rng(1).standard_normal(768).astype(np.float32)
+    v /= np.linalg.norm(v)
+    half = v.astype(np.float16)
+    text = vector_text(half, "float16")
+    assert np.array_equal(np.asarray(json.loads(text), dtype=np.float16), half)
+    bits = bfloat16_bits(v)
+    assert np.array_equal(bfloat16_bits(json.loads(vector_text(bfloat16_to_float32(bits), "bfloat16"))), bits)
+    assert len(text) < 0.5 * len(json.dumps(v.tolist()))
+
+    # blobs of every precision decode, whatever the run's EMBEDDING_PRECISION
+    blobs = {
+        "float32": v.tobytes(),
+        "float16": b"\x01" + half.tobytes(),
+        "bfloat16": b"\x02" + bits.tobytes(),
+    }
+    for precision, blob in blobs.items():
+        assert np.allclose(as_vector(blob_to_vector(blob)), round_trip(v, precision), atol=4e-3)
+    assert len(blobs["float16"]) == 2 * 768 + 1
+
+
+def test_similarity_error_stays_within_the_rounding_bound():
+    # Rounding to nearest moves each component by at most u relative (unit roundoff), so for unit
+    # vectors |q.c - q'.c'| <= 2u + u^2 whatever the data. This bounds how far scores can move; it
+    # says nothing about retrieval quality on real embeddings (benchmark.py precision --db measures that).
+    rng = np.random.default_rng(2)
+    corpus = rng.standard_normal((500, 768)).astype(np.float32)
+    corpus[:, :8] *= 40  # a few dominant dimensions, as real embeddings have
+    corpus /= np.linalg.norm(corpus, axis=1, keepdims=True)
+    queries = corpus[:50]
+    for precision, u in (("float16", 2.0 ** -11), ("bfloat16", 2.0 ** -8)):
+        exact = queries.astype(np.float64) @ corpus.T.astype(np.float64)
+        rounded = round_trip(queries, precision).astype(np.float64) @ round_trip(corpus, precision).T.astype(np.float64)
+        assert np.abs(rounded - exact).max() <= 2 * u + u * u + 1e-6  # slack for float16 subnormals
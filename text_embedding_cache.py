@@ -0,0 +1,25 @@
+"""
+Local cache of info-text embeddings, keyed by a hash of the exact text fed to the tokenizer (and
+the model name). A product's info_embedding is recomputed exactly when its text changes (a new
+price included) and never for an identical text, whatever happened to its image.
+"""
+import hashlib
+
+from config import EMBEDDING_MODEL
+from state_store import VectorCache
+
+
+def info_text_key(text: str, model: str = EMBEDDING_MODEL) -> str:
+    """Cache key of an info text: generate_text_embedding embeds text.strip()."""
+    return hashlib.sha256(f"{model}\n{text.strip()}".encode("utf-8")).hexdigest()
+
+
+class TextEmbeddingCache(VectorCache):
+    """Info-text key -> vector (EMBEDDING_PRECISION) in SQLite (WAL)."""
+
+    def __init__(self, path: str, model: str = EMBEDDING_MODEL):
+        super().__init__(path, table="text_embeddings")
+        self.model = model
+
+    def key(self, text: str) -> str:
+        return info_text_key(text, self.model)
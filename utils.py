@@ -4,10 +4,35 @@ import aiohttp
 import requests
 from fake_useragent import UserAgent
 from bs4 import BeautifulSoup
+import bisect
+import json
 import re
 import uuid
-from urllib.parse import urljoin
-from config import HEADERS, BASE_URL, MAX_CONCURRENT_REQUESTS
+from urllib.parse import urljoin, urlsplit, urlunsplit
+from config import HEADERS, BASE_URL, MAX_CONCURRENT_REQUESTS, CATEGORY_MAPPING
+
+# Patterns compiled once at import (extractors run for every product page)
+_CURRENCY_SYMBOL_RE = re.compile(r'[£$€¥₹₽₩₦₨₪₫₡₵₺₴₸₼₲₱₭₯₰₳₶₷₹₻₽₾₿]')
+_PRICE_NUMBER_RE = re.compile(r'(\d+(?:\.\d{2})?)')
+_PRICE_TEXT_RE = re.compile(r'(\d+(?:[.,]\d{1,2})?)\s*([A-Z]{3})?')
+_PRICE_SCRIPT_HINT_RE = re.compile(r'price|variant|money_format')
+_SCRIPT_PRICE_RE = re.compile(r'"price"\s*:\s*["\']?(\d+(?:\.\d*)?)')
+_VARIANT_HINT_RE = re.compile('variant')
+_AVAILABLE_HINT_RE = re.compile('available')
+_VARIANTS_JS_RE = re.compile(r'variants\s*:\s*\[(.*?)\]', re.DOTALL)
+_VARIANT_OPTION_RE = re.compile(r'"option(\d+)"\s*:\s*"([^"]*)"')
+_SHOPIFY_CURRENCY_RE = re.compile(r'Shopify\.currency\s*=\s*\{[^}]*"active"\s*:\s*"([A-Z]{3})"')
+_SHOPIFY_META_RE = re.compile(r'var\s+meta\s*=\s*')
+_DOUBLE_COMMA_RE = re.compile(r',\s*,')
+_COLLECTION_HREF_RE = re.compile(r'/collections/[\w\-]+')
+_COLLECTION_HANDLE_RE = re.compile(r'/collections/([^/?#]+)')
+_ADD_TO_CART_RE = re.compile('add to cart|add to bag|buy now|shop now', re.I)
+_CART_ADD_ACTION_RE = re.compile('/cart/add')
+_PRODUCT_FORM_CLASS_RE = re.compile('product|add-to-cart')
+# Product page path, optionally under a collection: /collections/shop-all/products/item-1/
+_PRODUCT_PATH_RE = re.compile(r'^(?:/collections/[^/]+)?(/products/[^/]+)')
+# Shopify size suffix before the extension: item_600x.jpg, item_600x800_crop_center@2x.jpg, item_{width}x.jpg
+_SHOPIFY_SIZE_SUFFIX_RE = re.compile(r'_(?:\d+x\d*|x\d+|\{width\}x)(?:_crop_[a-z]+)?(?:@\dx)?(?=\.\w+$)')
 
 
 def generate_product_id(source: str, product_url: str) -> str:
@@ -16,6 +41,54 @@ def generate_product_id(source: str, product_url: str) -> str:
     return hashlib.sha256(id_string.encode("utf-8")).hexdigest()
 
 
+def canonical_product_url(url, base_url=BASE_URL):
+    """
+    One URL per product page, so ids, embeddings and stale tracking don't split across variants:
+    absolute, lowercase host, no /collections/<handle> prefix, query (tracking/variant params),
+    fragment or trailing slash. '/collections/tees/products/Tee-1/?utm_source=x' -> '<base>/products/Tee-1'.
+    """
+    parts = urlsplit(urljoin(base_url + '/', url.strip()))
+    m = _PRODUCT_PATH_RE.match(parts.path)
+    path = m.group(1) if m else (parts.path.rstrip('/') or '/')
+    return urlunsplit((parts.scheme.lower(), parts.netloc.lower(), path, '', ''))
+
+
+class ProductUrlIndex:
+    """
+    Product URLs discovered this run, by canonical URL. Shared by every discovery source
+    (collection pages, products.json, sitemap) so each product is yielded, scraped and embedded once.
+    """
+
+    def __init__(self, base_url=BASE_URL):
+        self.base_url = base_url
+        self._first_seen = {}  # canonical -> URL as first discovered (keeps its /collections/ context)
+        self.added = {}
+        self.duplicates = {}
+
+    def add(self, url, source='html'):
+        """Canonical URL if this product is new, None if any source already found it."""
+        canonical = canonical_product_url(url, self.base_url)
+        if canonical in self._first_seen:
+            self.duplicates[source] = self.duplicates.get(source, 0) + 1
+            return None
+        self._first_seen[canonical] = url
+        self.added[source] = self.added.get(source, 0) + 1
+        return canonical
+
+    def discovered_as(self, url):
+        """The URL a product was first discovered under (None if not discovered this run)."""
+        return self._first_seen.get(canonical_product_url(url, self.base_url))
+
+    def __contains__(self, url):
+        return canonical_product_url(url, self.base_url) in self._first_seen
+
+    def __len__(self):
+        return len(self._first_seen)
+
+    def __iter__(self):
+        return iter(self._first_seen)
+
+
 def generate_uuid():
     """Generate a unique UUID for product ID (legacy). Prefer generate_product_id for products."""
     return str(uuid.uuid4())
@@ -30,8 +103,8 @@ def extract_price(text):
     """Extract price from text, handling currency symbols (returns single float)."""
     if not text:
         return None
-    cleaned = re.sub(r'[£$€¥₹₽₩₦₨₪₫₡₵₺₴₸₼₲₱₭₯₰₳₶₷₹₻₽₾₿]', '', text)
-    match = re.search(r'(\d+(?:\.\d{2})?)', cleaned)
+    cleaned = _CURRENCY_SYMBOL_RE.sub('', text)
+    match = _PRICE_NUMBER_RE.search(cleaned)
     return float(match.group(1)) if match else None
 
 
@@ -48,12 +121,137 @@ def _normalize_price_value(val: float, currency: str) -> float:
     return val
 
 
-def extract_prices_with_currencies(soup):
+_JSON_DECODER = json.JSONDecoder()
+SIZE_OPTION_NAMES = {'size', 'sizes', 'größe', 'grösse', 'taille', 'talla', 'taglia', 'velikost', 'rozmiar', 'storlek'}
+
+
+def _price_minor_units(value):
+    """Shopify variant price -> minor units: ints are already cents, '45.00' strings are major units."""
+    if value is None or isinstance(value, bool):
+        return None
+    if isinstance(value, int):
+        return value
+    try:
+        return int(round(float(value) * 100))
+    except (TypeError, ValueError):
+        return None
+
+
+def extract_shopify_product_json(soup):
+    """
+    Decode the page's Shopify product data once, in a single pass over <script> tags:
+    the theme's ProductJson script (variants with availability) or, failing that,
+    ShopifyAnalytics `var meta = {...}` (variants without availability), plus Shopify.currency.
+    Returns {"variants": [{"price_minor", "available", "options", "sku", "title"}], "options": [...],
+    "currency": "EUR" or None, "images": [...]}; "variants" is empty when the page has neither.
+    "images" is the ProductJson gallery (media/images) or else the JSON-LD Product image, unnormalized.
+    """
+    product = None
+    meta_product = None
+    currency = None
+    ld_images = None
+    for script in soup.find_all('script'):
+        text = script.string
+        if not text:
+            continue
+        script_type = (script.get('type') or '').lower()
+        if script_type == 'application/json':
+            script_id = script.get('id') or ''
+            if product is None and (script_id.startswith('ProductJson') or script.has_attr('data-product-json')):
+                try:
+                    data = json.loads(text)
+                except ValueError:
+                    continue
+                if isinstance(data, dict) and isinstance(data.get('variants'), list):
+                    product = data
+            continue
+        if script_type == 'application/ld+json':
+            if ld_images is None:
+                ld_images = _json_ld_product_images(text)
+            continue
+        if currency is None and 'Shopify.currency' in text:
+            m = _SHOPIFY_CURRENCY_RE.search(text)
+            if m:
+                currency = m.group(1)
+        if meta_product is None and 'meta' in text:
+            m = _SHOPIFY_META_RE.search(text)
+            if m:
+                try:
+                    meta, _ = _JSON_DECODER.raw_decode(text, m.end())
+                except ValueError:
+                    meta = None
+                if isinstance(meta, dict) and isinstance(meta.get('product'), dict):
+                    meta_product = meta['product']
+                    if currency is None and isinstance(meta.get('currency'), str):
+                        currency = meta['currency'].upper()[:3]
+
+    source = product or meta_product or {}
+    options = [o.get('name') if isinstance(o, dict) else o for o in (source.get('options') or [])]
+    variants = []
+    for v in source.get('variants') or []:
+        if not isinstance(v, dict):
+            continue
+        values = [v[k] for k in ('option1', 'option2', 'option3') if isinstance(v.get(k), str)]
+        if not values and isinstance(v.get('public_title'), str):
+            values = [part.strip() for part in v['public_title'].split(' / ')]
+        variants.append({
+            'price_minor': _price_minor_units(v.get('price')),
+            'available': v['available'] if isinstance(v.get('available'), bool) else None,
+            'options': values,
+            'sku': v.get('sku') or None,
+            'title': v.get('title') or v.get('public_title'),
+        })
+    return {
+        'variants': variants, 'options': [o for o in options if isinstance(o, str)], 'currency': currency,
+        'images': _product_json_images(product) or ld_images or [],
+    }
+
+
+def _image_src(item):
+    """'//cdn/x.jpg' or {'src': ...} / {'url': ...} -> URL string (None otherwise)."""
+    if isinstance(item, dict):
+        item = item.get('src') or item.get('url')
+    return item if isinstance(item, str) and item.strip() else None
+
+
+def _product_json_images(product):
+    """Gallery from a ProductJson blob: featured image, then image media (or the images list), in order."""
+    if not product:
+        return []
+    media = [m for m in product.get('media') or [] if isinstance(m, dict) and m.get('media_type', 'image') == 'image']
+    items = [product.get('featured_image')] + (media or list(product.get('images') or []))
+    return [src for src in map(_image_src, items) if src]
+
+
+def _json_ld_product_images(text):
+    """`image` of the JSON-LD Product in one ld+json script (None if the script has no Product)."""
+    try:
+        data = json.loads(text)
+    except ValueError:
+        return None
+    nodes = data if isinstance(data, list) else (data.get('@graph') or [data]) if isinstance(data, dict) else []
+    for node in nodes:
+        if isinstance(node, dict) and node.get('@type') == 'Product':
+            image = node.get('image')
+            items = image if isinstance(image, list) else [image]
+            return [src for src in map(_image_src, items) if src]
+    return None
+
+
+PRICE_CLASSES = frozenset({'price', 'product-price', 'current-price', 'money'})
+
+
+def _is_price_element(tag):
+    """Same match as the CSS '.price, .product-price, [data-price], .current-price, .money' without soupsieve."""
+    return 'data-price' in tag.attrs or not PRICE_CLASSES.isdisjoint(tag.get('class') or ())
+
+
+def extract_prices_with_currencies(soup, product_json=None):
     """
     Extract one price per currency from product page. Returns "20USD, 5EUR" or None.
     Normalizes cents to dollars for USD/EUR/GBP. Ensures at least USD or EUR.
+    Pass `product_json` (extract_shopify_product_json) to avoid decoding it again.
     """
-    import json
     by_currency = {}
 
     def add(val, c):
@@ -107,11 +305,11 @@ def extract_prices_with_currencies(soup):
             pass
 
     # 2) Visible price elements (display prices)
-    for elem in soup.select('.price, .product-price, [data-price], .current-price, .money'):
+    for elem in soup.find_all(_is_price_element):
         text = (elem.get_text() or '').strip()
         if not text or len(text) > 50:
             continue
-        for m in re.finditer(r'(\d+(?:[.,]\d{1,2})?)\s*([A-Z]{3})?', text):
+        for m in _PRICE_TEXT_RE.finditer(text):
             try:
                 val = float(m.group(1).replace(',', '.'))
             except ValueError:
@@ -123,26 +321,35 @@ def extract_prices_with_currencies(soup):
                 add(val, c)
             break  # one price per element
 
-    # 3) Scripts: Shopify variant price (often in cents) - only fill if we don't have that currency yet
-    for script in soup.find_all('script', string=re.compile(r'price|variant|money_format')):
-        s = script.string or ''
-        for m in re.finditer(r'"price"\s*:\s*["\']?(\d+(?:\.\d*)?)', s):
-            try:
-                raw = float(m.group(1))
-                c = 'USD'
-                if 'EUR' in s or '€' in s:
-                    c = 'EUR'
-                elif 'GBP' in s or '£' in s:
-                    c = 'GBP'
-                elif 'CZK' in s or 'Kč' in s:
-                    c = 'CZK'
-                elif 'PLN' in s or 'zł' in s:
-                    c = 'PLN'
-                if c not in by_currency:
-                    add(raw, c)
-            except (ValueError, IndexError):
-                pass
-        break  # one script pass
+    # 3) Shopify variant price (cents) - only fill if we don't have that currency yet
+    if product_json is None:
+        product_json = extract_shopify_product_json(soup)
+    variant_price = next((v['price_minor'] for v in product_json['variants'] if v['price_minor'] is not None), None)
+    if variant_price is not None:
+        c = product_json['currency'] or 'USD'
+        if c not in by_currency:
+            by_currency[c] = round(variant_price / 100.0, 2)
+    else:
+        # No product JSON: first "price" in the first script mentioning prices/variants
+        for script in soup.find_all('script', string=_PRICE_SCRIPT_HINT_RE):
+            s = script.string or ''
+            for m in _SCRIPT_PRICE_RE.finditer(s):
+                try:
+                    raw = float(m.group(1))
+                    c = 'USD'
+                    if 'EUR' in s or '€' in s:
+                        c = 'EUR'
+                    elif 'GBP' in s or '£' in s:
+                        c = 'GBP'
+                    elif 'CZK' in s or 'Kč' in s:
+                        c = 'CZK'
+                    elif 'PLN' in s or 'zł' in s:
+                        c = 'PLN'
+                    if c not in by_currency:
+                        add(raw, c)
+                except (ValueError, IndexError):
+                    pass
+            break  # one script pass
 
     if not by_currency:
         return None
@@ -160,8 +367,16 @@ def extract_prices_with_currencies(soup):
     parts = [f"{int(v) if v == int(v) else v}{c}" for c, v in sorted(by_currency.items())]
     return ", ".join(parts)
 
-def extract_sizes(soup):
-    """Extract available sizes from product page"""
+def _size_option_index(option_names):
+    """Index of the size option in the product's option names; None when names are unknown."""
+    for i, name in enumerate(option_names or []):
+        if name.strip().lower() in SIZE_OPTION_NAMES:
+            return i
+    return None
+
+
+def extract_sizes(soup, product_json=None):
+    """Extract available sizes from product page (order of appearance, deduplicated)"""
     sizes = []
 
     # Look for size options in various formats
@@ -179,76 +394,199 @@ def extract_sizes(soup):
         if button.get('value'):
             sizes.append(button.get('value'))
 
-    # Look for size labels in variant data
-    variant_script = soup.find('script', string=re.compile('variant'))
-    if variant_script:
-        variants_match = re.search(r'variants\s*:\s*\[(.*?)\]', variant_script.string, re.DOTALL)
-        if variants_match:
-            variants_text = variants_match.group(1)
-            size_matches = re.findall(r'"option(\d+)"\s*:\s*"([^"]*)"', variants_text)
-            for _, size in size_matches:
+    # Variant option values: from the decoded product JSON, else regex over the variants script
+    if product_json is None:
+        product_json = extract_shopify_product_json(soup)
+    if product_json['variants']:
+        option_names = product_json['options']
+        idx = _size_option_index(option_names)
+        for variant in product_json['variants']:
+            values = variant['options']
+            if idx is not None:
+                values = values[idx:idx + 1]
+            elif option_names:
+                values = []  # options are named and none is a size (e.g. only Color)
+            for size in values:
                 if size and size.lower() != 'default title':
                     sizes.append(size)
+    else:
+        variant_script = soup.find('script', string=_VARIANT_HINT_RE)
+        if variant_script:
+            variants_match = _VARIANTS_JS_RE.search(variant_script.string)
+            if variants_match:
+                variants_text = variants_match.group(1)
+                size_matches = _VARIANT_OPTION_RE.findall(variants_text)
+                for _, size in size_matches:
+                    if size and size.lower() != 'default title':
+                        sizes.append(size)
+
+    return list(dict.fromkeys(sizes))  # Remove duplicates
+
+def build_variant_table(product_json):
+    """
+    Compact per-variant rows from extract_shopify_product_json, in the store's variant order:
+    {"sku", "options": {name: value}, "size", "price_minor", "currency", "available"} (None fields omitted).
+    `size` is the Size option's value; with unnamed options it is the value only for single-option products.
+    """
+    option_names = product_json.get('options') or []
+    size_idx = _size_option_index(option_names)
+    rows = []
+    for v in product_json.get('variants') or []:
+        values = v['options']
+        names = option_names if len(option_names) == len(values) else [f'option{i + 1}' for i in range(len(values))]
+        if size_idx is not None and size_idx < len(values):
+            size = values[size_idx]
+        elif not option_names and len(values) == 1:
+            size = values[0]
+        else:
+            size = None
+        if size and size.lower() == 'default title':
+            size = None
+        row = {
+            'sku': v['sku'],
+            'options': dict(zip(names, values)),
+            'size': size,
+            'price_minor': v['price_minor'],
+            'currency': product_json.get('currency'),
+            'available': v['available'],
+        }
+        rows.append({k: val for k, val in row.items() if val is not None and val != {}})
+    return rows
+
+
+def variant_sizes(variants):
+    """Distinct sizes in variant order."""
+    return list(dict.fromkeys(v['size'] for v in variants if v.get('size')))
+
+
+def variant_sizes_in_stock(variants):
+    """Sizes with at least one available variant; None when availability is unknown."""
+    if not any('available' in v for v in variants):
+        return None
+    return list(dict.fromkeys(v['size'] for v in variants if v.get('size') and v.get('available')))
+
+
+def variant_in_stock(variants):
+    """Any variant available; None when the table carries no availability."""
+    known = [v['available'] for v in variants if 'available' in v]
+    return any(known) if known else None
 
-    return list(set(sizes))  # Remove duplicates
 
 def normalize_category_display(name):
     """Turn 'Sweaters & Hoodies' into 'Sweaters, Hoodies' (comma-separated, no ' & ')."""
     if not name or not name.strip():
         return None
     s = name.strip().replace(" & ", ", ").replace(" and ", ", ")
-    s = re.sub(r',\s*,', ',', s).strip(' ,')
+    s = _DOUBLE_COMMA_RE.sub(',', s).strip(' ,')
     return s if s else None
 
 
+class KeywordClassifier:
+    """
+    Substring keyword -> label matcher compiled once into a prefix trie (as a regex, so matching runs in C).
+    A text's label is the first label, in mapping order, with any keyword occurring in it - the same
+    answer as `for label, kws in mapping.items(): if any(kw in text for kw in kws)`, in one scan.
+    """
+
+    def __init__(self, mapping):
+        self.labels = list(mapping)
+        rank = {}
+        for i, keywords in enumerate(mapping.values()):
+            for kw in keywords:
+                kw = kw.lower()
+                if kw and '\n' not in kw:
+                    rank[kw] = min(rank.get(kw, i), i)
+        # The trie returns the longest keyword starting at each position; every shorter keyword
+        # matching there is a prefix of it, so fold the best rank over each keyword's prefixes.
+        self._best = {kw: min(r for k, r in rank.items() if kw.startswith(k)) for kw in rank}
+        self._pattern = re.compile(f"(?=({self._trie_regex(sorted(rank))}))") if rank else None
+
+    @classmethod
+    def _trie_regex(cls, words):
+        trie = {}
+        for w in words:
+            node = trie
+            for ch in w:
+                node = node.setdefault(ch, {})
+            node[''] = True
+        return cls._node_regex(trie)
+
+    @classmethod
+    def _node_regex(cls, node):
+        terminal = '' in node
+        branches = [re.escape(ch) + cls._node_regex(child) for ch, child in sorted(node.items()) if ch]
+        if not branches:
+            return ''
+        body = branches[0] if len(branches) == 1 else '(?:' + '|'.join(branches) + ')'
+        if terminal:
+            return f'(?:{body})?' if len(branches) == 1 else body + '?'  # greedy: prefer the longer keyword
+        return body
+
+    def classify_many(self, texts):
+        """Label (or None) for each text, from a single scan over all of them."""
+        lowered = [(t or '').lower().strip() for t in texts]
+        best = [None] * len(lowered)
+        if self._pattern is None or not lowered:
+            return best
+        starts = []
+        offset = 0
+        for t in lowered:
+            starts.append(offset)
+            offset += len(t) + 1
+        for m in self._pattern.finditer('\n'.join(lowered)):
+            i = bisect.bisect_right(starts, m.start()) - 1
+            r = self._best[m.group(1)]
+            if best[i] is None or r < best[i]:
+                best[i] = r
+        return [self.labels[r] if r is not None else None for r in best]
+
+    def classify(self, text):
+        return self.classify_many([text])[0]
+
+
+CATEGORY_CLASSIFIER = KeywordClassifier(CATEGORY_MAPPING)
+TITLE_CATEGORY_CLASSIFIER = KeywordClassifier({
+    'accessories': ['hat', 'cap', 'beanie', 'scarf', 'belt', 'bag', 'wallet'],
+    'clothes': ['t-shirt', 'hoodie', 'sweatshirt', 'jacket', 'coat', 'pants', 'jeans', 'shirt', 'vest', 'knitwear'],
+})
+
+
 def map_raw_categories_to_canonical(raw_names):
     """
     Map raw category/collection names to canonical: clothes, footwear, accessories.
     Returns comma-separated string e.g. "clothes" or "clothes, accessories".
     """
-    from config import CATEGORY_MAPPING
-    canonical = set()
-    for raw in raw_names:
-        if not raw or not raw.strip():
-            continue
-        lower = raw.lower().strip()
-        for canonical_name, keywords in CATEGORY_MAPPING.items():
-            if any(kw in lower for kw in keywords):
-                canonical.add(canonical_name)
-                break
+    names = [raw for raw in raw_names if raw and raw.strip()]
+    canonical = {label for label in CATEGORY_CLASSIFIER.classify_many(names) if label}
     if not canonical:
         return None
     return ", ".join(sorted(canonical))
 
 
-def extract_categories_from_page(soup, base_url):
-    """
-    Extract category from product page and map to canonical: clothes, footwear, accessories.
-    Returns comma-separated canonical string e.g. "clothes" or "clothes, accessories".
-    """
+def _collection_link_name(m):
+    """_COLLECTION_HANDLE_RE match for '/collections/hoodies-sweats' -> 'hoodies sweats'."""
     from urllib.parse import unquote
-    import json
-    raw_names = []
-    seen = set()
+    if not m:
+        return None
+    return unquote(m.group(1)).replace('-', ' ').strip() or None
 
-    # 1) Links to /collections/xxx
-    for a in soup.find_all('a', href=re.compile(r'/collections/[\w\-]+')):
-        href = a.get('href') or ''
-        m = re.search(r'/collections/([^/?#]+)', href)
-        if m:
-            raw = unquote(m.group(1)).replace('-', ' ').strip()
-            if raw and raw.lower() not in seen:
-                seen.add(raw.lower())
-                raw_names.append(raw)
-            norm = normalize_category_display(raw)
-            if norm:
-                for part in [p.strip() for p in norm.split(',') if p.strip()]:
-                    if part.lower() not in seen:
-                        seen.add(part.lower())
-                        raw_names.append(part)
 
-    # 2) JSON-LD breadcrumb / product category
-    for script in soup.find_all('script', type='application/ld+json'):
+def _add_category_name(raw, seen, raw_names):
+    """Append a collection name and its ' & '-split parts, skipping names already seen."""
+    if raw.lower() not in seen:
+        seen.add(raw.lower())
+        raw_names.append(raw)
+    norm = normalize_category_display(raw)
+    if norm:
+        for part in [p.strip() for p in norm.split(',') if p.strip()]:
+            if part.lower() not in seen:
+                seen.add(part.lower())
+                raw_names.append(part)
+
+
+def _add_json_ld_category_names(scripts, seen, raw_names):
+    """JSON-LD BreadcrumbList item names and Product category(ies)."""
+    for script in scripts:
         try:
             data = json.loads(script.string or '{}')
             if isinstance(data, dict) and data.get('@type') == 'BreadcrumbList':
@@ -265,22 +603,93 @@ def extract_categories_from_page(soup, base_url):
         except (json.JSONDecodeError, TypeError):
             pass
 
+
+PAGE_CHROME_TAGS = frozenset({'header', 'footer', 'nav', 'aside'})
+
+
+def _is_breadcrumb(tag):
+    label = ' '.join(tag.get('class') or []) + ' ' + (tag.get('aria-label') or '')
+    return 'breadcrumb' in label.lower()
+
+
+def _link_region(a):
+    """'breadcrumb', 'chrome' (header/footer/menu) or None (product section) for a link or image."""
+    for parent in a.parents:
+        if _is_breadcrumb(parent):
+            return 'breadcrumb'
+        if parent.name in PAGE_CHROME_TAGS:
+            return 'chrome'
+    return None
+
+
+class CollectionNavIndex:
+    """
+    Collection handles that appear on most collection listing pages (mega-menu, footer, filters).
+    Learned during discovery; product-scoped category extraction skips these links without
+    walking their ancestors, unless they sit inside the product's breadcrumb.
+    """
+
+    def __init__(self, min_share=0.5):
+        self.min_share = min_share
+        self.pages = 0
+        self.handles = frozenset()
+        self._counts = {}
+
+    def add_page(self, soup):
+        handles = set()
+        for a in soup.find_all('a', href=_COLLECTION_HREF_RE):
+            m = _COLLECTION_HANDLE_RE.search(a.get('href') or '')
+            if m:
+                handles.add(m.group(1).lower())
+        self.pages += 1
+        for h in handles:
+            self._counts[h] = self._counts.get(h, 0) + 1
+        need = self.pages * self.min_share
+        self.handles = frozenset(h for h, n in self._counts.items() if n >= need)
+
+
+def extract_categories_from_page(soup, base_url, scoped=False, nav_handles=frozenset()):
+    """
+    Extract category from product page and map to canonical: clothes, footwear, accessories.
+    Returns comma-separated canonical string e.g. "clothes" or "clothes, accessories".
+    Default: every /collections/ link on the page plus JSON-LD. scoped=True keeps only the
+    product's own candidates - JSON-LD, breadcrumb links and product-section links - dropping
+    header/footer/menu links and any handle in nav_handles (see CollectionNavIndex).
+    """
+    raw_names = []
+    seen = set()
+    links = []
+    ld_scripts = []
+    # One tree walk for both candidate sources (each find_all is a full pass over the page)
+    for tag in soup.find_all(['a', 'script']):
+        if tag.name == 'a':
+            href = tag.get('href')
+            if href and _COLLECTION_HREF_RE.search(href):
+                links.append(tag)
+        elif tag.get('type') == 'application/ld+json':
+            ld_scripts.append(tag)
+
+    # 1) Links to /collections/xxx
+    for a in links:
+        m = _COLLECTION_HANDLE_RE.search(a.get('href') or '')
+        raw = _collection_link_name(m)
+        if not raw:
+            continue
+        if scoped:
+            region = _link_region(a)
+            if region == 'chrome' or (region is None and m.group(1).lower() in nav_handles):
+                continue
+        _add_category_name(raw, seen, raw_names)
+
+    # 2) JSON-LD breadcrumb / product category
+    _add_json_ld_category_names(ld_scripts, seen, raw_names)
+
     return map_raw_categories_to_canonical(raw_names)
 
 
 def determine_category(collection_name, product_title):
     """Fallback: determine category from collection/title when page extraction has nothing."""
-    from config import CATEGORY_MAPPING
-    collection_lower = collection_name.lower() if collection_name else ""
-    title_lower = product_title.lower() if product_title else ""
-    for category, keywords in CATEGORY_MAPPING.items():
-        if any(keyword in collection_lower for keyword in keywords):
-            return category
-    if any(word in title_lower for word in ['hat', 'cap', 'beanie', 'scarf', 'belt', 'bag', 'wallet']):
-        return 'accessories'
-    if any(word in title_lower for word in ['t-shirt', 'hoodie', 'sweatshirt', 'jacket', 'coat', 'pants', 'jeans', 'shirt', 'vest', 'knitwear']):
-        return 'clothes'
-    return None
+    return CATEGORY_CLASSIFIER.classify(collection_name) or TITLE_CATEGORY_CLASSIFIER.classify(product_title)
 
 def determine_gender(category):
     """Determine gender based on category"""
@@ -308,12 +717,14 @@ def sync_fetch_url(url, timeout=30):
         print(f"Error fetching {url}: {e}")
         return None
 
-def setup_session():
+def setup_session(limit=MAX_CONCURRENT_REQUESTS, limit_per_host=0):
     """Setup aiohttp session with proper headers"""
     ua = UserAgent()
     headers = HEADERS.copy()
     headers['User-Agent'] = ua.random
-    return aiohttp.ClientSession(headers=headers, connector=aiohttp.TCPConnector(limit=MAX_CONCURRENT_REQUESTS))
+    return aiohttp.ClientSession(
+        headers=headers, connector=aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host),
+    )
 
 def _normalize_image_src(src, base_url=BASE_URL):
     """Normalize image src to full URL."""
@@ -328,54 +739,87 @@ def _normalize_image_src(src, base_url=BASE_URL):
     return src
 
 
-def get_all_product_image_urls(soup, base_url=BASE_URL):
+IMAGE_SKIP_WORDS = ('icon', 'logo', 'social', 'favicon', 'menu')
+IMAGE_ALT_SKIP_WORDS = ('logo', 'icon', 'social', 'menu', 'search')
+# Query params the Shopify CDN uses for resizing/cache busting, not identity
+IMAGE_CDN_VOLATILE_PARAMS = frozenset({'v', 'width', 'height', 'crop'})
+
+
+def normalize_image_url(src, base_url=BASE_URL):
     """
-    Extract all product image URLs. First item is the main image, rest are additional.
-    Returns list of full URLs, deduplicated, main first.
+    Full, canonical image URL. For Shopify CDN images the resize/cache-busting params and
+    filename size suffix are dropped ('...item_600x.jpg?v=17&width=360' -> '...item.jpg'), so the
+    same image keeps the same URL across runs and themes.
     """
-    all_imgs = soup.find_all('img')
-    seen = set()
-    ordered_urls = []  # (order_index, url) for stable ordering
-    product_cdn_urls = []  # cdn/shop/files URLs in order
+    url = _normalize_image_src(src.strip() if src else src, base_url)
+    if not url:
+        return None
+    parts = urlsplit(url)
+    if '/cdn/shop/' not in parts.path and 'cdn.shopify.com' not in parts.netloc:
+        return url
+    path = _SHOPIFY_SIZE_SUFFIX_RE.sub('', parts.path)
+    query = '&'.join(
+        kv for kv in parts.query.split('&') if kv and kv.split('=', 1)[0] not in IMAGE_CDN_VOLATILE_PARAMS
+    )
+    return urlunsplit((parts.scheme, parts.netloc, path, query, ''))
+
+
+def _largest_srcset_candidate(srcset):
+    """URL with the largest width (or density) descriptor in a srcset."""
+    best, best_size = None, -1.0
+    for candidate in (srcset or '').split(','):
+        fields = candidate.split()
+        if not fields:
+            continue
+        size = 0.0
+        if len(fields) > 1 and fields[1][:-1].replace('.', '', 1).isdigit():
+            size = float(fields[1][:-1])
+        if size > best_size:
+            best, best_size = fields[0], size
+    return best
 
-    for idx, img in enumerate(all_imgs):
+
+def _dom_product_image_urls(soup, base_url):
+    """Fallback without structured data: one pass over <img>, skipping header/footer/menu images."""
+    seen = set()
+    cdn_urls = []
+    other_urls = []
+    main_url = None
+    for img in soup.find_all('img'):
         src = img.get('src') or img.get('data-src') or img.get('data-lazy-src')
-        if not src or any(word in src.lower() for word in ['icon', 'logo', 'social', 'favicon', 'menu']):
+        if not src or src.startswith('data:'):
+            src = _largest_srcset_candidate(img.get('srcset') or img.get('data-srcset'))
+        if not src or any(word in src.lower() for word in IMAGE_SKIP_WORDS):
             continue
-        url = _normalize_image_src(src, base_url)
-        if not url or url in seen:
+        url = normalize_image_url(src, base_url)
+        if not url or url in seen or _link_region(img) == 'chrome':
             continue
         seen.add(url)
-        if 'cdn/shop/files' in src:
-            product_cdn_urls.append((idx, url))
-        ordered_urls.append((idx, url))
+        (cdn_urls if 'cdn/shop/files' in url else other_urls).append(url)
+        # Main image: first one with a descriptive alt
+        alt = (img.get('alt') or '').lower()
+        if main_url is None and len(alt) > 3 and not any(g in alt for g in IMAGE_ALT_SKIP_WORDS):
+            main_url = url
 
     # Prefer product CDN images as product gallery
-    candidate_list = product_cdn_urls if product_cdn_urls else ordered_urls
-    if not candidate_list:
+    candidates = cdn_urls or other_urls
+    if not candidates:
         return []
+    main_url = main_url or candidates[0]
+    return [main_url] + [url for url in candidates if url != main_url]
 
-    # Main image: first one with good alt, or first CDN, or first any
-    main_url = None
-    for img in all_imgs:
-        src = img.get('src') or img.get('data-src') or img.get('data-lazy-src')
-        alt = img.get('alt', '').lower()
-        if src and alt and len(alt) > 3 and not any(g in alt for g in ['logo', 'icon', 'social', 'menu', 'search']):
-            url = _normalize_image_src(src, base_url)
-            if url and url in seen:
-                main_url = url
-                break
-    if not main_url and product_cdn_urls:
-        main_url = product_cdn_urls[0][1]
-    if not main_url and ordered_urls:
-        main_url = ordered_urls[0][1]
-
-    # Build result: main first, then rest in order of appearance
-    result = [main_url] if main_url else []
-    for _, url in sorted(candidate_list, key=lambda x: x[0]):
-        if url != main_url:
-            result.append(url)
-    return result
+
+def get_all_product_image_urls(soup, base_url=BASE_URL, product_json=None):
+    """
+    Extract all product image URLs. First item is the main image, rest are additional.
+    Returns list of canonical full URLs (see normalize_image_url), deduplicated, main first.
+    Uses the product JSON / JSON-LD gallery when the page has one, else scans <img> tags.
+    """
+    images = (product_json or {}).get('images')
+    if images is None:
+        images = extract_shopify_product_json(soup)['images']
+    urls = list(dict.fromkeys(url for url in (normalize_image_url(src, base_url) for src in images) if url))
+    return urls or _dom_product_image_urls(soup, base_url)
 
 
 def get_image_url(soup, base_url=BASE_URL):
@@ -383,7 +827,7 @@ def get_image_url(soup, base_url=BASE_URL):
     urls = get_all_product_image_urls(soup, base_url)
     return urls[0] if urls else None
 
-def is_in_stock(soup):
+def is_in_stock(soup, product_json=None):
     """Check if product is in stock - prioritize UI elements over script data"""
     # Check for out of stock indicators
     out_of_stock_indicators = [
@@ -402,7 +846,7 @@ def is_in_stock(soup):
             return False
 
     # PRIORITY 1: Check for functional add to cart button (most user-facing indicator)
-    add_to_cart_buttons = soup.find_all('button', string=re.compile('add to cart|add to bag|buy now|shop now', re.I))
+    add_to_cart_buttons = soup.find_all('button', string=_ADD_TO_CART_RE)
     for button in add_to_cart_buttons:
         if button.get('disabled') is None:
             # Check if button has proper styling/classes that indicate it's active
@@ -411,7 +855,7 @@ def is_in_stock(soup):
                 return True
 
     # PRIORITY 2: Check for add to cart form (Shopify pattern)
-    cart_form = soup.find('form', {'action': re.compile('/cart/add')})
+    cart_form = soup.find('form', {'action': _CART_ADD_ACTION_RE})
     if cart_form:
         # Make sure form isn't hidden or disabled
         if cart_form.get('style') != 'display: none' and not cart_form.get('disabled'):
@@ -431,18 +875,25 @@ def is_in_stock(soup):
         if not select_element.get('disabled'):
             return True
 
-    # PRIORITY 5: Check variant availability in scripts (less reliable, often wrong)
-    variant_scripts = soup.find_all('script', string=re.compile('available'))
-    for script in variant_scripts:
-        if '"available":true' in script.string:
+    # PRIORITY 5: Check variant availability (product JSON, else raw script text; less reliable)
+    if product_json is None:
+        product_json = extract_shopify_product_json(soup)
+    known = [v['available'] for v in product_json['variants'] if v['available'] is not None]
+    if known:
+        if any(known):
             return True
-        # If we find explicit "available":false, it might override UI elements
-        elif '"available":false' in script.string:
-            # But only if ALL variants are unavailable
-            continue
+    else:
+        variant_scripts = soup.find_all('script', string=_AVAILABLE_HINT_RE)
+        for script in variant_scripts:
+            if '"available":true' in script.string:
+                return True
+            # If we find explicit "available":false, it might override UI elements
+            elif '"available":false' in script.string:
+                # But only if ALL variants are unavailable
+                continue
 
     # PRIORITY 6: Look for any product-related interactive elements
-    product_forms = soup.find_all('form', class_=re.compile('product|add-to-cart'))
+    product_forms = soup.find_all('form', class_=_PRODUCT_FORM_CLASS_RE)
     for form in product_forms:
         if not form.get('disabled') and form.get('style') != 'display: none':
             return True
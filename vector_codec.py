@@ -0,0 +1,132 @@
+"""
+Embedding vector precision (EMBEDDING_PRECISION). At "float32" (the default), vectors are lists
+of floats, as they always were. At "float16" or "bfloat16", they stay 2-byte NumPy arrays end
+to end: in the in-flight product rows, in the local SQLite products table and vector caches
+(tagged blobs), and on the wire to PostgREST (pgvector text with only the digits half precision
+carries). bfloat16 arrays need ml_dtypes, because NumPy has no bfloat16; without it, float16 is
+used. Stored vectors of any precision read back in the run's precision.
+"""
+import json
+import logging
+from typing import Any, Optional
+
+import numpy as np
+
+from config import EMBEDDING_PRECISION
+
+try:
+    import ml_dtypes
+except ImportError:  # optional: only needed for bfloat16 arrays
+    ml_dtypes = None
+
+logger = logging.getLogger(__name__)
+
+# Half-precision blobs are one tag byte plus 2 bytes per dimension. The odd length keeps them
+# apart from the raw float32 blobs (4 bytes per dimension) written at float32 or before this.
+_BLOB_TAGS = {"float16": 1, "bfloat16": 2}
+# Significant digits that read back as the same half-precision value
+_TEXT_DIGITS = {"float16": 5, "bfloat16": 4}
+
+
+def _resolve_dtype(precision: str) -> np.dtype:
+    if precision == "float16":
+        return np.dtype(np.float16)
+    if precision == "bfloat16":
+        if ml_dtypes is not None:
+            return np.dtype(ml_dtypes.bfloat16)
+        logger.warning("EMBEDDING_PRECISION=bfloat16 needs ml_dtypes (pip install ml-dtypes); using float16")
+        return np.dtype(np.float16)
+    if precision != "float32":
+        logger.warning(f"Unknown EMBEDDING_PRECISION {precision!r}; using float32")
+    return np.dtype(np.float32)
+
+
+VECTOR_DTYPE = _resolve_dtype(EMBEDDING_PRECISION)
+HALF_PRECISION = VECTOR_DTYPE.itemsize == 2
+
+
+def bfloat16_bits(values: Any) -> np.ndarray:
+    """float32 values -> bfloat16 bit patterns (uint16), rounded to nearest even."""
+    u = np.ascontiguousarray(values, dtype=np.float32).view(np.uint32)
+    return ((u + 0x7FFF + ((u >> 16) & 1)) >> 16).astype(np.uint16)
+
+
+def bfloat16_to_float32(bits: np.ndarray) -> np.ndarray:
+    return (np.asarray(bits, dtype=np.uint16).astype(np.uint32) << 16).view(np.float32)
+
+
+def round_trip(values: Any, precision: str) -> np.ndarray:
+    """float32 values as they read back after being stored at `precision`."""
+    a = np.asarray(values, dtype=np.float32)
+    if precision == "float16":
+        return a.astype(np.float16).astype(np.float32)
+    if precision == "bfloat16":
+        return bfloat16_to_float32(bfloat16_bits(a))
+    return a
+
+
+def as_vector(value: Any) -> Optional[np.ndarray]:
+    """Stored vector (list, array, or pgvector text from Supabase) as float32."""
+    if value is None:
+        return None
+    return np.asarray(json.loads(value) if isinstance(value, str) else value, dtype=np.float32)
+
+
+def to_vector(value: Any) -> Any:
+    """
+    A vector in the run's precision: a VECTOR_DTYPE array in half precision. At float32, lists
+    and pgvector text pass through unchanged and arrays become lists.
+    """
+    if value is None:
+        return None
+    if not HALF_PRECISION:
+        return value.tolist() if isinstance(value, np.ndarray) else value
+    if isinstance(value, np.ndarray) and value.dtype == VECTOR_DTYPE:
+        return value
+    return as_vector(value).astype(VECTOR_DTYPE)
+
+
+def vector_to_blob(value: Any) -> Optional[bytes]:
+    """Vector -> SQLite blob: raw float32 at float32, tag byte + 2-byte values in half precision."""
+    if value is None:
+        return None
+    if not HALF_PRECISION:
+        return as_vector(value).tobytes()
+    return bytes([_BLOB_TAGS[VECTOR_DTYPE.name]]) + to_vector(value).tobytes()
+
+
+def blob_to_vector(blob: Optional[bytes]) -> Any:
+    """SQLite blob of any precision -> vector in the run's precision."""
+    if blob is None:
+        return None
+    if len(blob) % 2 == 0:
+        return to_vector(np.frombuffer(blob, dtype=np.float32))
+    tag, data = blob[0], blob[1:]
+    if HALF_PRECISION and tag == _BLOB_TAGS[VECTOR_DTYPE.name]:
+        return np.frombuffer(data, dtype=VECTOR_DTYPE)
+    bits = np.frombuffer(data, dtype=np.uint16)
+    return to_vector(bits.view(np.float16) if tag == _BLOB_TAGS["float16"] else bfloat16_to_float32(bits))
+
+
+def vector_text(values: Any, precision: str) -> str:
+    """pgvector text of values stored at a half `precision`, e.g. "[0.012344,-0.5]"."""
+    fmt = f"%.{_TEXT_DIGITS[precision]}g"
+    return "[" + ",".join(fmt % x for x in np.asarray(values, dtype=np.float32).tolist()) + "]"
+
+
+def format_vector(value: Any) -> Any:
+    """JSON value of a vector: half-precision arrays as compact pgvector text, anything else as is."""
+    if not isinstance(value, np.ndarray):
+        return value
+    if value.dtype.name not in _TEXT_DIGITS:
+        return value.tolist()
+    return vector_text(value, value.dtype.name)
+
+
+def json_default(value: Any) -> Any:
+    """json.dumps(default=...) for rows holding vector arrays."""
+    if isinstance(value, np.ndarray):
+        return format_vector(value)
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError(f"Object of type {type(value).__name__} is not JSON serializable")